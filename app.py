@@ -1,23 +1,30 @@
 from typing import Optional, Callable, Any, Dict, Type
 from flask import Flask, request, render_template, session, jsonify
+from flask.cli import FlaskGroup
 from flask_migrate import Migrate
 from flask_login import LoginManager, current_user
 from flask_babel import Babel
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
-from flask_caching import Cache
 from flask_cors import CORS
 from config import BaseConfig, Config, redis_client
-from models import db, User, Post
+from models import db
 from filters import init_app as init_filters
 from celery_config import make_celery
 from utils.socket import init_socketio, socketio
+from utils.cache import cache, init_cache
+from utils.stats import get_site_stats, record_activity
+from utils.principal import UserPrincipal, load_user_principal
+from utils.db_routing import configure_replicas, replica_status
+from utils.db_pool import configure_pool, pool_status
+import click
 import logging
+import sys
 from logging.handlers import RotatingFileHandler
 import os
 from pathlib import Path
 from functools import wraps
-from datetime import datetime, timedelta
+from datetime import datetime
 from sqlalchemy import text
 
 # Инициализация расширений
@@ -32,11 +39,6 @@ limiter = Limiter(
     headers_enabled=Config.RATELIMIT_HEADERS_ENABLED
 )
 celery = None
-cache = Cache(config={
-    'CACHE_TYPE': 'redis',
-    'CACHE_REDIS_URL': Config.REDIS_URL,
-    'CACHE_DEFAULT_TIMEOUT': 300
-})
 socketio = None  # Инициализируем как None, будет установлено позже
 
 def setup_logging(app: Flask) -> None:
@@ -137,7 +139,9 @@ def init_extensions(app: Flask) -> None:
                 response.headers[header] = value
             return response
         
-        # Инициализация базы данных
+        # Инициализация базы данных, пула по профилю процесса и реплик для чтения
+        configure_pool(app)
+        configure_replicas(app)
         db.init_app(app)
         migrate.init_app(app, db)
         
@@ -158,7 +162,7 @@ def init_extensions(app: Flask) -> None:
         limiter.storage_uri = app.config['REDIS_URL']
         
         # Инициализация кэширования
-        cache.init_app(app)
+        init_cache(app)
         
         # Инициализация Celery
         app.celery = make_celery(app)
@@ -171,12 +175,14 @@ def init_extensions(app: Flask) -> None:
         app.logger.error(f'Error initializing extensions: {str(e)}')
         raise
 
-def create_app(config_class: Type[BaseConfig] = Config) -> Flask:
+def create_app(config_class: Type[BaseConfig] = Config, pool_profile: Optional[str] = None) -> Flask:
     """
     Создание и настройка приложения Flask.
     
     Args:
         config_class: Класс конфигурации приложения
+        pool_profile: Профиль пула соединений (web, realtime, worker, cli),
+            по умолчанию DB_POOL_PROFILE
         
     Returns:
         Flask: Настроенное приложение Flask
@@ -184,6 +190,8 @@ def create_app(config_class: Type[BaseConfig] = Config) -> Flask:
     try:
         app = Flask(__name__)
         app.config.update(config_class.get_config())
+        if pool_profile:
+            app.config['DB_POOL_PROFILE'] = pool_profile
         
         # Настройка логирования
         setup_logging(app)
@@ -205,6 +213,16 @@ def create_app(config_class: Type[BaseConfig] = Config) -> Flask:
                 app.logger.error(f'Health check failed: {str(e)}')
                 return jsonify({'status': 'unhealthy', 'error': str(e)}), 500
         
+        # Эндпоинт метрик
+        @app.route('/metrics')
+        @limiter.exempt
+        def metrics():
+            return jsonify({
+                'cache': cache.stats(),
+                'replicas': replica_status(),
+                'db_pool': pool_status()
+            }), 200
+        
         # Обработка языка
         @app.before_request
         def before_request() -> None:
@@ -213,10 +231,9 @@ def create_app(config_class: Type[BaseConfig] = Config) -> Flask:
             if lang and lang in ['ru', 'en']:
                 session['language'] = lang
                 
-            # Обновляем last_seen для авторизованных пользователей
-            if current_user.is_authenticated and hasattr(app, 'extensions') and 'sqlalchemy' in app.extensions:
-                current_user.last_seen = datetime.utcnow()
-                db.session.commit()
+            # Отмечаем активность авторизованных пользователей в буфере last_seen
+            if request.endpoint != 'static' and current_user.is_authenticated:
+                record_activity(current_user.id)
         
         # Добавление переменных в контекст шаблона
         @app.context_processor
@@ -229,12 +246,12 @@ def create_app(config_class: Type[BaseConfig] = Config) -> Flask:
             online_users = 0
             total_posts = 0
             
-            if hasattr(app, 'extensions') and 'sqlalchemy' in app.extensions:
-                try:
-                    online_users = User.query.filter(User.last_seen >= datetime.utcnow() - timedelta(minutes=5)).count()
-                    total_posts = Post.query.count()
-                except Exception as e:
-                    app.logger.error(f'Error getting statistics: {str(e)}')
+            try:
+                stats = get_site_stats()
+                online_users = stats['online_users']
+                total_posts = stats['total_posts']
+            except Exception as e:
+                app.logger.error(f'Error getting statistics: {str(e)}')
             
             return {
                 'now': datetime.utcnow(),
@@ -327,7 +344,7 @@ def create_app(config_class: Type[BaseConfig] = Config) -> Flask:
         raise
 
 @login_manager.user_loader
-def load_user(id: str) -> Optional[User]:
+def load_user(id: str) -> Optional[UserPrincipal]:
     """
     Загрузка пользователя для Flask-Login.
     
@@ -335,9 +352,9 @@ def load_user(id: str) -> Optional[User]:
         id: ID пользователя
         
     Returns:
-        Optional[User]: Объект пользователя или None
+        Optional[UserPrincipal]: Кэшированный принципал пользователя или None
     """
-    return User.query.get(int(id))
+    return load_user_principal(int(id))
 
 def with_app_context(app: Flask, f: Callable) -> Callable:
     """
@@ -356,7 +373,28 @@ def with_app_context(app: Flask, f: Callable) -> Callable:
             return f(*args, **kwargs)
     return wrapper
 
-app = create_app()
+def entry_point_profile() -> Optional[str]:
+    """
+    Профиль пула по способу запуска процесса.
+
+    Команда flask загружает приложение внутри контекста click корневой
+    FlaskGroup - это профиль cli. Процесс, в котором eventlet уже подменил
+    сокеты (gunicorn -k eventlet для Socket.IO), получает профиль realtime.
+    Остальные процессы используют DB_POOL_PROFILE.
+
+    Returns:
+        Optional[str]: Имя профиля или None для DB_POOL_PROFILE
+    """
+    ctx = click.get_current_context(silent=True)
+    if ctx is not None and isinstance(ctx.find_root().command, FlaskGroup):
+        return 'cli'
+    if 'eventlet' in sys.modules:
+        from eventlet import patcher
+        if patcher.is_monkey_patched('socket'):
+            return 'realtime'
+    return None
+
+app = create_app(pool_profile=entry_point_profile())
 
 if __name__ == '__main__':
     app.run(
@@ -30,6 +30,38 @@ task_routes = {
     'utils.tasks.process_video': {'queue': 'video_processing'},
 }
 
+# Периодические задачи
+beat_schedule = {
+    'rebuild-popular-threads': {
+        'task': 'utils.tasks.rebuild_popular_threads',
+        'schedule': 3600.0,
+    },
+    'flush-last-seen': {
+        'task': 'utils.tasks.flush_last_seen',
+        'schedule': 60.0,
+    },
+    'reconcile-site-stats': {
+        'task': 'utils.tasks.reconcile_site_stats',
+        'schedule': 900.0,
+    },
+    'archive-old-threads': {
+        'task': 'utils.tasks.archive_old_threads',
+        'schedule': 3600.0,
+    },
+    'purge-old-threads': {
+        'task': 'utils.tasks.purge_old_threads',
+        'schedule': 86400.0,
+    },
+    'ensure-partitions': {
+        'task': 'utils.tasks.ensure_partitions',
+        'schedule': 86400.0,
+    },
+    'collect-orphan-blobs': {
+        'task': 'utils.tasks.collect_orphan_blobs',
+        'schedule': 86400.0,
+    },
+}
+
 # Настройки производительности
 WORKER_PREFETCH_MULTIPLIER = 1
 WORKER_MAX_TASKS_PER_CHILD = MAX_TASKS_PER_CHILD
@@ -72,6 +104,7 @@ def make_celery(app: Any) -> Celery:
     
     # Обновляем конфигурацию из приложения
     celery.conf.update(app.config)
+    celery.conf.beat_schedule = beat_schedule
     
     # Добавляем контекст приложения к задачам
     class ContextTask(celery.Task):
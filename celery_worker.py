@@ -1,14 +1,15 @@
 import os
 import logging
 from app import create_app
-from celery.signals import worker_ready, worker_shutdown, task_failure
+from utils.db_pool import dispose_engines
+from celery.signals import worker_ready, worker_shutdown, worker_process_init, task_failure
 from celery.exceptions import MaxRetriesExceededError
 
 # Настройка логирования
 logger = logging.getLogger(__name__)
 
 # Создаем приложение
-app = create_app()
+app = create_app(pool_profile='worker')
 app.app_context().push()
 
 # Получаем экземпляр Celery
@@ -19,6 +20,11 @@ def worker_ready_handler(sender, **kwargs):
     """Обработчик события готовности воркера."""
     logger.info(f"Воркер {sender.hostname} готов к работе")
 
+@worker_process_init.connect
+def worker_process_init_handler(**kwargs):
+    """Сброс соединений с базой, унаследованных дочерним процессом от родителя."""
+    dispose_engines()
+
 @worker_shutdown.connect
 def worker_shutdown_handler(sender, **kwargs):
     """Обработчик события завершения работы воркера."""
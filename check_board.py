@@ -36,7 +36,7 @@ def check_database():
         logger.error(f"Ошибка при проверке базы данных: {str(e)}")
 
 def check_board():
-    app = create_app()
+    app = create_app(pool_profile='cli')
     with app.app_context():
         try:
             # Проверяем состояние базы данных
@@ -2,24 +2,52 @@ import click
 from flask.cli import with_appcontext
 from utils.archive import archive_old_threads, unarchive_thread
 from utils.backup import create_backup, list_backups, restore_backup, delete_backup
+from utils.popularity import rebuild_popular_threads
+from utils.stats import reconcile_site_stats
+from utils.counters import reconcile_counters
+from utils.purge import purge_old_threads
+from utils.partitions import ensure_partitions, detach_partitions
+from utils.query_plans import explain_hot_queries
+from utils.backlinks import rebuild_links
+from utils.exif import benchmark as exif_benchmark
 from datetime import datetime
 
 @click.command('archive-threads')
 @click.option('--board-id', type=int, help='ID доски для архивации')
 @click.option('--days', type=int, default=30, help='Возраст треда в днях для архивации')
-@click.option('--max-replies', type=int, default=1000, help='Максимальное количество ответов')
+@click.option('--max-replies', type=int, default=1000, help='Количество ответов, начиная с которого тред архивируется')
 @click.option('--reason', help='Причина архивации')
+@click.option('--batch-size', type=int, help='Количество тредов в одной пачке')
+@click.option('--time-budget', type=float, help='Ограничение времени работы в секундах')
 @with_appcontext
-def archive_threads_command(board_id, days, max_replies, reason):
+def archive_threads_command(board_id, days, max_replies, reason, batch_size, time_budget):
     """Архивирует старые треды."""
     archived = archive_old_threads(
         board_id=board_id,
         days=days,
         max_replies=max_replies,
-        reason=reason
+        reason=reason,
+        batch_size=batch_size,
+        time_budget=time_budget,
+        progress=lambda count: click.echo(f'Архивировано: {count}')
     )
     click.echo(f'Архивировано тредов: {archived}')
 
+@click.command('purge-threads')
+@click.option('--days', type=int, help='Возраст треда в днях для удаления')
+@click.option('--batch-size', type=int, help='Количество тредов в одной пачке')
+@click.option('--time-budget', type=float, help='Ограничение времени работы в секундах')
+@with_appcontext
+def purge_threads_command(days, batch_size, time_budget):
+    """Удаляет старые треды вместе с постами и файлами."""
+    result = purge_old_threads(
+        days=days,
+        batch_size=batch_size,
+        time_budget=time_budget,
+        progress=lambda totals: click.echo(f'Удалено тредов: {totals["threads"]}')
+    )
+    click.echo(f'Удалено тредов: {result["threads"]}, постов: {result["posts"]}, файлов: {result["files"]}')
+
 @click.command('unarchive-thread')
 @click.argument('thread_id', type=int)
 @click.option('--reason', help='Причина разархивации')
@@ -80,8 +108,131 @@ def backup_delete(timestamp):
     except Exception as e:
         click.echo(f'Ошибка при удалении резервной копии: {str(e)}', err=True)
 
+@click.command('rebuild-popular')
+@with_appcontext
+def rebuild_popular_command():
+    """Пересобирает рейтинг популярных тредов из базы данных."""
+    try:
+        count = rebuild_popular_threads()
+        click.echo(f'Тредов в рейтинге: {count}')
+    except Exception as e:
+        click.echo(f'Ошибка при пересборке рейтинга: {str(e)}', err=True)
+
+@click.command('reconcile-stats')
+@with_appcontext
+def reconcile_stats_command():
+    """Сверяет счетчики статистики сайта с базой данных."""
+    try:
+        stats = reconcile_site_stats()
+        click.echo(f'Постов: {stats["total_posts"]}, онлайн: {stats["online_users"]}')
+    except Exception as e:
+        click.echo(f'Ошибка при сверке статистики: {str(e)}', err=True)
+
+@click.command('reconcile-counters')
+@click.option('--board-id', type=int, help='ID доски для пересчета')
+@with_appcontext
+def reconcile_counters_command(board_id):
+    """Пересчитывает счетчики тредов и досок."""
+    try:
+        result = reconcile_counters(board_id=board_id)
+        click.echo(f'Обновлено тредов: {result["threads"]}, досок: {result["boards"]}')
+    except Exception as e:
+        click.echo(f'Ошибка при пересчете счетчиков: {str(e)}', err=True)
+
+@click.command('explain-check')
+@with_appcontext
+def explain_check_command():
+    """Проверяет, что горячие запросы листингов используют индексы."""
+    try:
+        results = explain_hot_queries()
+    except Exception as e:
+        click.echo(f'Ошибка при проверке планов запросов: {str(e)}', err=True)
+        raise SystemExit(2)
+
+    regressions = {name: tables for name, tables in results.items() if tables}
+    for name, tables in results.items():
+        status = 'SEQ SCAN: ' + ', '.join(tables) if tables else 'ok'
+        click.echo(f'{name}: {status}')
+    if regressions:
+        click.echo(f'Запросов с полным сканированием: {len(regressions)}', err=True)
+        raise SystemExit(1)
+
+@click.command('partitions-ensure')
+@click.option('--months-ahead', type=int, help='На сколько месяцев вперед создать секции')
+@with_appcontext
+def partitions_ensure_command(months_ahead):
+    """Создает секции posts и files на следующие месяцы."""
+    try:
+        created = ensure_partitions(months_ahead=months_ahead)
+        click.echo(f'Создано секций: {len(created)}')
+        for name in created:
+            click.echo(f'- {name}')
+    except Exception as e:
+        click.echo(f'Ошибка при создании секций: {str(e)}', err=True)
+
+@click.command('partitions-detach')
+@click.argument('before', type=click.DateTime(formats=['%Y-%m']))
+@click.option('--schema', help='Схема холодного хранилища')
+@click.option('--force', is_flag=True, help='Отключать месяцы с постами неархивированных тредов')
+@with_appcontext
+def partitions_detach_command(before, schema, force):
+    """Отключает секции месяцев до BEFORE (ГГГГ-ММ) в холодное хранилище."""
+    try:
+        detached = detach_partitions(before, schema=schema, force=force)
+        click.echo(f'Отключено секций: {len(detached)}')
+        for name in detached:
+            click.echo(f'- {name}')
+    except Exception as e:
+        click.echo(f'Ошибка при отключении секций: {str(e)}', err=True)
+
+@click.command('backlinks-rebuild')
+@click.option('--batch-size', type=int, help='Количество постов в одной пачке')
+@with_appcontext
+def backlinks_rebuild_command(batch_size):
+    """Пересобирает граф цитирования по текстам постов."""
+    try:
+        result = rebuild_links(
+            batch_size=batch_size,
+            progress=lambda totals: click.echo(f'Постов: {totals["posts"]}, ссылок: {totals["links"]}')
+        )
+        click.echo(f'Готово. Постов: {result["posts"]}, ссылок: {result["links"]}')
+    except Exception as e:
+        click.echo(f'Ошибка при пересборке графа цитирования: {str(e)}', err=True)
+
+@click.command('exif-benchmark')
+@click.argument('paths', nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False))
+@click.option('--repeat', type=int, default=3, help='Количество повторов для каждого файла')
+def exif_benchmark_command(paths, repeat):
+    """Сравнивает удаление метаданных с копированием пикселей."""
+    try:
+        results = exif_benchmark(paths, repeat=repeat)
+    except Exception as e:
+        click.echo(f'Ошибка при замере: {str(e)}', err=True)
+        raise SystemExit(1)
+
+    for entry in results:
+        click.echo(f'{entry["path"]} ({entry["bytes"]} байт), strip_metadata: {entry["mode"]}')
+        for name in ('pixel_copy', 'strip_metadata'):
+            result = entry[name]
+            click.echo(
+                f'  {name}: {result["seconds"] * 1000:.1f} мс, '
+                f'пик памяти Python {result["peak_bytes"] / (1024 * 1024):.1f} МБ, '
+                f'результат {result["result_bytes"]} байт'
+            )
+
 def init_app(app):
+    app.cli.add_command(archive_threads_command)
+    app.cli.add_command(unarchive_thread_command)
+    app.cli.add_command(purge_threads_command)
+    app.cli.add_command(partitions_ensure_command)
+    app.cli.add_command(partitions_detach_command)
     app.cli.add_command(backup_create)
     app.cli.add_command(backup_list)
     app.cli.add_command(backup_restore)
-    app.cli.add_command(backup_delete) 
\ No newline at end of file
+    app.cli.add_command(backup_delete)
+    app.cli.add_command(rebuild_popular_command)
+    app.cli.add_command(reconcile_stats_command)
+    app.cli.add_command(reconcile_counters_command)
+    app.cli.add_command(explain_check_command)
+    app.cli.add_command(backlinks_rebuild_command)
+    app.cli.add_command(exif_benchmark_command) 
\ No newline at end of file
@@ -96,7 +96,7 @@ def create_admin(app):
             raise
 
 def init_system():
-    app = create_app()
+    app = create_app(pool_profile='cli')
     try:
         # Создаем доску
         board = create_board(app)
@@ -0,0 +1,83 @@
+"""denormalized board and thread counters
+
+Revision ID: 3f1a9c2d7b10
+Revises: 
+Create Date: 2026-10-17 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1a9c2d7b10'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+COUNTER_COLUMNS = {
+    'boards': [
+        ('thread_count', sa.Integer()),
+        ('post_count', sa.Integer()),
+        ('file_count', sa.Integer()),
+        ('file_bytes', sa.BigInteger()),
+    ],
+    'threads': [
+        ('file_count', sa.Integer()),
+        ('poster_count', sa.Integer()),
+    ],
+}
+
+
+# Тред файла: прямая ссылка или тред поста
+FILE_THREAD = 'COALESCE(f.thread_id, (SELECT p.thread_id FROM posts p WHERE p.id = f.post_id))'
+
+BACKFILL = (
+    f"""
+    UPDATE threads SET
+        reply_count = (SELECT COUNT(p.id) FROM posts p
+                       WHERE p.thread_id = threads.id AND NOT COALESCE(p.is_op, FALSE)),
+        poster_count = (SELECT COUNT(DISTINCT COALESCE('u' || CAST(p.user_id AS VARCHAR), p.ip_address))
+                        FROM posts p WHERE p.thread_id = threads.id),
+        file_count = (SELECT COUNT(f.id) FROM files f WHERE {FILE_THREAD} = threads.id)
+    """,
+    f"""
+    UPDATE boards SET
+        thread_count = (SELECT COUNT(t.id) FROM threads t WHERE t.board_id = boards.id),
+        post_count = (SELECT COUNT(p.id) FROM posts p
+                      WHERE p.thread_id IN (SELECT t.id FROM threads t WHERE t.board_id = boards.id)),
+        file_count = (SELECT COUNT(f.id) FROM files f
+                      WHERE {FILE_THREAD} IN (SELECT t.id FROM threads t WHERE t.board_id = boards.id)),
+        file_bytes = (SELECT COALESCE(SUM(f.file_size), 0) FROM files f
+                      WHERE {FILE_THREAD} IN (SELECT t.id FROM threads t WHERE t.board_id = boards.id))
+    """,
+)
+
+
+def _existing_columns(table):
+    return {column['name'] for column in sa.inspect(op.get_bind()).get_columns(table)}
+
+
+def upgrade():
+    # Таблицы могли быть созданы db.create_all() уже с новыми колонками
+    for table, columns in COUNTER_COLUMNS.items():
+        existing = _existing_columns(table)
+        for name, type_ in columns:
+            if name not in existing:
+                op.add_column(table, sa.Column(name, type_, nullable=False, server_default='0'))
+
+    op.execute('UPDATE threads SET reply_count = 0 WHERE reply_count IS NULL')
+
+    # Начальные значения: те же коррелированные UPDATE, что и в
+    # flask reconcile-counters (utils.counters.reconcile_counters)
+    for statement in BACKFILL:
+        op.execute(statement)
+
+
+def downgrade():
+    for table, columns in COUNTER_COLUMNS.items():
+        existing = _existing_columns(table)
+        for name, _ in reversed(columns):
+            if name in existing:
+                op.drop_column(table, name)
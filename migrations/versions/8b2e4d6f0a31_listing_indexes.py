@@ -0,0 +1,112 @@
+"""composite and partial indexes for thread and post listings
+
+Revision ID: 8b2e4d6f0a31
+Revises: 3f1a9c2d7b10
+Create Date: 2026-10-17 12:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b2e4d6f0a31'
+down_revision = '3f1a9c2d7b10'
+branch_labels = None
+depends_on = None
+
+
+# (таблица, имя, колонки, условие частичного индекса)
+NEW_INDEXES = [
+    ('threads', 'idx_threads_board_bump', ['board_id', 'is_pinned', 'last_reply_at', 'id'], 'NOT is_archived'),
+    ('threads', 'idx_threads_board_created', ['board_id', 'is_pinned', 'created_at', 'id'], 'NOT is_archived'),
+    ('threads', 'idx_threads_board_replies', ['board_id', 'is_pinned', 'reply_count', 'id'], 'NOT is_archived'),
+    ('threads', 'idx_threads_archived', ['archived_at', 'id'], 'is_archived'),
+    ('threads', 'idx_threads_board_archived', ['board_id', 'archived_at', 'id'], 'is_archived'),
+    ('posts', 'idx_posts_thread_created', ['thread_id', 'created_at', 'id'], None),
+    ('posts', 'idx_posts_thread_op', ['thread_id'], 'is_op'),
+]
+
+# Одноколоночные индексы, которые покрываются новыми или не используются
+# из-за низкой селективности булевых колонок
+OLD_INDEXES = [
+    ('threads', 'idx_threads_is_locked', ['is_locked']),
+    ('threads', 'idx_threads_is_pinned', ['is_pinned']),
+    ('threads', 'idx_threads_is_archived', ['is_archived']),
+    ('posts', 'idx_posts_thread_id', ['thread_id']),
+    ('posts', 'idx_posts_is_op', ['is_op']),
+]
+
+NOT_NULL_COLUMNS = [
+    ('threads', 'created_at', sa.DateTime()),
+    ('threads', 'last_reply_at', sa.DateTime()),
+    ('threads', 'reply_count', sa.Integer()),
+    ('threads', 'is_pinned', sa.Boolean()),
+    ('threads', 'is_archived', sa.Boolean()),
+    ('posts', 'created_at', sa.DateTime()),
+]
+
+
+def _existing_indexes(table):
+    return {index['name'] for index in sa.inspect(op.get_bind()).get_indexes(table)}
+
+
+def _is_postgresql():
+    return op.get_bind().dialect.name == 'postgresql'
+
+
+def _create_index(table, name, columns, where):
+    kwargs = {}
+    if where is not None:
+        kwargs['postgresql_where'] = sa.text(where)
+        kwargs['sqlite_where'] = sa.text(where)
+    if _is_postgresql():
+        kwargs['postgresql_concurrently'] = True
+    op.create_index(name, table, columns, **kwargs)
+
+
+def _drop_index(table, name):
+    kwargs = {'postgresql_concurrently': True} if _is_postgresql() else {}
+    op.drop_index(name, table_name=table, **kwargs)
+
+
+def upgrade():
+    # Ключи курсорной пагинации сравниваются как кортежи, NULL в них
+    # выпадал бы из выборки
+    op.execute('UPDATE threads SET created_at = CURRENT_TIMESTAMP WHERE created_at IS NULL')
+    op.execute('UPDATE threads SET last_reply_at = created_at WHERE last_reply_at IS NULL')
+    op.execute('UPDATE threads SET reply_count = 0 WHERE reply_count IS NULL')
+    op.execute('UPDATE threads SET is_pinned = false WHERE is_pinned IS NULL')
+    op.execute('UPDATE threads SET is_archived = false WHERE is_archived IS NULL')
+    op.execute('UPDATE threads SET archived_at = COALESCE(updated_at, created_at) '
+               'WHERE is_archived AND archived_at IS NULL')
+    op.execute('UPDATE posts SET created_at = CURRENT_TIMESTAMP WHERE created_at IS NULL')
+
+    for table, column, type_ in NOT_NULL_COLUMNS:
+        with op.batch_alter_table(table) as batch:
+            batch.alter_column(column, existing_type=type_, nullable=False)
+
+    # CREATE INDEX CONCURRENTLY не может выполняться внутри транзакции
+    with op.get_context().autocommit_block():
+        existing = {table: _existing_indexes(table) for table in ('threads', 'posts')}
+        for table, name, columns, where in NEW_INDEXES:
+            if name not in existing[table]:
+                _create_index(table, name, columns, where)
+        for table, name, _ in OLD_INDEXES:
+            if name in existing[table]:
+                _drop_index(table, name)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        existing = {table: _existing_indexes(table) for table in ('threads', 'posts')}
+        for table, name, columns in OLD_INDEXES:
+            if name not in existing[table]:
+                _create_index(table, name, columns, None)
+        for table, name, _, _ in NEW_INDEXES:
+            if name in existing[table]:
+                _drop_index(table, name)
+
+    for table, column, type_ in NOT_NULL_COLUMNS:
+        with op.batch_alter_table(table) as batch:
+            batch.alter_column(column, existing_type=type_, nullable=True)
@@ -0,0 +1,56 @@
+"""image rendition sizes
+
+Revision ID: a7c9e1b3d5f8
+Revises: f4b8d0e2a6c5
+Create Date: 2026-10-17 17:00:00.000000
+
+Размеры заполняются при обработке; у уже обработанных файлов они
+остаются пустыми, а предпросмотра у них нет.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7c9e1b3d5f8'
+down_revision = 'f4b8d0e2a6c5'
+branch_labels = None
+depends_on = None
+
+
+COLUMNS = (
+    ('width', sa.Integer),
+    ('height', sa.Integer),
+    ('preview_path', lambda: sa.String(length=255)),
+    ('preview_width', sa.Integer),
+    ('preview_height', sa.Integer),
+    ('preview_size', sa.Integer),
+    ('thumbnail_width', sa.Integer),
+    ('thumbnail_height', sa.Integer),
+    ('thumbnail_size', sa.Integer),
+)
+
+# На PostgreSQL files секционирована, ADD COLUMN распространяется на секции
+TABLES = ('files', 'blobs')
+
+
+def _columns(table):
+    return {column['name'] for column in sa.inspect(op.get_bind()).get_columns(table)}
+
+
+def upgrade():
+    for table in TABLES:
+        existing = _columns(table)
+        for name, column_type in COLUMNS:
+            if name not in existing:
+                op.add_column(table, sa.Column(name, column_type(), nullable=True))
+
+
+def downgrade():
+    for table in TABLES:
+        existing = _columns(table)
+        with op.batch_alter_table(table) as batch:
+            for name, _ in reversed(COLUMNS):
+                if name in existing:
+                    batch.drop_column(name)
@@ -0,0 +1,61 @@
+"""database-side cascades for thread, post and file deletion
+
+Revision ID: c4e8a1b7d952
+Revises: 8b2e4d6f0a31
+Create Date: 2026-10-17 13:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4e8a1b7d952'
+down_revision = '8b2e4d6f0a31'
+branch_labels = None
+depends_on = None
+
+
+# (таблица, колонка, ссылочная таблица, ON DELETE)
+CASCADES = [
+    ('posts', 'thread_id', 'threads', 'CASCADE'),
+    ('posts', 'reply_to_id', 'posts', 'SET NULL'),
+    ('files', 'post_id', 'posts', 'CASCADE'),
+    ('files', 'thread_id', 'threads', 'CASCADE'),
+    ('reports', 'post_id', 'posts', 'CASCADE'),
+]
+
+
+def _foreign_key_name(table, column):
+    for foreign_key in sa.inspect(op.get_bind()).get_foreign_keys(table):
+        if foreign_key['constrained_columns'] == [column]:
+            return foreign_key['name']
+    return None
+
+
+def _replace_foreign_key(table, column, referred, ondelete):
+    name = _foreign_key_name(table, column) or f'{table}_{column}_fkey'
+    with op.batch_alter_table(table) as batch:
+        if _foreign_key_name(table, column):
+            batch.drop_constraint(name, type_='foreignkey')
+        batch.create_foreign_key(name, referred, [column], ['id'], ondelete=ondelete)
+
+
+def _existing_indexes(table):
+    return {index['name'] for index in sa.inspect(op.get_bind()).get_indexes(table)}
+
+
+def upgrade():
+    for table, column, referred, ondelete in CASCADES:
+        _replace_foreign_key(table, column, referred, ondelete)
+    # Каскад по reports.post_id без индекса сканировал бы всю таблицу жалоб
+    # на каждую пачку удаляемых постов
+    if 'idx_reports_post_id' not in _existing_indexes('reports'):
+        op.create_index('idx_reports_post_id', 'reports', ['post_id'])
+
+
+def downgrade():
+    if 'idx_reports_post_id' in _existing_indexes('reports'):
+        op.drop_index('idx_reports_post_id', table_name='reports')
+    for table, column, referred, _ in reversed(CASCADES):
+        _replace_foreign_key(table, column, referred, None)
@@ -0,0 +1,162 @@
+"""monthly range partitioning of posts and files on PostgreSQL
+
+Revision ID: d7f3b5a9e1c6
+Revises: c4e8a1b7d952
+Create Date: 2026-10-17 14:00:00.000000
+
+Таблицы пересоздаются секционированными и данные копируются в одной
+транзакции, поэтому миграцию нужно выполнять в окно обслуживания.
+На других СУБД миграция ничего не делает.
+
+"""
+from datetime import datetime
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd7f3b5a9e1c6'
+down_revision = 'c4e8a1b7d952'
+branch_labels = None
+depends_on = None
+
+
+# Сколько месяцев вперед создавать секции; дальше их создает
+# periodic-задача ensure_partitions
+MONTHS_AHEAD = 3
+
+# Внешние ключи на posts.id невозможны: уникальный ключ секционированной
+# таблицы обязан включать created_at
+INCOMING_FOREIGN_KEYS = [
+    ('files', 'post_id', 'posts', 'CASCADE'),
+    ('reports', 'post_id', 'posts', 'CASCADE'),
+    ('posts', 'reply_to_id', 'posts', 'SET NULL'),
+]
+
+# (таблица, внешние ключи секционированной таблицы, индексы)
+TABLES = {
+    'posts': {
+        'foreign_keys': [
+            ('thread_id', 'threads', 'CASCADE'),
+            ('user_id', 'users', None),
+        ],
+        'indexes': [
+            ('idx_posts_thread_created', ['thread_id', 'created_at', 'id'], None),
+            ('idx_posts_thread_op', ['thread_id'], 'is_op'),
+            ('idx_posts_user_id', ['user_id'], None),
+            ('idx_posts_created_at', ['created_at'], None),
+            ('idx_posts_reply_to_id', ['reply_to_id'], None),
+            ('idx_posts_ip_address', ['ip_address'], None),
+            ('idx_posts_report_count', ['report_count'], None),
+        ],
+    },
+    'files': {
+        'foreign_keys': [
+            ('thread_id', 'threads', 'CASCADE'),
+        ],
+        'indexes': [
+            ('idx_files_post_id', ['post_id'], None),
+            ('idx_files_thread_id', ['thread_id'], None),
+            ('idx_files_created_at', ['created_at'], None),
+            ('idx_files_mime_type', ['mime_type'], None),
+        ],
+    },
+}
+
+
+def _add_months(value, months):
+    index = value.year * 12 + value.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def _is_partitioned(table):
+    return op.get_bind().execute(sa.text(
+        'SELECT 1 FROM pg_partitioned_table pt JOIN pg_class c ON c.oid = pt.partrelid '
+        'JOIN pg_namespace n ON n.oid = c.relnamespace '
+        'WHERE c.relname = :table AND n.nspname = current_schema()'
+    ), {'table': table}).first() is not None
+
+
+def _foreign_key_name(table, column):
+    for foreign_key in sa.inspect(op.get_bind()).get_foreign_keys(table):
+        if foreign_key['constrained_columns'] == [column]:
+            return foreign_key['name']
+    return None
+
+
+def _drop_foreign_key(table, column):
+    name = _foreign_key_name(table, column)
+    if name:
+        op.drop_constraint(name, table, type_='foreignkey')
+
+
+def _rebuild(table, partitioned):
+    """Пересоздание таблицы с копированием данных, секционированной или обычной."""
+    bind = op.get_bind()
+    spec = TABLES[table]
+    old = f'{table}_old'
+    sequence = bind.execute(sa.text("SELECT pg_get_serial_sequence(:table, 'id')"), {'table': table}).scalar()
+
+    for column, _, _ in spec['foreign_keys']:
+        _drop_foreign_key(table, column)
+    op.execute(f'ALTER TABLE {table} RENAME TO {old}')
+    # Имена индексов и первичного ключа освобождаются для новой таблицы
+    for name, _, _ in spec['indexes']:
+        op.execute(f'DROP INDEX IF EXISTS {name}')
+    op.execute(f'ALTER TABLE {old} DROP CONSTRAINT IF EXISTS {table}_pkey')
+
+    if partitioned:
+        op.execute(f'CREATE TABLE {table} (LIKE {old} INCLUDING DEFAULTS) PARTITION BY RANGE (created_at)')
+        first = bind.execute(sa.text(f'SELECT min(created_at) FROM {old}')).scalar() or datetime.utcnow()
+        month = datetime(first.year, first.month, 1)
+        last = _add_months(datetime(datetime.utcnow().year, datetime.utcnow().month, 1), MONTHS_AHEAD)
+        while month <= last:
+            op.execute(
+                f'CREATE TABLE {table}_p{month:%Y_%m} PARTITION OF {table} '
+                f"FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{_add_months(month, 1):%Y-%m-%d}')"
+            )
+            month = _add_months(month, 1)
+    else:
+        op.execute(f'CREATE TABLE {table} (LIKE {old} INCLUDING DEFAULTS)')
+
+    op.execute(f'INSERT INTO {table} SELECT * FROM {old}')
+    if sequence:
+        op.execute(f'ALTER SEQUENCE {sequence} OWNED BY {table}.id')
+    op.execute(f'DROP TABLE {old}')
+
+    primary_key = 'id, created_at' if partitioned else 'id'
+    op.execute(f'ALTER TABLE {table} ADD CONSTRAINT {table}_pkey PRIMARY KEY ({primary_key})')
+    for column, referred, ondelete in spec['foreign_keys']:
+        op.create_foreign_key(f'{table}_{column}_fkey', table, referred, [column], ['id'], ondelete=ondelete)
+    for name, columns, where in spec['indexes']:
+        kwargs = {'postgresql_where': sa.text(where)} if where else {}
+        op.create_index(name, table, columns, **kwargs)
+
+
+def upgrade():
+    if op.get_bind().dialect.name != 'postgresql' or _is_partitioned('posts'):
+        return
+
+    for table, column, _, _ in INCOMING_FOREIGN_KEYS:
+        _drop_foreign_key(table, column)
+
+    # Ключ секционирования не может быть NULL без секции по умолчанию
+    op.execute('UPDATE files SET created_at = COALESCE(last_modified, CURRENT_TIMESTAMP) WHERE created_at IS NULL')
+    op.alter_column('files', 'created_at', existing_type=sa.DateTime(), nullable=False)
+    # Файлы постов получают thread_id, чтобы удаление треда удаляло их каскадом
+    op.execute('UPDATE files SET thread_id = posts.thread_id FROM posts '
+               'WHERE files.post_id = posts.id AND files.thread_id IS NULL')
+
+    _rebuild('posts', partitioned=True)
+    _rebuild('files', partitioned=True)
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql' or not _is_partitioned('posts'):
+        return
+
+    _rebuild('files', partitioned=False)
+    _rebuild('posts', partitioned=False)
+
+    for table, column, referred, ondelete in INCOMING_FOREIGN_KEYS:
+        op.create_foreign_key(f'{table}_{column}_fkey', table, referred, [column], ['id'], ondelete=ondelete)
@@ -0,0 +1,55 @@
+"""quote-link graph between posts
+
+Revision ID: e2a6c8f0b4d3
+Revises: d7f3b5a9e1c6
+Create Date: 2026-10-17 15:00:00.000000
+
+Ссылки >>N из текстов существующих постов записываются командой
+flask backlinks-rebuild; миграция переносит только reply_to_id.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2a6c8f0b4d3'
+down_revision = 'd7f3b5a9e1c6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if 'post_links' in sa.inspect(op.get_bind()).get_table_names():
+        return
+
+    op.create_table(
+        'post_links',
+        sa.Column('source_id', sa.Integer(), nullable=False),
+        sa.Column('target_id', sa.Integer(), nullable=False),
+        sa.Column('source_thread_id', sa.Integer(), nullable=False),
+        sa.Column('thread_id', sa.Integer(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('source_id', 'target_id'),
+        sa.ForeignKeyConstraint(['source_thread_id'], ['threads.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['thread_id'], ['threads.id'], ondelete='CASCADE')
+    )
+    op.create_index('idx_post_links_thread', 'post_links', ['thread_id', 'target_id'])
+    op.create_index('idx_post_links_source_thread', 'post_links', ['source_thread_id'])
+    op.create_index('idx_post_links_target', 'post_links', ['target_id'])
+
+    op.execute(
+        'INSERT INTO post_links (source_id, target_id, source_thread_id, thread_id, created_at) '
+        'SELECT p.id, t.id, p.thread_id, t.thread_id, p.created_at '
+        'FROM posts p JOIN posts t ON t.id = p.reply_to_id'
+    )
+
+
+def downgrade():
+    if 'post_links' not in sa.inspect(op.get_bind()).get_table_names():
+        return
+
+    op.drop_index('idx_post_links_target', table_name='post_links')
+    op.drop_index('idx_post_links_source_thread', table_name='post_links')
+    op.drop_index('idx_post_links_thread', table_name='post_links')
+    op.drop_table('post_links')
@@ -0,0 +1,59 @@
+"""content-addressed upload store
+
+Revision ID: f4b8d0e2a6c5
+Revises: e2a6c8f0b4d3
+Create Date: 2026-10-17 16:00:00.000000
+
+Уже загруженные файлы остаются на своих местах с пустым blob_id и
+удаляются по-старому, вместе со строкой файла.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f4b8d0e2a6c5'
+down_revision = 'e2a6c8f0b4d3'
+branch_labels = None
+depends_on = None
+
+
+def _columns(table):
+    return {column['name'] for column in sa.inspect(op.get_bind()).get_columns(table)}
+
+
+def upgrade():
+    if 'blobs' not in sa.inspect(op.get_bind()).get_table_names():
+        op.create_table(
+            'blobs',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('created_at', sa.DateTime(), nullable=True),
+            sa.Column('sha256', sa.String(length=64), nullable=False),
+            sa.Column('file_path', sa.String(length=255), nullable=False),
+            sa.Column('thumbnail_path', sa.String(length=255), nullable=True),
+            sa.Column('file_size', sa.BigInteger(), nullable=False),
+            sa.Column('mime_type', sa.String(length=100), nullable=False),
+            sa.Column('processed', sa.Boolean(), nullable=False, server_default=sa.false()),
+            sa.Column('ref_count', sa.Integer(), nullable=False, server_default='0'),
+            sa.PrimaryKeyConstraint('id')
+        )
+        op.create_index('idx_blobs_sha256', 'blobs', ['sha256'], unique=True)
+
+    if 'blob_id' not in _columns('files'):
+        op.add_column('files', sa.Column('blob_id', sa.Integer(), nullable=True))
+        with op.batch_alter_table('files') as batch:
+            batch.create_foreign_key('files_blob_id_fkey', 'blobs', ['blob_id'], ['id'])
+        op.create_index('idx_files_blob_id', 'files', ['blob_id'])
+
+
+def downgrade():
+    if 'blob_id' in _columns('files'):
+        op.drop_index('idx_files_blob_id', table_name='files')
+        with op.batch_alter_table('files') as batch:
+            batch.drop_constraint('files_blob_id_fkey', type_='foreignkey')
+            batch.drop_column('blob_id')
+
+    if 'blobs' in sa.inspect(op.get_bind()).get_table_names():
+        op.drop_index('idx_blobs_sha256', table_name='blobs')
+        op.drop_table('blobs')
@@ -6,14 +6,16 @@ from werkzeug.security import generate_password_hash, check_password_hash
 import os
 import logging
 from pathlib import Path
-from sqlalchemy import event
-from sqlalchemy.orm import relationship, validates
+from sqlalchemy import event, inspect, select
+from sqlalchemy.orm import relationship, validates, make_transient_to_detached, object_session, Session
+from sqlalchemy.orm.attributes import set_committed_value
 from sqlalchemy.ext.declarative import declared_attr
-from flask_caching import Cache
+from utils.tiered_cache import TieredCache
+from utils.db_routing import RoutingSession
 
 logger = logging.getLogger(__name__)
-db = SQLAlchemy()
-cache = Cache()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+cache = TieredCache()
 
 T = TypeVar('T')
 
@@ -74,7 +76,54 @@ class BaseModel(db.Model):
 class CacheableModel(BaseModel):
     """Базовый класс для моделей с поддержкой кэширования."""
     __abstract__ = True
-    
+
+    # Версия формата кэшируемой записи
+    CACHE_RECORD_VERSION = 1
+
+    @classmethod
+    def cache_key(cls, id: int) -> str:
+        """
+        Получение ключа кэша для объекта.
+        
+        Args:
+            id: ID объекта
+            
+        Returns:
+            str: Ключ кэша
+        """
+        return f'{cls.__name__}:v{cls.CACHE_RECORD_VERSION}:{id}'
+
+    def to_cache_record(self) -> Dict[str, Any]:
+        """
+        Преобразование объекта в плоскую запись из значений колонок.
+        
+        Returns:
+            Dict[str, Any]: Значения колонок объекта
+        """
+        return {attr.key: getattr(self, attr.key) for attr in inspect(self.__class__).column_attrs}
+
+    @classmethod
+    def from_cache_record(cls: T, record: Dict[str, Any]) -> T:
+        """
+        Восстановление объекта из записи кэша без запроса к базе данных.
+        
+        Объект собирается в обход __init__ и валидаторов, помечается как
+        отсоединенный с известной identity и присоединяется к текущей сессии
+        через merge(load=False), поэтому ленивые связи продолжают работать.
+        
+        Args:
+            record: Значения колонок
+            
+        Returns:
+            T: Объект, присоединенный к сессии
+        """
+        mapper = inspect(cls)
+        obj = mapper.class_manager.new_instance()
+        for attr in mapper.column_attrs:
+            set_committed_value(obj, attr.key, record.get(attr.key))
+        make_transient_to_detached(obj)
+        return db.session.merge(obj, load=False)
+
     @classmethod
     def get_cached(cls: T, id: int) -> Optional[T]:
         """
@@ -86,24 +135,23 @@ class CacheableModel(BaseModel):
         Returns:
             Optional[T]: Объект или None
         """
-        cache_key = f'{cls.__name__}:{id}'
-        obj = cache.get(cache_key)
-        if obj is None:
-            obj = cls.query.get(id)
-            if obj:
-                cache.set(cache_key, obj, timeout=300)  # 5 минут
+        cache_key = cls.cache_key(id)
+        record = cache.get(cache_key)
+        if isinstance(record, dict):
+            return cls.from_cache_record(record)
+        obj = cls.query.get(id)
+        if obj:
+            cache.set(cache_key, obj.to_cache_record(), timeout=300)  # 5 минут
         return obj
     
     def save(self) -> None:
         """Сохранение объекта в базу данных и обновление кэша."""
         super().save()
-        cache_key = f'{self.__class__.__name__}:{self.id}'
-        cache.set(cache_key, self, timeout=300)
+        cache.set(self.cache_key(self.id), self.to_cache_record(), timeout=300)
     
     def delete(self) -> None:
         """Удаление объекта из базы данных и кэша."""
-        cache_key = f'{self.__class__.__name__}:{self.id}'
-        cache.delete(cache_key)
+        cache.delete(self.cache_key(self.id))
         super().delete()
 
 class Achievement(BaseModel):
@@ -151,6 +199,20 @@ user_achievements = db.Table('user_achievements',
     db.Column('created_at', db.DateTime, default=datetime.utcnow)
 )
 
+# Граф цитирования: ссылки >>N из текста постов, записываются при создании
+# поста (utils.backlinks). Внешних ключей на posts.id нет из-за секционирования
+# posts; ребра удаляются каскадом вместе с тредами обеих сторон.
+post_links = db.Table('post_links',
+    db.Column('source_id', db.Integer, primary_key=True),
+    db.Column('target_id', db.Integer, primary_key=True),
+    db.Column('source_thread_id', db.Integer, db.ForeignKey('threads.id', ondelete='CASCADE'), nullable=False),
+    db.Column('thread_id', db.Integer, db.ForeignKey('threads.id', ondelete='CASCADE'), nullable=False),
+    db.Column('created_at', db.DateTime, default=datetime.utcnow),
+    db.Index('idx_post_links_thread', 'thread_id', 'target_id'),
+    db.Index('idx_post_links_source_thread', 'source_thread_id'),
+    db.Index('idx_post_links_target', 'target_id')
+)
+
 class User(UserMixin, CacheableModel):
     """
     Модель пользователя.
@@ -311,9 +373,15 @@ class User(UserMixin, CacheableModel):
         return self.two_factor_enabled and self.two_factor_secret is not None
 
     def update_last_seen(self) -> None:
-        """Обновление времени последнего визита."""
-        self.last_seen = datetime.utcnow()
-        self.save()
+        """
+        Обновление времени последнего визита.
+        
+        Отметка пишется в буфер Redis и попадает в базу данных пакетно
+        при следующем сбросе буфера.
+        """
+        # Импорт здесь, так как utils.stats сам зависит от моделей
+        from utils.stats import record_activity
+        record_activity(self.id)
 
     def __repr__(self) -> str:
         return f'<User {self.username}>'
@@ -328,6 +396,10 @@ class Board(BaseModel):
         description: Описание доски
         is_locked: Заблокирована ли доска
         is_hidden: Скрыта ли доска
+        thread_count: Количество тредов
+        post_count: Количество постов
+        file_count: Количество файлов
+        file_bytes: Суммарный размер файлов в байтах
     """
     name = db.Column(db.String(8), unique=True, nullable=False)
     title = db.Column(db.String(64), nullable=False)
@@ -335,6 +407,12 @@ class Board(BaseModel):
     is_locked = db.Column(db.Boolean, default=False)
     is_hidden = db.Column(db.Boolean, default=False)
     
+    # Счетчики поддерживаются обработчиками событий ниже
+    thread_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    post_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    file_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    file_bytes = db.Column(db.BigInteger, nullable=False, default=0, server_default='0')
+    
     threads = relationship('Thread', backref=db.backref('board', lazy='joined'),
                          lazy='dynamic', cascade='all, delete-orphan')
 
@@ -370,7 +448,9 @@ class Thread(BaseModel):
         content: Содержание первого поста
         name: Имя автора
         updated_at: Дата обновления
-        reply_count: Количество ответов
+        reply_count: Количество ответов (постов кроме ОП)
+        file_count: Количество файлов
+        poster_count: Количество уникальных авторов
         last_reply_at: Дата последнего ответа
         is_archived: Архивирован ли тред
         archived_at: Дата архивации
@@ -379,31 +459,48 @@ class Thread(BaseModel):
         is_pinned: Закреплен ли тред
         views: Количество просмотров
     """
+    # Составные индексы повторяют ключи курсорной пагинации (utils.pagination):
+    # активные треды доски по закреплению и полю сортировки, архив по дате
+    # архивации. Миграция: migrations/versions/8b2e4d6f0a31
     __table_args__ = (
         db.Index('idx_threads_created_at', 'created_at'),
-        db.Index('idx_threads_is_locked', 'is_locked'),
-        db.Index('idx_threads_is_pinned', 'is_pinned'),
         db.Index('idx_threads_board_id', 'board_id'),
         db.Index('idx_threads_updated_at', 'updated_at'),
-        db.Index('idx_threads_is_archived', 'is_archived')
+        db.Index('idx_threads_board_bump', 'board_id', 'is_pinned', 'last_reply_at', 'id',
+                 postgresql_where=db.text('NOT is_archived')),
+        db.Index('idx_threads_board_created', 'board_id', 'is_pinned', 'created_at', 'id',
+                 postgresql_where=db.text('NOT is_archived')),
+        db.Index('idx_threads_board_replies', 'board_id', 'is_pinned', 'reply_count', 'id',
+                 postgresql_where=db.text('NOT is_archived')),
+        db.Index('idx_threads_archived', 'archived_at', 'id',
+                 postgresql_where=db.text('is_archived')),
+        db.Index('idx_threads_board_archived', 'board_id', 'archived_at', 'id',
+                 postgresql_where=db.text('is_archived'))
     )
     
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     board_id = db.Column(db.Integer, db.ForeignKey('boards.id'), nullable=False)
     subject = db.Column(db.String(100))
     content = db.Column(db.Text, nullable=False)
     name = db.Column(db.String(50))
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
-    reply_count = db.Column(db.Integer, default=0)
-    last_reply_at = db.Column(db.DateTime)
-    is_archived = db.Column(db.Boolean, default=False)
+    reply_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    file_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    poster_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    last_reply_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    is_archived = db.Column(db.Boolean, nullable=False, default=False, server_default=db.false())
     archived_at = db.Column(db.DateTime)
     archive_reason = db.Column(db.String(200))
     is_locked = db.Column(db.Boolean, default=False)
-    is_pinned = db.Column(db.Boolean, default=False)
+    is_pinned = db.Column(db.Boolean, nullable=False, default=False, server_default=db.false())
     views = db.Column(db.Integer, default=0)
     
-    posts = relationship('Post', backref='thread', lazy='dynamic', cascade='all, delete-orphan')
-    thread_files = relationship('File', backref='thread', lazy=True, cascade='all, delete-orphan')
+    # Дочерние строки удаляет база данных (ON DELETE CASCADE), ORM их не загружает.
+    # Треды удаляются через utils.purge, который учитывает счетчики и файлы на диске
+    posts = relationship('Post', backref='thread', lazy='dynamic', cascade='all, delete-orphan',
+                         passive_deletes=True)
+    thread_files = relationship('File', backref='thread', lazy=True, cascade='all, delete-orphan',
+                                passive_deletes=True)
 
     def __init__(self, subject: str) -> None:
         """
@@ -488,17 +585,23 @@ class Post(BaseModel):
         report_count: Количество жалоб
         reply_to_id: ID поста, на который отвечают
     """
+    # На PostgreSQL posts и files секционированы по месяцам created_at
+    # (миграция d7f3b5a9e1c6, обслуживание в utils.partitions). Первичный ключ
+    # секционированной таблицы (id, created_at), поэтому внешние ключи на
+    # posts.id (files.post_id, reports.post_id, reply_to_id) там не создаются,
+    # а целостность поддерживают ORM-каскады и utils.purge
     __table_args__ = (
-        db.Index('idx_posts_thread_id', 'thread_id'),
+        db.Index('idx_posts_thread_created', 'thread_id', 'created_at', 'id'),
+        db.Index('idx_posts_thread_op', 'thread_id', postgresql_where=db.text('is_op')),
         db.Index('idx_posts_user_id', 'user_id'),
         db.Index('idx_posts_created_at', 'created_at'),
         db.Index('idx_posts_reply_to_id', 'reply_to_id'),
         db.Index('idx_posts_ip_address', 'ip_address'),
-        db.Index('idx_posts_report_count', 'report_count'),
-        db.Index('idx_posts_is_op', 'is_op')
+        db.Index('idx_posts_report_count', 'report_count')
     )
     
-    thread_id = db.Column(db.Integer, db.ForeignKey('threads.id'), nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    thread_id = db.Column(db.Integer, db.ForeignKey('threads.id', ondelete='CASCADE'), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
     name = db.Column(db.String(64))
     tripcode = db.Column(db.String(32))
@@ -506,7 +609,7 @@ class Post(BaseModel):
     content = db.Column(db.Text)
     is_op = db.Column(db.Boolean, default=False)
     report_count = db.Column(db.Integer, default=0)
-    reply_to_id = db.Column(db.Integer, db.ForeignKey('posts.id'))
+    reply_to_id = db.Column(db.Integer, db.ForeignKey('posts.id', ondelete='SET NULL'))
     
     # Переопределяем отношение к файлам
     files = relationship('File', backref=db.backref('post', lazy='joined'), lazy='dynamic', cascade='all, delete-orphan')
@@ -568,6 +671,25 @@ class Post(BaseModel):
             raise ValueError('Превышен лимит жалоб')
         return count
 
+    @classmethod
+    def in_thread(cls, thread_id: int, since: Optional[datetime] = None) -> Any:
+        """
+        Запрос постов треда.
+
+        На PostgreSQL таблица posts секционирована по месяцам created_at.
+        Посты треда не старше самого треда, поэтому нижняя граница по месяцу
+        его создания позволяет планировщику отбросить более старые секции.
+
+        Args:
+            thread_id: ID треда
+            since: Время создания треда, если известно
+        """
+        query = cls.query.filter(cls.thread_id == thread_id)
+        if since is not None:
+            month = since.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+            query = query.filter(cls.created_at >= month)
+        return query
+
     def __repr__(self) -> str:
         return f'<Post {self.id}>'
 
@@ -587,16 +709,27 @@ class File(BaseModel):
         processed: Обработан ли файл
         error: Ошибка обработки
         last_modified: Дата последнего изменения
+        blob_id: ID содержимого в хранилище по хешу; у файлов, загруженных
+            до его появления, пустой
+        width, height: Размеры изображения после обработки
+        preview_path: Путь к предпросмотру
+        preview_width, preview_height, preview_size: Размеры предпросмотра
+            в пикселях и байтах
+        thumbnail_width, thumbnail_height, thumbnail_size: Размеры превью
+            в пикселях и байтах
     """
     __table_args__ = (
         db.Index('idx_files_post_id', 'post_id'),
         db.Index('idx_files_thread_id', 'thread_id'),
         db.Index('idx_files_created_at', 'created_at'),
-        db.Index('idx_files_mime_type', 'mime_type')
+        db.Index('idx_files_mime_type', 'mime_type'),
+        db.Index('idx_files_blob_id', 'blob_id')
     )
     
-    post_id = db.Column(db.Integer, db.ForeignKey('posts.id'))
-    thread_id = db.Column(db.Integer, db.ForeignKey('threads.id'))
+    # Ключ секционирования на PostgreSQL
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    post_id = db.Column(db.Integer, db.ForeignKey('posts.id', ondelete='CASCADE'))
+    thread_id = db.Column(db.Integer, db.ForeignKey('threads.id', ondelete='CASCADE'))
     filename = db.Column(db.String(255), nullable=False)
     original_filename = db.Column(db.String(255), nullable=False)
     file_path = db.Column(db.String(255), nullable=False)
@@ -606,6 +739,18 @@ class File(BaseModel):
     processed = db.Column(db.Boolean, default=False)
     error = db.Column(db.Text)
     last_modified = db.Column(db.DateTime, default=datetime.utcnow)
+    blob_id = db.Column(db.Integer, db.ForeignKey('blobs.id'))
+    width = db.Column(db.Integer)
+    height = db.Column(db.Integer)
+    preview_path = db.Column(db.String(255))
+    preview_width = db.Column(db.Integer)
+    preview_height = db.Column(db.Integer)
+    preview_size = db.Column(db.Integer)
+    thumbnail_width = db.Column(db.Integer)
+    thumbnail_height = db.Column(db.Integer)
+    thumbnail_size = db.Column(db.Integer)
+    
+    blob = relationship('Blob')
     
     # Удаляем дублирующееся определение отношения
     # post = relationship('Post')
@@ -647,6 +792,11 @@ class File(BaseModel):
     def delete(self) -> None:
         """Удаление файла и его превью."""
         try:
+            # Содержимое из хранилища по хешу удаляется с диска, только когда
+            # на него не осталось ссылок (release_blob_reference)
+            if self.blob_id:
+                super().delete()
+                return
             # Проверяем существование директории
             if self.file_path and os.path.exists(os.path.dirname(self.file_path)):
                 if os.path.exists(self.file_path):
@@ -654,6 +804,14 @@ class File(BaseModel):
             if self.thumbnail_path and os.path.exists(os.path.dirname(self.thumbnail_path)):
                 if os.path.exists(self.thumbnail_path):
                     os.remove(self.thumbnail_path)
+            if self.preview_path and os.path.exists(self.preview_path):
+                os.remove(self.preview_path)
+            # Превью в дополнительных форматах лежат рядом с JPEG
+            from utils.renditions import alternate_paths
+            for path in (self.thumbnail_path, self.preview_path):
+                for alternate in alternate_paths(path) if path else ():
+                    if os.path.exists(alternate):
+                        os.remove(alternate)
             super().delete()
         except Exception as e:
             logger.error(f'Ошибка при удалении файла {self.filename}: {e}')
@@ -662,6 +820,54 @@ class File(BaseModel):
     def __repr__(self) -> str:
         return f'<File {self.filename}>'
 
+class Blob(BaseModel):
+    """
+    Содержимое загруженного файла, адресуемое SHA-256.
+
+    Одинаковые загрузки хранятся один раз (utils.blobs); строки File
+    ссылаются на blob, ref_count равен количеству таких строк.
+
+    Attributes:
+        sha256: Хеш содержимого в hex
+        file_path: Путь к файлу
+        thumbnail_path: Путь к превью
+        file_size: Размер файла
+        mime_type: MIME-тип
+        processed: Созданы ли превью
+        ref_count: Количество файлов, ссылающихся на содержимое
+        width, height, preview_*, thumbnail_*: Размеры версий, которые
+            копируются в ссылающиеся файлы (см. File)
+    """
+    __table_args__ = (
+        db.Index('idx_blobs_sha256', 'sha256', unique=True),
+    )
+
+    sha256 = db.Column(db.String(64), nullable=False)
+    file_path = db.Column(db.String(255), nullable=False)
+    thumbnail_path = db.Column(db.String(255))
+    file_size = db.Column(db.BigInteger, nullable=False)
+    mime_type = db.Column(db.String(100), nullable=False)
+    processed = db.Column(db.Boolean, nullable=False, default=False)
+    ref_count = db.Column(db.Integer, nullable=False, default=0)
+    width = db.Column(db.Integer)
+    height = db.Column(db.Integer)
+    preview_path = db.Column(db.String(255))
+    preview_width = db.Column(db.Integer)
+    preview_height = db.Column(db.Integer)
+    preview_size = db.Column(db.Integer)
+    thumbnail_width = db.Column(db.Integer)
+    thumbnail_height = db.Column(db.Integer)
+    thumbnail_size = db.Column(db.Integer)
+
+    # Колонки версий, общие для Blob и File
+    RENDITION_COLUMNS = (
+        'width', 'height', 'preview_path', 'preview_width', 'preview_height', 'preview_size',
+        'thumbnail_path', 'thumbnail_width', 'thumbnail_height', 'thumbnail_size'
+    )
+
+    def __repr__(self) -> str:
+        return f'<Blob {self.sha256}>'
+
 class Ban(BaseModel):
     """
     Модель бана.
@@ -704,12 +910,18 @@ class Report(BaseModel):
         ip_address: IP-адрес
         is_resolved: Решена ли жалоба
     """
-    post_id = db.Column(db.Integer, db.ForeignKey('posts.id'), nullable=False)
+    __table_args__ = (
+        db.Index('idx_reports_post_id', 'post_id'),
+    )
+    
+    post_id = db.Column(db.Integer, db.ForeignKey('posts.id', ondelete='CASCADE'), nullable=False)
     reason = db.Column(db.Text)
     ip_address = db.Column(db.String(45), nullable=False)
     is_resolved = db.Column(db.Boolean, default=False)
     
-    post = relationship('Post', backref=db.backref('reports', lazy='dynamic'))
+    # Секционированная таблица posts не может быть целью внешнего ключа,
+    # поэтому жалобы удаляются ORM вместе с постом
+    post = relationship('Post', backref=db.backref('reports', lazy='dynamic', cascade='all, delete-orphan'))
 
     def resolve(self) -> None:
         """Решение жалобы."""
@@ -750,19 +962,199 @@ class UserAchievement(BaseModel):
     def __repr__(self) -> str:
         return f'<UserAchievement {self.user_id}:{self.achievement_id}>'
 
+def on_commit(target: Any, func: Any, *args: Any) -> None:
+    """
+    Отложенный вызов функции после успешного коммита сессии объекта.
+    
+    Используется для побочных эффектов вне базы данных (Redis, уведомления),
+    которые не должны срабатывать при откате транзакции.
+    
+    Args:
+        target: Объект модели или сессия
+        func: Вызываемая функция
+        args: Аргументы функции
+    """
+    session = target if isinstance(target, Session) else object_session(target)
+    if session is None:
+        func(*args)
+        return
+    session.info.setdefault('after_commit', []).append((func, args))
+
+@event.listens_for(Session, 'after_commit')
+def run_after_commit_hooks(session: Session) -> None:
+    """Выполнение отложенных функций после коммита."""
+    hooks = session.info.pop('after_commit', [])
+    for func, args in hooks:
+        try:
+            func(*args)
+        except Exception as e:
+            logger.error(f'Ошибка в обработчике после коммита {getattr(func, "__name__", func)}: {str(e)}')
+
+@event.listens_for(Session, 'after_rollback')
+def discard_after_commit_hooks(session: Session) -> None:
+    """Отмена отложенных функций при откате."""
+    session.info.pop('after_commit', None)
+
 # Регистрация обработчиков событий
+#
+# Счетчики досок и тредов меняются атомарными UPDATE ... SET x = x + n в той
+# же транзакции, что и сама запись, поэтому откат отменяет и их. Массовые
+# удаления в обход ORM исправляются командой reconcile-counters.
+
+def _increment(connection: Any, model: Any, where: Any, **deltas: int) -> None:
+    """Атомарное изменение счетчиков строк модели."""
+    table = model.__table__
+    values = {table.c[name]: table.c[name] + delta for name, delta in deltas.items() if delta}
+    if values:
+        connection.execute(table.update().where(where).values(values))
+
+def _board_of_thread(thread_id: int) -> Any:
+    threads = Thread.__table__
+    return select(threads.c.board_id).where(threads.c.id == thread_id).scalar_subquery()
+
+def _poster_of(target: Post) -> Optional[tuple]:
+    """Автор поста для poster_count: пользователь, иначе IP-адрес."""
+    user = target.__dict__.get('user')
+    user_id = target.user_id or (user.id if user is not None else None)
+    if user_id:
+        return ('user_id', user_id)
+    if target.ip_address:
+        return ('ip_address', target.ip_address)
+    return None
+
+def _thread_ref(target: Post) -> Any:
+    """ID треда поста или объект еще не сохраненного треда."""
+    if target.thread_id:
+        return target.thread_id
+    thread = target.__dict__.get('thread')
+    if thread is not None and thread.id:
+        return thread.id
+    return thread
+
+@event.listens_for(Session, 'before_flush')
+def count_thread_posters(session: Session, flush_context: Any, instances: Any) -> None:
+    """
+    Изменение poster_count для постов, которые запишет этот flush.
+
+    Решается до записи: в after_insert посты одного автора из одной пачки
+    видят друг друга, и новый автор не был бы посчитан. Для каждой пары
+    тред-автор учитывается один пост пачки, если других постов автора в
+    треде нет. Результат хранится в _poster_delta и применяется
+    обработчиками after_insert и after_delete.
+    """
+    groups = {}
+    for kind, targets in ((1, session.new), (-1, session.deleted)):
+        for target in targets:
+            if not isinstance(target, Post):
+                continue
+            target._poster_delta = 0
+            poster = _poster_of(target)
+            if poster is not None:
+                groups.setdefault((kind, _thread_ref(target), poster), []).append(target)
+    if not groups:
+        return
+
+    posts = Post.__table__
+    connection = session.connection()
+    for (kind, thread, (column, value)), targets in groups.items():
+        if isinstance(thread, int):
+            batch_ids = [target.id for target in targets if target.id]
+            query = select(posts.c.id).where(posts.c.thread_id == thread, posts.c[column] == value)
+            if batch_ids:
+                query = query.where(posts.c.id.notin_(batch_ids))
+            if connection.execute(query.limit(1)).first() is not None:
+                continue
+        # Других постов автора в треде нет; в новом треде их нет заведомо
+        targets[0]._poster_delta = kind
+
+def _thread_of_file(connection: Any, target: 'File') -> Optional[int]:
+    if target.thread_id:
+        return target.thread_id
+    if target.post_id:
+        posts = Post.__table__
+        return connection.execute(select(posts.c.thread_id).where(posts.c.id == target.post_id)).scalar()
+    return None
+
 @event.listens_for(Thread, 'after_insert')
 def update_thread_count(mapper: Any, connection: Any, target: Thread) -> None:
     """Обновление счетчика тредов в доске."""
-    connection.execute(
-        "UPDATE boards SET thread_count = thread_count + 1 WHERE id = :board_id",
-        {'board_id': target.board_id}
-    )
+    _increment(connection, Board, Board.__table__.c.id == target.board_id, thread_count=1)
+
+@event.listens_for(Thread, 'after_delete')
+def decrement_thread_count(mapper: Any, connection: Any, target: Thread) -> None:
+    """Уменьшение счетчика тредов в доске."""
+    _increment(connection, Board, Board.__table__.c.id == target.board_id, thread_count=-1)
 
 @event.listens_for(Post, 'after_insert')
 def update_post_count(mapper: Any, connection: Any, target: Post) -> None:
-    """Обновление счетчика постов в треде."""
+    """Обновление счетчиков треда и доски после добавления поста."""
+    threads = Thread.__table__
     connection.execute(
-        "UPDATE threads SET reply_count = reply_count + 1, last_reply_at = :now WHERE id = :thread_id",
-        {'thread_id': target.thread_id, 'now': datetime.utcnow()}
-    ) 
\ No newline at end of file
+        threads.update()
+        .where(threads.c.id == target.thread_id)
+        .values({
+            threads.c.reply_count: threads.c.reply_count + (0 if target.is_op else 1),
+            threads.c.poster_count: threads.c.poster_count + getattr(target, '_poster_delta', 0),
+            threads.c.last_reply_at: target.created_at or datetime.utcnow(),
+        })
+    )
+    _increment(connection, Board, Board.__table__.c.id == _board_of_thread(target.thread_id), post_count=1)
+
+@event.listens_for(Post, 'after_insert')
+def record_post_links(mapper: Any, connection: Any, target: Post) -> None:
+    """Запись ссылок поста в граф цитирования."""
+    from utils.backlinks import record_links
+    record_links(connection, target)
+
+@event.listens_for(Post, 'after_delete')
+def decrement_post_count(mapper: Any, connection: Any, target: Post) -> None:
+    """Обновление счетчиков треда и доски после удаления поста."""
+    _increment(
+        connection, Thread, Thread.__table__.c.id == target.thread_id,
+        reply_count=0 if target.is_op else -1,
+        poster_count=getattr(target, '_poster_delta', 0)
+    )
+    _increment(connection, Board, Board.__table__.c.id == _board_of_thread(target.thread_id), post_count=-1)
+
+@event.listens_for(Post, 'after_delete')
+def forget_post_links(mapper: Any, connection: Any, target: Post) -> None:
+    """Удаление ребер графа цитирования удаленного поста."""
+    from utils.backlinks import forget_links
+    forget_links(connection, target)
+
+@event.listens_for(File, 'after_insert')
+def update_file_count(mapper: Any, connection: Any, target: File) -> None:
+    """Обновление счетчиков файлов треда и доски."""
+    thread_id = _thread_of_file(connection, target)
+    if thread_id is None:
+        return
+    _increment(connection, Thread, Thread.__table__.c.id == thread_id, file_count=1)
+    _increment(connection, Board, Board.__table__.c.id == _board_of_thread(thread_id),
+               file_count=1, file_bytes=target.file_size or 0)
+
+@event.listens_for(File, 'after_insert')
+def acquire_blob_reference(mapper: Any, connection: Any, target: File) -> None:
+    """Увеличение счетчика ссылок на содержимое файла."""
+    if target.blob_id:
+        _increment(connection, Blob, Blob.__table__.c.id == target.blob_id, ref_count=1)
+
+@event.listens_for(File, 'after_delete')
+def release_blob_reference(mapper: Any, connection: Any, target: File) -> None:
+    """Уменьшение счетчика ссылок; содержимое без ссылок удаляется после коммита."""
+    if not target.blob_id:
+        return
+    from utils.blobs import release_blobs
+    from utils.purge import schedule_file_removal
+    paths = release_blobs(connection, {target.blob_id: 1})
+    if paths:
+        on_commit(target, schedule_file_removal, paths)
+
+@event.listens_for(File, 'after_delete')
+def decrement_file_count(mapper: Any, connection: Any, target: File) -> None:
+    """Уменьшение счетчиков файлов треда и доски."""
+    thread_id = _thread_of_file(connection, target)
+    if thread_id is None:
+        return
+    _increment(connection, Thread, Thread.__table__.c.id == thread_id, file_count=-1)
+    _increment(connection, Board, Board.__table__.c.id == _board_of_thread(thread_id),
+               file_count=-1, file_bytes=-(target.file_size or 0)) 
\ No newline at end of file
@@ -7,7 +7,9 @@ from flask import current_app
 import magic
 import subprocess
 import logging
-from models import db, File
+from models import db, File, Post
+from utils.cache import invalidate_thread_cache
+from utils.render_cache import invalidate_post_fragment
 from celery.exceptions import MaxRetriesExceededError
 from functools import wraps
 import time
@@ -87,10 +89,27 @@ def update_file_status(file_id: int, processed: bool = True, error: Optional[str
             file.thumbnail_path = thumbnail_path
         file.last_modified = datetime.utcnow()
         db.session.commit()
+        invalidate_file_views(file)
         logger.info(f"Статус файла {file_id} обновлен: processed={processed}, error={error}")
     else:
         logger.warning(f"Файл {file_id} не найден в базе данных")
 
+def invalidate_file_views(file: File) -> None:
+    """
+    Инвалидация закэшированных страниц и фрагментов, показывающих файл.
+    
+    Args:
+        file: Файл, у которого изменились превью или статус
+    """
+    if file.post_id:
+        invalidate_post_fragment(file.post_id)
+    thread_id = file.thread_id
+    if thread_id is None and file.post_id:
+        post = Post.query.get(file.post_id)
+        thread_id = post.thread_id if post else None
+    if thread_id:
+        invalidate_thread_cache(thread_id)
+
 @shared_task(bind=True, max_retries=3, default_retry_delay=300, base=BaseTask)
 def process_image(self, file_path: str, file_id: int) -> bool:
     """
@@ -0,0 +1,53 @@
+import os
+
+# Конфигурация выбирается при импорте config, поэтому до импорта приложения
+os.environ.setdefault('FLASK_ENV', 'testing')
+
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import event
+
+from app import create_app
+from config import TestingConfig
+from models import db
+
+
+@pytest.fixture
+def app():
+    """Приложение на SQLite в памяти с пустой схемой."""
+    app = create_app(TestingConfig())
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+class QueryCounter:
+    """Счетчик SQL-запросов, отправленных в базу."""
+
+    def __init__(self):
+        self.statements = []
+
+    def __call__(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+
+@pytest.fixture
+def count_queries(app):
+    """Контекстный менеджер, считающий запросы через before_cursor_execute."""
+    @contextmanager
+    def counter():
+        counted = QueryCounter()
+        event.listen(db.engine, 'before_cursor_execute', counted)
+        try:
+            yield counted
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', counted)
+
+    return counter
@@ -0,0 +1,62 @@
+"""Защита от лавины промахов в cached_call."""
+import threading
+import time
+
+import pytest
+
+from utils import cache as cache_module
+from utils.cache import cached_call
+
+
+class ScriptedCache:
+    """Кэш, который отвечает на чтения заранее заданными значениями."""
+
+    def __init__(self, reads):
+        self.reads = list(reads)
+        self.event = threading.Event()
+
+    def get(self, key):
+        return self.reads.pop(0) if self.reads else None
+
+    def set(self, key, value, timeout=None):
+        pass
+
+    def register_waiter(self, key):
+        return self.event
+
+
+@pytest.fixture
+def locked(app, monkeypatch):
+    """Блокировку пересчета держит другой процесс."""
+    app.config['CACHE_LOCK_TIMEOUT'] = 0.2
+    monkeypatch.setattr(cache_module, 'acquire_lock', lambda key, timeout: None)
+
+    def install(reads):
+        scripted = ScriptedCache(reads)
+        monkeypatch.setattr(cache_module, 'cache', scripted)
+        return scripted
+
+    return install
+
+
+def _fail():
+    raise AssertionError('producer must not run')
+
+
+def test_value_written_before_waiter_registration(locked):
+    # Промах, затем владелец блокировки записал ключ до регистрации ожидания
+    locked([None, {'value': 'ready', 'fresh_until': time.time() + 60}])
+    started = time.monotonic()
+    assert cached_call('key', _fail) == 'ready'
+    assert time.monotonic() - started < 0.1
+
+
+def test_value_reread_after_timeout(locked):
+    # Уведомление потерялось, но ключ записан
+    locked([None, None, {'value': 'late', 'fresh_until': time.time() + 60}])
+    assert cached_call('key', _fail) == 'late'
+
+
+def test_producer_runs_after_timeout_without_value(locked):
+    locked([])
+    assert cached_call('key', lambda: 'computed') == 'computed'
@@ -0,0 +1,52 @@
+"""Денормализованные счетчики тредов."""
+import pytest
+
+from models import db, Board, Thread, Post
+
+
+def _post(thread_id, ip_address):
+    return Post(content='Пост', thread_id=thread_id, name='Аноним', tripcode=None, ip_address=ip_address)
+
+
+def _counts(thread_id):
+    db.session.expire_all()
+    thread = db.session.get(Thread, thread_id)
+    return thread.reply_count, thread.poster_count
+
+
+@pytest.fixture
+def thread_id(app):
+    board = Board(name='test', title='Тест')
+    db.session.add(board)
+    db.session.flush()
+    thread = Thread(subject='Тред')
+    thread.board_id = board.id
+    thread.content = 'ОП'
+    db.session.add(thread)
+    db.session.commit()
+    return thread.id
+
+
+def test_posters_of_one_flush_are_counted_once(thread_id):
+    db.session.add_all([_post(thread_id, '10.0.0.1') for _ in range(3)] + [_post(thread_id, '10.0.0.2')])
+    db.session.commit()
+    assert _counts(thread_id) == (4, 2)
+
+    db.session.add(_post(thread_id, '10.0.0.1'))
+    db.session.commit()
+    assert _counts(thread_id) == (5, 2)
+
+
+def test_deleting_posts_of_one_poster(thread_id):
+    db.session.add_all([_post(thread_id, '10.0.0.1') for _ in range(3)] + [_post(thread_id, '10.0.0.2')])
+    db.session.commit()
+
+    posts = Post.query.filter_by(thread_id=thread_id, ip_address='10.0.0.1').order_by(Post.id).all()
+    for post in posts[:2]:
+        db.session.delete(post)
+    db.session.commit()
+    assert _counts(thread_id) == (2, 2)
+
+    db.session.delete(db.session.get(Post, posts[2].id))
+    db.session.commit()
+    assert _counts(thread_id) == (1, 1)
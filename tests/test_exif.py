@@ -0,0 +1,123 @@
+"""Удаление метаданных изображений."""
+import io
+
+import pytest
+from PIL import Image
+from PIL.PngImagePlugin import PngInfo
+
+from utils.exif import ORIENTATION, _jpeg_strip, _png_strip, _webp_strip, strip_metadata
+
+# Производитель и программа: теги, которые есть в любом снимке с телефона
+MAKE = 0x010F
+SOFTWARE = 0x0131
+
+
+def _exif(**tags):
+    exif = Image.Exif()
+    exif[MAKE] = 'Camera'
+    exif[SOFTWARE] = 'Editor 1.0'
+    for tag, value in tags.items():
+        exif[int(tag)] = value
+    return exif
+
+
+def _encode(image, **params):
+    out = io.BytesIO()
+    image.save(out, **params)
+    return out.getvalue()
+
+
+def _reopen(data):
+    image = Image.open(io.BytesIO(data))
+    image.load()
+    return image
+
+
+@pytest.fixture
+def picture():
+    image = Image.new('RGB', (64, 32), (200, 30, 30))
+    image.paste((30, 30, 200), (0, 0, 16, 32))
+    return image
+
+
+def test_jpeg_strip_drops_exif_and_comment(picture):
+    data = _encode(picture, format='JPEG', exif=_exif(), comment=b'secret')
+    cleaned = _jpeg_strip(data)
+
+    image = _reopen(cleaned)
+    assert not image.getexif()
+    assert 'comment' not in image.info
+    assert image.size == picture.size
+
+
+def test_jpeg_strip_keeps_icc_profile(picture):
+    ImageCms = pytest.importorskip('PIL.ImageCms')
+    profile = ImageCms.ImageCmsProfile(ImageCms.createProfile('sRGB')).tobytes()
+    data = _encode(picture, format='JPEG', exif=_exif(), icc_profile=profile)
+
+    assert _reopen(_jpeg_strip(data)).info.get('icc_profile') == profile
+
+
+def test_png_strip_drops_text_chunks(picture):
+    info = PngInfo()
+    info.add_text('Comment', 'secret')
+    info.add_itxt('Author', 'secret')
+    data = _encode(picture, format='PNG', pnginfo=info, exif=_exif())
+    cleaned = _png_strip(data)
+
+    image = _reopen(cleaned)
+    assert 'Comment' not in image.info and 'Author' not in image.info
+    assert not image.getexif()
+    assert list(image.getdata()) == list(picture.getdata())
+
+
+def test_webp_strip_drops_exif_and_clears_flags(picture):
+    data = _encode(picture, format='WEBP', lossless=True, exif=_exif(), xmp=b'<x:xmpmeta/>')
+    cleaned = _webp_strip(data)
+
+    assert b'EXIF' not in cleaned and b'XMP ' not in cleaned
+    image = _reopen(cleaned)
+    assert not image.getexif()
+    assert list(image.getdata()) == list(picture.getdata())
+
+
+@pytest.mark.parametrize('strip, data', [
+    (_jpeg_strip, b'\xff\xd8\xff\xe1\xff\xff'),
+    (_png_strip, b'\x89PNG\r\n\x1a\n\x00\x00\xff\xffIHDR'),
+    (_webp_strip, b'RIFF\x00\x00\x00\x00WEBPVP8 \xff\xff\x00\x00'),
+])
+def test_strip_rejects_truncated_files(strip, data):
+    with pytest.raises(ValueError):
+        strip(data)
+
+
+def test_mpo_is_stripped_losslessly(tmp_path, picture):
+    path = tmp_path / 'photo.jpg'
+    picture.save(path, format='MPO', save_all=True, append_images=[picture.rotate(180)], exif=_exif())
+    with Image.open(path) as image:
+        assert image.format == 'MPO'
+        assert image.getexif()[MAKE] == 'Camera'
+
+    assert strip_metadata(str(path)) == 'lossless'
+    with Image.open(path) as image:
+        assert image.format == 'JPEG'
+        assert MAKE not in image.getexif() and SOFTWARE not in image.getexif()
+
+
+def test_mpo_with_rotation_is_reencoded(tmp_path, picture):
+    path = tmp_path / 'photo.jpg'
+    exif = _exif(**{str(ORIENTATION): 6})
+    picture.save(path, format='MPO', save_all=True, append_images=[picture], exif=exif)
+
+    assert strip_metadata(str(path)) == 'reencoded'
+    with Image.open(path) as image:
+        assert image.format == 'JPEG'
+        assert image.size == (32, 64)
+        assert not image.getexif()
+
+
+def test_gif_is_skipped(tmp_path, picture):
+    path = tmp_path / 'anim.gif'
+    picture.save(path, format='GIF')
+
+    assert strip_metadata(str(path)) == 'skipped'
@@ -0,0 +1,30 @@
+"""Удаление файлов после коммита и хранилище по хешу."""
+import hashlib
+import os
+
+from models import db, Blob
+from utils.blobs import blob_path
+from utils.purge import remove_files
+
+
+def _write(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(b'data')
+    return path
+
+
+def test_remove_files_keeps_live_blobs(app, tmp_path):
+    app.config['UPLOAD_FOLDER'] = str(tmp_path)
+    live = hashlib.sha256(b'live').hexdigest()
+    dead = hashlib.sha256(b'dead').hexdigest()
+    db.session.add(Blob(sha256=live, file_path=blob_path(live, '.jpg'), file_size=4, mime_type='image/jpeg'))
+    db.session.commit()
+
+    paths = [
+        _write(blob_path(live, '.jpg')),
+        _write(blob_path(dead, '.jpg')),
+        _write(str(tmp_path / 'thumb_legacy.jpg')),
+    ]
+    assert remove_files([*paths, None, str(tmp_path / 'missing.jpg')]) == 2
+    assert [os.path.exists(path) for path in paths] == [True, False, False]
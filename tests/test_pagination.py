@@ -0,0 +1,77 @@
+"""Курсорная пагинация."""
+import base64
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+from models import db, Board, Thread, Post
+from utils.pagination import POST_KEYS, decode_cursor, encode_cursor, keyset_paginate
+
+POSTS = 7
+
+
+def _cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip('=')
+
+
+@pytest.fixture
+def thread(app):
+    """Тред с несколькими постами на доске /test/."""
+    board = Board(name='test', title='Тест')
+    db.session.add(board)
+    db.session.flush()
+    thread = Thread(subject='Тред')
+    thread.board_id = board.id
+    thread.content = 'ОП'
+    db.session.add(thread)
+    db.session.flush()
+    start = datetime.utcnow() - timedelta(hours=1)
+    for number in range(POSTS):
+        post = Post(content=f'Пост {number}', thread_id=thread.id, name='Аноним',
+                    tripcode=None, ip_address='127.0.0.1')
+        post.is_op = number == 0
+        post.created_at = start + timedelta(seconds=number)
+        db.session.add(post)
+    db.session.commit()
+    return thread
+
+
+def _page(thread, **cursor):
+    return keyset_paginate(Post.query.filter_by(thread_id=thread.id), POST_KEYS, 3,
+                           descending=False, **cursor)
+
+
+def test_cursor_round_trip(thread):
+    first = _page(thread)
+    second = _page(thread, after=first.next_cursor)
+    assert second.items[0].id > first.items[-1].id
+    assert decode_cursor(POST_KEYS, first.next_cursor) == [first.items[-1].created_at, first.items[-1].id]
+
+
+@pytest.mark.parametrize('cursor', [
+    'garbage',
+    '!!!',
+    _cursor({'dt': 1}),
+    _cursor([1]),
+    _cursor([{'dt': 'not a date'}, 1]),
+    _cursor(['2024-01-01', 1]),
+    _cursor([{'dt': '2024-01-01T00:00:00'}, 'x']),
+    _cursor([{'dt': '2024-01-01T00:00:00'}, True]),
+])
+def test_decode_cursor_rejects_malformed(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(POST_KEYS, cursor)
+
+
+@pytest.mark.parametrize('direction', ['after', 'before'])
+def test_malformed_cursor_serves_first_page(thread, direction):
+    first = _page(thread)
+    page = _page(thread, **{direction: 'garbage'})
+    assert [post.id for post in page.items] == [post.id for post in first.items]
+    assert not page.has_prev and page.has_next
+
+
+def test_thread_page_with_malformed_cursor(app, thread):
+    response = app.test_client().get(f'/test/thread/{thread.id}?after=garbage')
+    assert response.status_code == 200
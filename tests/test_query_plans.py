@@ -0,0 +1,35 @@
+"""Планы горячих запросов листингов."""
+import os
+
+import pytest
+
+from config import TestingConfig
+from models import db
+from utils.query_plans import _hot_queries, compile_for_explain, explain_hot_queries
+
+# База PostgreSQL со схемой после flask db upgrade
+POSTGRES_URL = os.getenv('TEST_DATABASE_URL', '')
+
+
+def test_hot_queries_compile_without_placeholders(app):
+    for name, query in _hot_queries().items():
+        sql = str(compile_for_explain(query))
+        assert 'POSTCOMPILE' not in sql, name
+
+
+@pytest.fixture
+def postgres_app():
+    if not POSTGRES_URL.startswith('postgresql'):
+        pytest.skip('TEST_DATABASE_URL с PostgreSQL не задан')
+    from app import create_app
+    app = create_app(TestingConfig(SQLALCHEMY_DATABASE_URI=POSTGRES_URL))
+    with app.app_context():
+        yield app
+        db.session.remove()
+
+
+def test_hot_queries_use_indexes(postgres_app):
+    results = explain_hot_queries()
+    assert results
+    regressions = {name: tables for name, tables in results.items() if tables}
+    assert not regressions
@@ -0,0 +1,77 @@
+"""Кэш готовых страниц и состояние сессии."""
+import re
+
+import pytest
+from flask import render_template_string
+from flask_wtf import FlaskForm
+
+from app import create_app
+from config import TestingConfig
+from utils import render_cache
+from utils.render_cache import CSRF_PLACEHOLDER, render_cached
+
+TOKEN = re.compile(r'name="csrf_token" type="hidden" value="([^"]+)"')
+
+
+class DictCache:
+    """Кэш страниц в словаре вместо Redis."""
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, timeout=None):
+        self.data[key] = value
+
+
+@pytest.fixture
+def app():
+    """
+    Приложение без открытого контекста: g и CSRF-токен создаются
+    заново для каждого запроса, как в работе.
+    """
+    return create_app(TestingConfig(WTF_CSRF_ENABLED=True))
+
+
+@pytest.fixture
+def page_cache(app, monkeypatch):
+    """Кэшируемая страница с формой и кэш страниц в словаре."""
+    stored = DictCache()
+    monkeypatch.setattr(render_cache, 'cache', stored)
+
+    @app.route('/cached-form')
+    @render_cached('form', lambda: ('form',))
+    def cached_form():
+        return render_template_string('<form>{{ form.csrf_token }}</form>', form=FlaskForm())
+
+    @app.route('/cached-form', methods=['POST'])
+    def submit_form():
+        return 'ok' if FlaskForm().validate_on_submit() else ('invalid', 400)
+
+    return stored
+
+
+def test_cached_page_has_no_session_token(app, page_cache):
+    with app.test_client() as client:
+        token = TOKEN.search(client.get('/cached-form').get_data(as_text=True)).group(1)
+
+    (html,) = page_cache.data.values()
+    assert token not in html
+    assert CSRF_PLACEHOLDER in html
+
+
+def test_cached_page_gets_token_per_session(app, page_cache):
+    tokens = []
+    for _ in range(2):
+        with app.test_client() as client:
+            html = client.get('/cached-form').get_data(as_text=True)
+            assert CSRF_PLACEHOLDER not in html
+            token = TOKEN.search(html).group(1)
+            # Токен из кэша проходит проверку в сессии этого клиента
+            assert client.post('/cached-form', data={'csrf_token': token}).status_code == 200
+            tokens.append(token)
+
+    assert len(page_cache.data) == 1
+    assert tokens[0] != tokens[1]
@@ -0,0 +1,38 @@
+"""Пути версий изображений."""
+import hashlib
+
+from werkzeug.datastructures import MIMEAccept
+
+from utils.renditions import alternate_paths, negotiate
+
+DIGEST = hashlib.sha256(b'image').hexdigest()
+
+
+def test_alternates_of_blob_renditions():
+    path = f'/uploads/thumbnails/{DIGEST[:2]}/{DIGEST[2:4]}/{DIGEST}.jpg'
+    assert alternate_paths(path) == [path[:-4] + '.avif', path[:-4] + '.webp']
+
+
+def test_alternates_of_legacy_renditions():
+    assert alternate_paths('/uploads/thumb_photo.png.jpg') == [
+        '/uploads/thumb_photo.png.avif', '/uploads/thumb_photo.png.webp'
+    ]
+    assert alternate_paths('/uploads/preview_photo.jpg.jpg')[1] == '/uploads/preview_photo.jpg.webp'
+
+
+def test_old_thumbnails_have_no_alternates():
+    # thumb_photo.webp - превью загрузки photo.webp, а не версия thumb_photo.jpg
+    assert alternate_paths('/uploads/thumb_photo.jpg') == []
+    assert alternate_paths('/uploads/thumb_photo.webp') == []
+    assert alternate_paths(f'/uploads/{DIGEST}.png') == []
+
+
+def test_negotiate_ignores_other_uploads(tmp_path):
+    accept = MIMEAccept([('image/webp', 1), ('image/jpeg', 0.8)])
+    legacy = tmp_path / 'thumb_photo.jpg'
+    (tmp_path / 'thumb_photo.webp').write_bytes(b'other upload')
+    assert negotiate(str(legacy), accept) == (str(legacy), 'image/jpeg')
+
+    rendition = tmp_path / f'{DIGEST}.jpg'
+    (tmp_path / f'{DIGEST}.webp').write_bytes(b'webp')
+    assert negotiate(str(rendition), accept) == (str(tmp_path / f'{DIGEST}.webp'), 'image/webp')
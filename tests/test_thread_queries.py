@@ -0,0 +1,86 @@
+"""Количество запросов при загрузке страниц треда (без N+1)."""
+from datetime import datetime, timedelta
+
+import pytest
+
+from models import db, Board, Thread, Post, File, User
+from utils.snapshots import build_thread_snapshot, load_thread_page
+
+POSTS = 30
+PER_PAGE = 50
+
+
+@pytest.fixture
+def thread_id(app):
+    """Тред с постами нескольких авторов, у каждого поста по два файла."""
+    board = Board(name='test', title='Тест')
+    db.session.add(board)
+    users = []
+    for number in range(3):
+        users.append(User(username=f'user{number}', email=f'user{number}@example.com', password='Passw0rd!'))
+    db.session.add_all(users)
+    db.session.flush()
+
+    thread = Thread(subject='Тред')
+    thread.board_id = board.id
+    thread.content = 'ОП'
+    db.session.add(thread)
+    db.session.flush()
+
+    start = datetime.utcnow() - timedelta(hours=1)
+    for number in range(POSTS):
+        post = Post(content=f'Пост {number}', thread_id=thread.id, name='Аноним',
+                    tripcode=None, ip_address='127.0.0.1')
+        post.is_op = number == 0
+        post.user_id = users[number % len(users)].id if number % 4 else None
+        post.created_at = start + timedelta(seconds=number)
+        db.session.add(post)
+        db.session.flush()
+        for index in range(2):
+            db.session.add(File(
+                post_id=post.id,
+                thread_id=thread.id,
+                filename=f'{post.id}_{index}.jpg',
+                original_filename=f'{index}.jpg',
+                file_path=f'/tmp/{post.id}_{index}.jpg',
+                file_size=1024,
+                mime_type='image/jpeg'
+            ))
+    thread_id = thread.id
+    db.session.commit()
+    db.session.expunge_all()
+    return thread_id
+
+
+def test_thread_page_query_count(thread_id, count_queries):
+    # Посты по курсору, их файлы и авторы - по одному запросу
+    with count_queries() as counted:
+        page = load_thread_page(thread_id, PER_PAGE)
+    assert len(page.items) == POSTS
+    assert all(len(post.files) == 2 for post in page.items)
+    assert counted.count == 3, counted.statements
+
+
+def test_thread_page_with_total_query_count(thread_id, count_queries):
+    # Плюс счетчик постов
+    with count_queries() as counted:
+        page = load_thread_page(thread_id, PER_PAGE, with_total=True)
+    assert page.total == POSTS
+    assert counted.count == 4, counted.statements
+
+
+def test_thread_page_query_count_does_not_grow(thread_id, count_queries):
+    with count_queries() as small:
+        load_thread_page(thread_id, 5)
+    with count_queries() as large:
+        load_thread_page(thread_id, PER_PAGE)
+    assert small.count == large.count
+
+
+def test_thread_snapshot_query_count(thread_id, count_queries):
+    # Тред с доской, первая страница, файлы, авторы и счетчик; ОП на первой
+    # странице, отдельного запроса за ним нет
+    with count_queries() as counted:
+        snapshot = build_thread_snapshot(thread_id, PER_PAGE)
+    assert snapshot is not None
+    assert counted.count == 5, counted.statements
@@ -1,42 +1,107 @@
 from datetime import datetime, timedelta
+from flask import current_app
 from models import Thread, db
-from sqlalchemy import and_
+from sqlalchemy import String, cast, literal, select
+from utils.cache import bump_generations
+from utils.pagination import ARCHIVE_KEYS, keyset_paginate
+import logging
+import time
 
-def archive_old_threads(board_id=None, days=30, max_replies=1000, reason=None):
+logger = logging.getLogger(__name__)
+
+def _archive_batch_statement(board_id, cutoff, max_replies, reason, days, batch_size, now):
+    """
+    UPDATE одной пачки кандидатов с RETURNING архивированных тредов.
+
+    Кандидаты выбираются подзапросом с LIMIT от самых старых, поэтому пачка
+    занимает блокировки только своих строк. На PostgreSQL строки, занятые
+    другими транзакциями, пропускаются.
+    """
+    threads = Thread.__table__
+    candidates = select(threads.c.id).where(
+        threads.c.is_archived == False,
+        threads.c.created_at <= cutoff,
+        threads.c.reply_count >= max_replies
+    )
+    if board_id:
+        candidates = candidates.where(threads.c.board_id == board_id)
+    candidates = candidates.order_by(threads.c.created_at, threads.c.id).limit(batch_size)
+    if db.session.get_bind().dialect.name == 'postgresql':
+        candidates = candidates.with_for_update(skip_locked=True)
+
+    if reason:
+        archive_reason = literal(reason)
+    else:
+        archive_reason = (
+            literal(f'Архивирован автоматически: возраст {days} дней, ')
+            + cast(threads.c.reply_count, String)
+            + literal(' ответов')
+        )
+
+    return threads.update()\
+        .where(threads.c.id.in_(candidates.scalar_subquery()))\
+        .values(is_archived=True, archived_at=now, archive_reason=archive_reason)\
+        .returning(threads.c.id, threads.c.board_id)
+
+def archive_old_threads(board_id=None, days=30, max_replies=1000, reason=None,
+                        batch_size=None, time_budget=None, progress=None):
     """
-    Архивирует старые треды.
+    Архивирует старые треды пачками.
+    
+    Каждая пачка архивируется одним UPDATE ... WHERE id IN (SELECT ... LIMIT n)
+    RETURNING и коммитится отдельно, поэтому блокировки держатся недолго.
+    После каждой пачки сбрасывается кэш затронутых тредов и досок. Работа
+    прекращается, когда кандидаты закончились или исчерпан бюджет времени;
+    оставшиеся треды архивирует следующий запуск.
     
     Args:
         board_id (int, optional): ID доски. Если None, архивирует на всех досках.
         days (int): Возраст треда в днях для архивации.
-        max_replies (int): Максимальное количество ответов для архивации.
+        max_replies (int): Количество ответов, начиная с которого тред архивируется.
         reason (str): Причина архивации.
-    """
-    # Базовые условия для архивации
-    conditions = [
-        Thread.is_archived == False,
-        Thread.created_at <= datetime.utcnow() - timedelta(days=days)
-    ]
-    
-    # Добавляем условие по доске, если указана
-    if board_id:
-        conditions.append(Thread.board_id == board_id)
+        batch_size (int, optional): Размер пачки, по умолчанию ARCHIVE_BATCH_SIZE.
+        time_budget (float, optional): Бюджет времени в секундах, по умолчанию ARCHIVE_TIME_BUDGET.
+        progress (callable, optional): Вызывается после каждой пачки с числом архивированных тредов.
     
-    # Находим треды для архивации
-    threads = Thread.query.filter(and_(*conditions)).all()
-    
-    # Архивируем каждый тред
-    for thread in threads:
-        # Проверяем количество ответов
-        if thread.reply_count >= max_replies:
-            thread.is_archived = True
-            thread.archived_at = datetime.utcnow()
-            thread.archive_reason = reason or f'Архивирован автоматически: возраст {days} дней, {thread.reply_count} ответов'
+    Returns:
+        int: Количество архивированных тредов.
+    """
+    batch_size = batch_size or current_app.config['ARCHIVE_BATCH_SIZE']
+    if time_budget is None:
+        time_budget = current_app.config['ARCHIVE_TIME_BUDGET']
+    now = datetime.utcnow()
+    cutoff = now - timedelta(days=days)
+    deadline = time.monotonic() + time_budget
+    archived = 0
     
-    # Сохраняем изменения
-    db.session.commit()
+    while True:
+        statement = _archive_batch_statement(board_id, cutoff, max_replies, reason, days, batch_size, now)
+        try:
+            rows = db.session.execute(statement).all()
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        
+        if rows:
+            archived += len(rows)
+            boards = {row.board_id for row in rows}
+            bump_generations(
+                *[f'thread:{row.id}' for row in rows],
+                *[f'board:{board}' for board in boards],
+                'threads'
+            )
+            if progress:
+                progress(archived)
+        
+        if len(rows) < batch_size:
+            break
+        if time.monotonic() >= deadline:
+            logger.info(f'Archive time budget of {time_budget}s exhausted after {archived} threads')
+            break
     
-    return len(threads)
+    logger.info(f'Archived {archived} threads')
+    return archived
 
 def unarchive_thread(thread_id, reason=None):
     """
@@ -58,22 +123,27 @@ def unarchive_thread(thread_id, reason=None):
     db.session.commit()
     return True
 
-def get_archived_threads(board_id=None, page=1, per_page=20):
+def get_archived_threads(board_id=None, per_page=20, after=None, before=None, with_total=False):
     """
     Получает список архивных тредов.
     
     Args:
         board_id (int, optional): ID доски. Если None, возвращает со всех досок.
-        page (int): Номер страницы.
         per_page (int): Количество тредов на странице.
+        after (str, optional): Курсор, после которого начинается страница.
+        before (str, optional): Курсор, перед которым заканчивается страница.
+        with_total (bool): Посчитать общее количество тредов.
     """
     query = Thread.query.filter_by(is_archived=True)
     
     if board_id:
         query = query.filter_by(board_id=board_id)
     
-    return query.order_by(Thread.archived_at.desc()).paginate(
-        page=page,
-        per_page=per_page,
-        error_out=False
+    return keyset_paginate(
+        query,
+        ARCHIVE_KEYS,
+        per_page,
+        after=after,
+        before=before,
+        with_total=with_total
     ) 
\ No newline at end of file
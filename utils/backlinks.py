@@ -0,0 +1,234 @@
+from datetime import datetime
+from flask import current_app
+from models import db, on_commit, post_links, Post, Thread, User
+from sqlalchemy import select, or_
+from utils.cache import versioned_key, cached_call, bump_generations
+from utils.socket import notify_new_reply
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+# Ссылка на пост: >>12345 в исходном или уже экранированном тексте
+QUOTE_RE = re.compile(r'(?:>>|&gt;&gt;)(\d+)')
+
+
+def parse_quotes(content, limit=None):
+    """
+    ID постов, на которые ссылается текст, в порядке первого упоминания.
+
+    Args:
+        content: Текст поста
+        limit: Максимальное количество ссылок, по умолчанию MAX_QUOTES_PER_POST
+    """
+    limit = limit or current_app.config['MAX_QUOTES_PER_POST']
+    quoted = []
+    for match in QUOTE_RE.finditer(content or ''):
+        post_id = int(match.group(1))
+        if post_id not in quoted:
+            quoted.append(post_id)
+            if len(quoted) >= limit:
+                break
+    return quoted
+
+
+def _quoted_ids(post_id, content, reply_to_id):
+    """Цели ссылок поста: ссылки из текста и явный reply_to_id."""
+    quoted = parse_quotes(content)
+    if reply_to_id and reply_to_id not in quoted:
+        quoted.append(reply_to_id)
+    return [target_id for target_id in quoted if target_id != post_id]
+
+
+def _resolve_targets(connection, thread_id, quoted):
+    """
+    Существующие посты из ссылок, лежащие на той же доске, что и тред.
+
+    Returns:
+        List[Row]: ID поста, ID его треда и ID автора
+    """
+    posts = Post.__table__
+    threads = Thread.__table__
+    board_id = select(threads.c.board_id).where(threads.c.id == thread_id).scalar_subquery()
+    return connection.execute(
+        select(posts.c.id, posts.c.thread_id, posts.c.user_id)
+        .select_from(posts.join(threads, threads.c.id == posts.c.thread_id))
+        .where(posts.c.id.in_(quoted), threads.c.board_id == board_id)
+    ).all()
+
+
+def record_links(connection, post):
+    """
+    Запись ссылок нового поста в граф цитирования.
+
+    Вызывается из обработчика after_insert в той же транзакции, что и
+    вставка поста. После коммита сбрасываются карты ответов затронутых
+    тредов и фрагменты процитированных постов, а их авторы получают
+    уведомления.
+    """
+    quoted = _quoted_ids(post.id, post.content, post.reply_to_id)
+    if not quoted:
+        return
+
+    targets = _resolve_targets(connection, post.thread_id, quoted)
+    if not targets:
+        return
+    now = datetime.utcnow()
+    connection.execute(post_links.insert(), [{
+        'source_id': post.id,
+        'target_id': row.id,
+        'source_thread_id': post.thread_id,
+        'thread_id': row.thread_id,
+        'created_at': now
+    } for row in targets])
+
+    # После коммита объект поста просрочен, поэтому данные для уведомления
+    # собираются сейчас
+    username = None
+    if post.user_id:
+        users = User.__table__
+        username = connection.execute(
+            select(users.c.username).where(users.c.id == post.user_id)
+        ).scalar()
+    data = {
+        'id': post.id,
+        'user_id': post.user_id,
+        'user': username or post.name,
+        'content': post.content or '',
+        'created_at': post.created_at or now
+    }
+    on_commit(post, _links_committed, post.thread_id, data,
+              [(row.id, row.thread_id, row.user_id) for row in targets])
+
+
+def _links_committed(thread_id, post, targets):
+    bump_generations(
+        *{f'thread:{target_thread_id}' for _, target_thread_id, _ in targets},
+        *[f'post:{target_id}' for target_id, _, _ in targets]
+    )
+    notify_new_reply(thread_id, post, [(target_id, user_id) for target_id, _, user_id in targets])
+
+
+def forget_links(connection, post):
+    """Удаление ребер удаленного поста в обе стороны."""
+    rows = connection.execute(
+        select(post_links.c.target_id, post_links.c.thread_id)
+        .where(or_(post_links.c.source_id == post.id, post_links.c.target_id == post.id))
+    ).all()
+    if not rows:
+        return
+    connection.execute(post_links.delete().where(
+        or_(post_links.c.source_id == post.id, post_links.c.target_id == post.id)
+    ))
+    on_commit(post, bump_generations,
+              *{f'thread:{row.thread_id}' for row in rows},
+              *[f'post:{row.target_id}' for row in rows])
+
+
+def backlinks_key(thread_id):
+    """Ключ карты ответов треда."""
+    return versioned_key(f'backlinks:{thread_id}', f'thread:{thread_id}')
+
+
+def load_backlinks(thread_id):
+    """
+    Карта ответов на посты треда одним запросом.
+
+    Returns:
+        Dict[int, List[List[int]]]: ID отвечающего поста и его треда по ID поста
+    """
+    rows = db.session.execute(
+        select(post_links.c.target_id, post_links.c.source_id, post_links.c.source_thread_id)
+        .where(post_links.c.thread_id == thread_id)
+        .order_by(post_links.c.target_id, post_links.c.source_id)
+    ).all()
+    backlinks = {}
+    for target_id, source_id, source_thread_id in rows:
+        backlinks.setdefault(target_id, []).append([source_id, source_thread_id])
+    return backlinks
+
+
+def get_backlinks(thread_id):
+    """
+    Карта ответов треда из кэша.
+
+    Ключ версионируется поколением треда, которое сдвигается при записи
+    ребер, поэтому карта не устаревает до истечения срока.
+    """
+    try:
+        return cached_call(backlinks_key(thread_id), lambda: load_backlinks(thread_id),
+                           timeout=current_app.config['THREAD_CACHE_TIMEOUT'])
+    except Exception as e:
+        logger.error(f'Error loading backlinks of thread {thread_id}: {str(e)}')
+        return load_backlinks(thread_id)
+
+
+def rebuild_links(batch_size=None, progress=None):
+    """
+    Пересборка графа цитирования по текстам всех постов.
+
+    Посты обходятся пачками по возрастанию ID; ребра каждой пачки
+    переписываются в отдельной транзакции.
+
+    Args:
+        batch_size: Количество постов в пачке, по умолчанию BACKLINKS_REBUILD_BATCH
+        progress: Вызывается после каждой пачки с количеством постов и ребер
+
+    Returns:
+        Dict[str, int]: Количество обработанных постов и записанных ребер
+    """
+    batch_size = batch_size or current_app.config['BACKLINKS_REBUILD_BATCH']
+    posts = Post.__table__
+    threads = Thread.__table__
+    with_board = select(posts.c.id, posts.c.thread_id, threads.c.board_id)\
+        .select_from(posts.join(threads, threads.c.id == posts.c.thread_id))
+    totals = {'posts': 0, 'links': 0}
+    last_id = 0
+    while True:
+        rows = db.session.execute(
+            select(posts.c.id, posts.c.thread_id, posts.c.content, posts.c.reply_to_id, threads.c.board_id)
+            .select_from(posts.join(threads, threads.c.id == posts.c.thread_id))
+            .where(posts.c.id > last_id)
+            .order_by(posts.c.id)
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+
+        quotes = {row.id: _quoted_ids(row.id, row.content, row.reply_to_id) for row in rows}
+        wanted = {post_id for quoted in quotes.values() for post_id in quoted}
+
+        try:
+            # Все цели пачки разрешаются одним запросом
+            targets = {}
+            if wanted:
+                targets = {target.id: target for target in db.session.execute(
+                    with_board.where(posts.c.id.in_(wanted))
+                ).all()}
+            links = [{
+                'source_id': row.id,
+                'target_id': post_id,
+                'source_thread_id': row.thread_id,
+                'thread_id': targets[post_id].thread_id,
+                'created_at': datetime.utcnow()
+            } for row in rows for post_id in quotes[row.id]
+                if post_id in targets and targets[post_id].board_id == row.board_id]
+
+            db.session.execute(post_links.delete().where(post_links.c.source_id.in_(list(quotes))))
+            if links:
+                db.session.execute(post_links.insert(), links)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+        totals['posts'] += len(rows)
+        totals['links'] += len(links)
+        if progress:
+            progress(totals)
+
+    # Карты ответов и фрагменты постов всех тредов устарели
+    bump_generations('global')
+    logger.info(f'Rebuilt {totals["links"]} quote links from {totals["posts"]} posts')
+    return totals
@@ -0,0 +1,314 @@
+from contextlib import contextmanager
+from datetime import datetime
+from flask import current_app
+from models import db, Blob, File
+from sqlalchemy import select, text
+from sqlalchemy.exc import IntegrityError
+from utils.counters import adjust_file_bytes
+from utils.ingest import TEMP_DIR, ingest, place, discard
+from utils.renditions import alternate_paths
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_DIR = 'thumbnails'
+PREVIEW_DIR = 'previews'
+
+# Блокировка содержимого по хешу до конца транзакции: загрузка и удаление
+# файлов одного хеша не пересекаются
+DIGEST_LOCK_SQL = text('SELECT pg_advisory_xact_lock(hashtext(:digest))')
+
+
+def shard_path(root, digest, suffix):
+    """Путь по хешу с двумя уровнями каталогов: ab/cd/abcd...suffix."""
+    return os.path.join(root, digest[:2], digest[2:4], f'{digest}{suffix}')
+
+
+def blob_path(digest, extension):
+    """Путь к содержимому по хешу."""
+    return shard_path(current_app.config['UPLOAD_FOLDER'], digest, extension)
+
+
+def thumbnail_path_for(digest, extension='.jpg'):
+    """Путь к превью содержимого по хешу."""
+    return shard_path(os.path.join(current_app.config['UPLOAD_FOLDER'], THUMBNAIL_DIR), digest, extension)
+
+
+def preview_path_for(digest, extension='.jpg'):
+    """Путь к предпросмотру содержимого по хешу."""
+    return shard_path(os.path.join(current_app.config['UPLOAD_FOLDER'], PREVIEW_DIR), digest, extension)
+
+
+def lock_digests(connection, digests):
+    """
+    Advisory-блокировка хешей до конца транзакции соединения.
+
+    Хеши блокируются в порядке сортировки, чтобы параллельные удаления не
+    взаимоблокировались. На SQLite не действует.
+    """
+    if connection.dialect.name != 'postgresql':
+        return
+    for digest in sorted(set(digests)):
+        connection.execute(DIGEST_LOCK_SQL, {'digest': digest})
+
+
+def find_blob(digest):
+    """Содержимое по хешу; на PostgreSQL строка блокируется до конца транзакции."""
+    return Blob.query.filter_by(sha256=digest).with_for_update().first()
+
+
+def store_upload(upload, **fields):
+    """
+    Сохранение загрузки в хранилище по хешу содержимого.
+
+    Загрузка принимается за один проход (utils.ingest). Если такое
+    содержимое уже есть, временный файл удаляется и новый File ссылается
+    на существующий blob вместе с его превью. Иначе создается blob, и
+    только после успешной вставки его строки файл атомарно переносится на
+    путь по хешу. Хеш блокируется до конца транзакции загрузки, поэтому
+    отложенное удаление файлов того же хеша не снимет новый файл до
+    коммита. Счетчик ссылок увеличивает вставка File.
+
+    Хеш считается по байтам загрузки: последующая обработка (уменьшение,
+    очистка метаданных) детерминирована, поэтому повтор той же загрузки
+    дает тот же результат.
+
+    Args:
+        upload: FileStorage из формы
+        fields: Дополнительные поля File (post, thread_id и т.д.)
+
+    Returns:
+        Tuple[File, bool]: Несохраненный File и признак того, что
+        содержимое новое и его нужно обработать
+
+    Raises:
+        UploadRejected: Если тип не разрешен или файл слишком большой
+    """
+    ingested = ingest(upload)
+    try:
+        # Удаление файлов этого хеша (removable_paths) ждет коммита загрузки
+        lock_digests(db.session.connection(), [ingested.sha256])
+        blob = find_blob(ingested.sha256)
+        created = blob is None
+        if created:
+            path = blob_path(ingested.sha256, ingested.extension)
+            blob = Blob(sha256=ingested.sha256, file_path=path,
+                        file_size=ingested.size, mime_type=ingested.mime_type)
+            try:
+                with db.session.begin_nested():
+                    db.session.add(blob)
+            except IntegrityError:
+                # Тот же файл одновременно загрузили в другом запросе; его
+                # файл уже мог пройти обработку, поэтому наш на диск не попадает
+                blob = find_blob(ingested.sha256)
+                created = False
+            else:
+                # Вставка строки прошла: конкурирующая вставка того же хеша ждет
+                # нашей транзакции, и путь принадлежит этой загрузке
+                place(ingested, path)
+    finally:
+        discard(ingested)
+
+    file = File(
+        blob=blob,
+        filename=os.path.relpath(blob.file_path, current_app.config['UPLOAD_FOLDER']),
+        original_filename=ingested.original_filename,
+        file_path=blob.file_path,
+        file_size=blob.file_size,
+        mime_type=blob.mime_type,
+        processed=blob.processed,
+        **{name: getattr(blob, name) for name in Blob.RENDITION_COLUMNS},
+        **fields
+    )
+    if not created:
+        logger.info(f'Upload {ingested.sha256} deduplicated')
+    return file, created
+
+
+def mark_processed(blob, values):
+    """
+    Запись результата обработки содержимого во все ссылающиеся файлы.
+
+    Если обработка уменьшила оригинал, счетчики размера файлов досок
+    поправляются на разницу.
+
+    Args:
+        blob: Обработанное содержимое
+        values: Значения колонок версий (thumbnail_path, file_size и т.д.)
+
+    Returns:
+        List[Row]: post_id и thread_id обновленных файлов для инвалидации кэша
+    """
+    old_size = blob.file_size
+    blob.processed = True
+    for name, value in values.items():
+        setattr(blob, name, value)
+    files = File.__table__
+    rows = db.session.execute(
+        files.update()
+        .where(files.c.blob_id == blob.id)
+        .values(processed=True, error=None, last_modified=datetime.utcnow(), **values)
+        .returning(files.c.post_id, files.c.thread_id)
+    ).all()
+    delta = blob.file_size - old_size
+    if delta:
+        thread_deltas = {}
+        for row in rows:
+            if row.thread_id:
+                thread_deltas[row.thread_id] = thread_deltas.get(row.thread_id, 0) + delta
+        adjust_file_bytes(thread_deltas)
+    return rows
+
+
+def release_blobs(connection, counts):
+    """
+    Уменьшение счетчиков ссылок и удаление содержимого без ссылок.
+
+    Строки blobs удаляются в текущей транзакции; файлы с диска удаляет
+    вызывающий код после коммита.
+
+    Args:
+        connection: Соединение текущей транзакции
+        counts: Количество удаленных ссылок по ID blob
+
+    Returns:
+        List[str]: Пути к файлам и превью удаленного содержимого
+    """
+    if not counts:
+        return []
+    blobs = Blob.__table__
+    for blob_id, count in counts.items():
+        connection.execute(
+            blobs.update().where(blobs.c.id == blob_id).values(ref_count=blobs.c.ref_count - count)
+        )
+    # Условие по ref_count проверяется заново после блокировки строки, поэтому
+    # содержимое, на которое параллельно сослалась новая загрузка, остается
+    deleted = connection.execute(
+        blobs.delete()
+        .where(blobs.c.id.in_(list(counts)), blobs.c.ref_count <= 0)
+        .returning(blobs.c.file_path, blobs.c.thumbnail_path, blobs.c.preview_path)
+    ).all()
+    paths = []
+    for row in deleted:
+        paths.append(row.file_path)
+        for path in (row.thumbnail_path, row.preview_path):
+            if path:
+                paths.extend([path, *alternate_paths(path)])
+    return paths
+
+
+def _stale_files(root, cutoff):
+    """Файлы каталогов-шардов root/ab/cd, измененные раньше cutoff."""
+    for first in os.listdir(root):
+        first_dir = os.path.join(root, first)
+        if len(first) != 2 or not os.path.isdir(first_dir):
+            continue
+        for second in os.listdir(first_dir):
+            second_dir = os.path.join(first_dir, second)
+            if not os.path.isdir(second_dir):
+                continue
+            for name in os.listdir(second_dir):
+                path = os.path.join(second_dir, name)
+                if os.path.isfile(path) and os.path.getmtime(path) < cutoff:
+                    yield _digest_of(path), path
+
+
+def collect_orphan_blobs(grace=None):
+    """
+    Удаление содержимого, на которое не ссылается ни одна строка blobs.
+
+    Строка blob вставляется в одной транзакции с постом, поэтому при
+    откате на диске остается файл без строки. Сюда же попадают брошенные
+    временные файлы загрузок. Файлы моложе grace не трогаются: их
+    транзакция может быть еще не закоммичена.
+
+    Args:
+        grace: Минимальный возраст в секундах, по умолчанию BLOB_ORPHAN_GRACE
+
+    Returns:
+        int: Количество удаленных файлов
+    """
+    from utils.purge import remove_files
+
+    grace = current_app.config['BLOB_ORPHAN_GRACE'] if grace is None else grace
+    cutoff = time.time() - grace
+    root = current_app.config['UPLOAD_FOLDER']
+    paths = []
+
+    temp_dir = os.path.join(root, TEMP_DIR)
+    if os.path.isdir(temp_dir):
+        for name in os.listdir(temp_dir):
+            path = os.path.join(temp_dir, name)
+            if os.path.getmtime(path) < cutoff:
+                paths.append(path)
+
+    batch = {}
+
+    def flush():
+        known = set(db.session.execute(
+            select(Blob.sha256).where(Blob.sha256.in_(list(batch)))
+        ).scalars())
+        for digest, files in batch.items():
+            if digest not in known:
+                paths.extend(files)
+        batch.clear()
+
+    for directory in (root, os.path.join(root, THUMBNAIL_DIR), os.path.join(root, PREVIEW_DIR)):
+        if not os.path.isdir(directory):
+            continue
+        for digest, path in _stale_files(directory, cutoff):
+            if digest is None:
+                continue
+            batch.setdefault(digest, []).append(path)
+            if len(batch) >= 500:
+                flush()
+    if batch:
+        flush()
+    db.session.rollback()
+
+    removed = remove_files(paths)
+    if paths:
+        logger.info(f'Removed {removed} orphan upload files')
+    return removed
+
+
+def _digest_of(path):
+    digest = os.path.basename(path).split('.', 1)[0]
+    return digest if len(digest) == 64 else None
+
+
+@contextmanager
+def removable_paths(paths):
+    """
+    Пути без действующего содержимого, защищенные от повторной загрузки.
+
+    Файл удаляется с диска уже после коммита; если за это время то же
+    содержимое загрузили снова, путь по хешу занят новым blob и удалять
+    его нельзя. Хеши блокируются на отдельном соединении с основной базой
+    до выхода из блока: незакоммиченная загрузка того же хеша дописывается
+    раньше проверки, а новая ждет, пока файлы не будут удалены.
+
+    Yields:
+        List[str]: Пути, которые можно удалить внутри блока
+    """
+    digests = {_digest_of(path) for path in paths} - {None}
+    if not digests:
+        yield list(paths)
+        return
+    with db.engine.begin() as connection:
+        lock_digests(connection, digests)
+        live = set(connection.execute(
+            select(Blob.sha256).where(Blob.sha256.in_(list(digests)))
+        ).scalars())
+        yield [path for path in paths if _digest_of(path) not in live]
+
+
+def blob_counts(file_rows):
+    """Количество ссылок по ID blob среди строк файлов."""
+    counts = {}
+    for row in file_rows:
+        if row.blob_id:
+            counts[row.blob_id] = counts.get(row.blob_id, 0) + 1
+    return counts
@@ -1,19 +1,22 @@
-from flask import current_app
-from flask_caching import Cache
-from models import Thread, Post
-from sqlalchemy import func
-from datetime import datetime, timedelta
+from flask import current_app, abort
+from models import cache
 from functools import wraps
+from utils.snapshots import (
+    SNAPSHOT_VERSION, build_thread_snapshot, encode_snapshot,
+    decode_snapshot, hydrate_thread_snapshot, load_thread_page
+)
+from utils.db_routing import primary_reads
 import logging
-import json
+import time
+import uuid
+import redis
 
 logger = logging.getLogger(__name__)
-cache = Cache()
 
 def init_cache(app):
     """Инициализация кэша."""
     try:
-        if 'cache' not in app.extensions:
+        if cache not in app.extensions.get('cache', {}):
             cache.init_app(
                 app,
                 config={
@@ -28,7 +31,6 @@ def init_cache(app):
                     }
                 }
             )
-            app.extensions['cache'] = cache
             logger.info('Cache initialized successfully')
         else:
             logger.info('Cache already initialized')
@@ -36,9 +38,182 @@ def init_cache(app):
         logger.error(f'Error initializing cache: {str(e)}')
         raise
 
-def cache_key_prefix():
-    """Получение префикса для ключей кэша."""
-    return f'imageboard_{datetime.utcnow().strftime("%Y%m%d")}_'
+def get_redis():
+    """Получение клиента Redis для бинарных значений кэша."""
+    client = current_app.extensions.get('cache_redis')
+    if client is None:
+        client = redis.Redis.from_url(
+            current_app.config['REDIS_URL'],
+            socket_timeout=5,
+            socket_connect_timeout=5,
+            retry_on_timeout=True
+        )
+        current_app.extensions['cache_redis'] = client
+    return client
+
+def generation_key(scope):
+    """Ключ счетчика поколения для области кэша."""
+    return f'imageboard:gen:{scope}'
+
+def get_generations(*scopes):
+    """
+    Получает текущие поколения областей кэша.
+
+    Значения держатся в локальном уровне кэша, промахи дочитываются
+    одним MGET. Поколение отсутствующей области считается нулевым.
+    """
+    generations = {}
+    missing = []
+    for scope in scopes:
+        hit, value = cache.get_local(generation_key(scope))
+        if hit:
+            generations[scope] = value
+        else:
+            missing.append(scope)
+
+    if missing:
+        try:
+            values = get_redis().mget([generation_key(scope) for scope in missing])
+        except redis.RedisError as e:
+            logger.error(f'Error reading cache generations: {str(e)}')
+            values = [None] * len(missing)
+        for scope, value in zip(missing, values):
+            generations[scope] = int(value or 0)
+            cache.set_local(generation_key(scope), generations[scope])
+
+    return [generations[scope] for scope in scopes]
+
+def bump_generation(scope):
+    """
+    Инвалидирует все ключи области одним INCR.
+
+    Старые ключи становятся недостижимыми и вытесняются Redis по TTL.
+    """
+    key = generation_key(scope)
+    try:
+        generation = get_redis().incr(key)
+    except redis.RedisError as e:
+        logger.error(f'Error bumping cache generation {scope}: {str(e)}')
+        return None
+    cache.invalidate_local(key)
+    return generation
+
+def bump_generations(*scopes):
+    """
+    Инвалидирует несколько областей одним конвейером Redis.
+
+    Используется массовыми операциями, затрагивающими много тредов сразу.
+    """
+    if not scopes:
+        return
+    keys = [generation_key(scope) for scope in scopes]
+    try:
+        pipe = get_redis().pipeline(transaction=False)
+        for key in keys:
+            pipe.incr(key)
+        pipe.execute()
+    except redis.RedisError as e:
+        logger.error(f'Error bumping {len(keys)} cache generations: {str(e)}')
+        return
+    cache.invalidate_local(*keys)
+
+def versioned_key(name, *scopes):
+    """
+    Строит ключ кэша с поколениями глобальной и перечисленных областей.
+
+    Пример: versioned_key('thread_1', 'board:2', 'thread:1') ->
+    'thread_1@global.3|board:2.7|thread:1.1'
+    """
+    scopes = ('global',) + scopes
+    generations = get_generations(*scopes)
+    suffix = '|'.join(f'{scope}.{generation}' for scope, generation in zip(scopes, generations))
+    return f'{name}@{suffix}'
+
+# Снятие блокировки только ее владельцем
+RELEASE_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+def acquire_lock(key, timeout):
+    """
+    Захват блокировки пересчета ключа.
+
+    Returns:
+        str или None: Токен владельца, если блокировка захвачена
+    """
+    token = uuid.uuid4().hex
+    try:
+        if get_redis().set(f'imageboard:lock:{key}', token, nx=True, px=int(timeout * 1000)):
+            return token
+    except redis.RedisError as e:
+        logger.error(f'Error acquiring lock for {key}: {str(e)}')
+    return None
+
+def release_lock(key, token):
+    """Освобождение блокировки пересчета ключа."""
+    try:
+        get_redis().eval(RELEASE_LOCK_SCRIPT, 1, f'imageboard:lock:{key}', token)
+    except redis.RedisError as e:
+        logger.error(f'Error releasing lock for {key}: {str(e)}')
+
+def _recompute(key, producer, timeout, stale_ttl):
+    with primary_reads():
+        value = producer()
+    envelope = {'value': value, 'fresh_until': time.time() + timeout}
+    cache.set(key, envelope, timeout=timeout + stale_ttl)
+    return value
+
+def cached_call(key, producer, timeout=300, stale_ttl=None):
+    """
+    Получение значения с защитой от лавины промахов.
+
+    Значение хранится в конверте с мягким сроком свежести и живет в Redis
+    еще stale_ttl секунд после него. Пересчитывает только процесс, захвативший
+    блокировку в Redis: при устаревшем значении остальные сразу отдают старое,
+    при полном промахе ждут записи ключа и просыпаются по уведомлению.
+
+    Args:
+        key: Ключ кэша
+        producer: Функция, вычисляющая значение
+        timeout: Время свежести значения в секундах
+        stale_ttl: Сколько секунд после устаревания можно отдавать старое значение
+
+    Returns:
+        Any: Значение из кэша или результат producer()
+    """
+    if stale_ttl is None:
+        stale_ttl = current_app.config['CACHE_STALE_TTL']
+    lock_timeout = current_app.config['CACHE_LOCK_TIMEOUT']
+
+    envelope = cache.get(key)
+    if envelope is not None and envelope['fresh_until'] > time.time():
+        return envelope['value']
+
+    token = acquire_lock(key, lock_timeout)
+    if token:
+        try:
+            return _recompute(key, producer, timeout, stale_ttl)
+        finally:
+            release_lock(key, token)
+
+    if envelope is not None:
+        # Другой процесс уже пересчитывает, отдаем устаревшее значение
+        return envelope['value']
+
+    written = cache.register_waiter(key)
+    # Ключ мог быть записан между промахом и регистрацией ожидания
+    envelope = cache.get(key)
+    if envelope is None:
+        written.wait(lock_timeout)
+        # Перечитывается и после таймаута: уведомление могло не дойти
+        envelope = cache.get(key)
+    if envelope is not None:
+        return envelope['value']
+    logger.warning(f'Timed out waiting for {key}, computing without lock')
+    return producer()
 
 def cache_thread(thread_id, timeout=300):
     """Кэширование треда."""
@@ -46,13 +221,8 @@ def cache_thread(thread_id, timeout=300):
         @wraps(f)
         def decorated_function(*args, **kwargs):
             try:
-                key = f'{cache_key_prefix()}thread_{thread_id}'
-                rv = cache.get(key)
-                if rv is None:
-                    rv = f(*args, **kwargs)
-                    cache.set(key, rv, timeout=timeout)
-                    logger.info(f'Thread {thread_id} cached')
-                return rv
+                key = versioned_key(f'thread_{thread_id}', f'thread:{thread_id}')
+                return cached_call(key, lambda: f(*args, **kwargs), timeout=timeout)
             except Exception as e:
                 logger.error(f'Error caching thread {thread_id}: {str(e)}')
                 return f(*args, **kwargs)
@@ -65,13 +235,8 @@ def cache_thread_list(timeout=60):
         @wraps(f)
         def decorated_function(*args, **kwargs):
             try:
-                key = f'{cache_key_prefix()}thread_list'
-                rv = cache.get(key)
-                if rv is None:
-                    rv = f(*args, **kwargs)
-                    cache.set(key, rv, timeout=timeout)
-                    logger.info('Thread list cached')
-                return rv
+                key = versioned_key('thread_list', 'threads')
+                return cached_call(key, lambda: f(*args, **kwargs), timeout=timeout)
             except Exception as e:
                 logger.error(f'Error caching thread list: {str(e)}')
                 return f(*args, **kwargs)
@@ -84,92 +249,113 @@ def cache_user_profile(user_id, timeout=300):
         @wraps(f)
         def decorated_function(*args, **kwargs):
             try:
-                key = f'{cache_key_prefix()}user_{user_id}'
-                rv = cache.get(key)
-                if rv is None:
-                    rv = f(*args, **kwargs)
-                    cache.set(key, rv, timeout=timeout)
-                    logger.info(f'User profile {user_id} cached')
-                return rv
+                key = versioned_key(f'user_{user_id}', f'user:{user_id}')
+                return cached_call(key, lambda: f(*args, **kwargs), timeout=timeout)
             except Exception as e:
                 logger.error(f'Error caching user profile {user_id}: {str(e)}')
                 return f(*args, **kwargs)
         return decorated_function
     return decorator
 
-def get_popular_threads():
-    """Получает список популярных тредов из кэша или базы данных."""
-    cache_key = current_app.config['POPULAR_THREADS_CACHE_KEY']
-    threads = cache.get(cache_key)
-    
-    if threads is None:
-        # Получаем треды за последние 24 часа
-        day_ago = datetime.utcnow() - timedelta(days=1)
-        threads = Thread.query.join(Post).filter(
-            Post.created_at >= day_ago
-        ).group_by(Thread.id).order_by(
-            func.count(Post.id).desc()
-        ).limit(
-            current_app.config['POPULAR_THREADS_COUNT']
-        ).all()
-        
-        # Кэшируем результат
-        cache.set(
-            cache_key,
-            threads,
-            timeout=current_app.config['THREAD_CACHE_TIMEOUT']
-        )
-    
-    return threads
+def thread_snapshot_key(thread_id):
+    """Ключ снимка треда в Redis."""
+    base = current_app.config['THREAD_SNAPSHOT_KEY'].format(version=SNAPSHOT_VERSION, id=thread_id)
+    return versioned_key(base, f'thread:{thread_id}')
+
+def invalidate_thread_cache(thread_id=None, board_id=None):
+    """
+    Инвалидирует кэш тредов.
 
-def invalidate_thread_cache(thread_id=None):
-    """Инвалидирует кэш тредов."""
+    Args:
+        thread_id: ID треда; без него сбрасываются списки и популярные треды
+        board_id: ID доски треда, если известен
+    """
     if thread_id:
-        # Инвалидируем кэш конкретного треда
-        cache.delete(f'thread_{thread_id}')
-    else:
-        # Инвалидируем кэш популярных тредов
-        cache.delete(current_app.config['POPULAR_THREADS_CACHE_KEY'])
+        # Удаляем текущий снимок сразу, чтобы не ждать вытеснения по TTL
+        key = thread_snapshot_key(thread_id)
+        try:
+            get_redis().delete(key)
+        except redis.RedisError as e:
+            logger.error(f'Error invalidating snapshot of thread {thread_id}: {str(e)}')
+        bump_generation(f'thread:{thread_id}')
+    if board_id:
+        bump_generation(f'board:{board_id}')
+    # Списки тредов и популярные треды зависят от любого треда
+    bump_generation('threads')
+
+def invalidate_board_cache(board_id):
+    """Инвалидирует все ключи доски."""
+    bump_generation(f'board:{board_id}')
+    bump_generation('threads')
+
+def invalidate_all_cache():
+    """Инвалидирует весь кэш приложения."""
+    bump_generation('global')
+
+def get_thread_snapshot(thread_id):
+    """
+    Получает снимок треда из Redis или собирает его из базы данных.
+
+    Returns:
+        ThreadSnapshot или None, если тред не найден
+    """
+    key = thread_snapshot_key(thread_id)
+    hit, data = cache.get_local(key)
+    if hit:
+        return hydrate_thread_snapshot(data)
+
+    client = get_redis()
+    try:
+        data = decode_snapshot(client.get(key))
+    except redis.RedisError as e:
+        logger.error(f'Error reading snapshot of thread {thread_id}: {str(e)}')
+
+    if data is None:
+        with primary_reads():
+            data = build_thread_snapshot(thread_id, current_app.config['POSTS_PER_PAGE'])
+        if data is None:
+            return None
+        try:
+            client.set(key, encode_snapshot(data), ex=current_app.config['THREAD_CACHE_TIMEOUT'])
+        except redis.RedisError as e:
+            logger.error(f'Error caching snapshot of thread {thread_id}: {str(e)}')
+
+    cache.set_local(key, data)
+    return hydrate_thread_snapshot(data)
+
+def get_thread_page(thread_id, after=None, before=None, per_page=None, with_total=False):
+    """
+    Страница постов треда для HTML и API.
+
+    Первая страница стандартного размера берется из снимка вместе с
+    точным счетчиком, остальные загружаются по курсору без N+1.
+
+    Returns:
+        KeysetPage: Страница записей постов
+    """
+    per_page = per_page or current_app.config['POSTS_PER_PAGE']
+    snapshot = get_thread_snapshot(thread_id)
+    if not after and not before and per_page == current_app.config['POSTS_PER_PAGE']:
+        if snapshot is not None:
+            return snapshot.first_page()
+    # Время создания треда из снимка ограничивает выборку нужными секциями posts
+    since = snapshot.thread.created_at if snapshot is not None else None
+    return load_thread_page(thread_id, per_page, after=after, before=before,
+                            with_total=with_total, since=since)
 
 def get_thread_from_cache(thread_id):
-    """Получает тред из кэша или базы данных."""
-    cache_key = f'thread_{thread_id}'
-    thread = cache.get(cache_key)
-    
-    if thread is None:
-        thread = Thread.query.get_or_404(thread_id)
-        cache.set(
-            cache_key,
-            thread,
-            timeout=current_app.config['THREAD_CACHE_TIMEOUT']
-        )
-    
-    return thread
+    """Получает снимок треда из кэша или базы данных."""
+    snapshot = get_thread_snapshot(thread_id)
+    if snapshot is None:
+        abort(404)
+    return snapshot
 
 def invalidate_thread_list_cache():
     """Инвалидация кэша списка тредов."""
-    try:
-        key = f'{cache_key_prefix()}thread_list'
-        cache.delete(key)
+    if bump_generation('threads') is not None:
         logger.info('Thread list cache invalidated')
-    except Exception as e:
-        logger.error(f'Error invalidating thread list cache: {str(e)}')
 
 def invalidate_user_profile_cache(user_id):
     """Инвалидация кэша профиля пользователя."""
-    try:
-        key = f'{cache_key_prefix()}user_{user_id}'
-        cache.delete(key)
+    if bump_generation(f'user:{user_id}') is not None:
         logger.info(f'User profile {user_id} cache invalidated')
-    except Exception as e:
-        logger.error(f'Error invalidating user profile {user_id} cache: {str(e)}')
-
-def clear_expired_cache():
-    """Очистка устаревшего кэша."""
-    try:
-        yesterday = datetime.utcnow() - timedelta(days=1)
-        old_prefix = f'imageboard_{yesterday.strftime("%Y%m%d")}_'
-        cache.delete_many([f'{old_prefix}*'])
-        logger.info('Expired cache cleared')
-    except Exception as e:
-        logger.error(f'Error clearing expired cache: {str(e)}') 
\ No newline at end of file
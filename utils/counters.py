@@ -0,0 +1,110 @@
+from models import db, Board, Thread, Post, File
+from sqlalchemy import String, cast, func, literal, not_, select
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def _poster_identity():
+    """Идентификатор автора поста: пользователь, иначе IP-адрес."""
+    posts = Post.__table__
+    return func.coalesce(literal('u') + cast(posts.c.user_id, String), posts.c.ip_address)
+
+
+def _file_thread():
+    """Тред файла: прямая ссылка или тред поста."""
+    files = File.__table__
+    posts = Post.__table__
+    return func.coalesce(
+        files.c.thread_id,
+        select(posts.c.thread_id).where(posts.c.id == files.c.post_id).scalar_subquery()
+    )
+
+
+def reconcile_counters(board_id=None):
+    """
+    Пересчет денормализованных счетчиков тредов и досок.
+
+    Все значения пересчитываются set-based UPDATE с коррелированными
+    подзапросами, по одному на таблицу, без загрузки строк в приложение.
+
+    Args:
+        board_id: ID доски или None для всех досок
+
+    Returns:
+        Dict[str, int]: Количество обновленных тредов и досок
+    """
+    boards = Board.__table__
+    threads = Thread.__table__
+    posts = Post.__table__
+    files = File.__table__
+
+    thread_posts = posts.c.thread_id == threads.c.id
+    thread_update = threads.update().values(
+        reply_count=select(func.count(posts.c.id))
+            .where(thread_posts, not_(func.coalesce(posts.c.is_op, False)))
+            .scalar_subquery(),
+        poster_count=select(func.count(func.distinct(_poster_identity())))
+            .where(thread_posts)
+            .scalar_subquery(),
+        file_count=select(func.count(files.c.id))
+            .where(_file_thread() == threads.c.id)
+            .scalar_subquery(),
+        last_reply_at=func.coalesce(
+            select(func.max(posts.c.created_at)).where(thread_posts).scalar_subquery(),
+            threads.c.last_reply_at
+        )
+    )
+    if board_id is not None:
+        thread_update = thread_update.where(threads.c.board_id == board_id)
+
+    board_threads = select(threads.c.id).where(threads.c.board_id == boards.c.id)
+    board_files = _file_thread().in_(board_threads)
+    board_update = boards.update().values(
+        thread_count=select(func.count(threads.c.id))
+            .where(threads.c.board_id == boards.c.id)
+            .scalar_subquery(),
+        post_count=select(func.count(posts.c.id))
+            .where(posts.c.thread_id.in_(board_threads))
+            .scalar_subquery(),
+        file_count=select(func.count(files.c.id))
+            .where(board_files)
+            .scalar_subquery(),
+        file_bytes=select(func.coalesce(func.sum(files.c.file_size), 0))
+            .where(board_files)
+            .scalar_subquery()
+    )
+    if board_id is not None:
+        board_update = board_update.where(boards.c.id == board_id)
+
+    try:
+        threads_updated = db.session.execute(thread_update).rowcount
+        boards_updated = db.session.execute(board_update).rowcount
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    logger.info(f'Counters reconciled: {threads_updated} threads, {boards_updated} boards')
+    return {'threads': threads_updated, 'boards': boards_updated}
+
+
+def adjust_file_bytes(thread_deltas):
+    """
+    Поправка суммарного размера файлов досок после изменения file_size.
+
+    Обработка изображения перезаписывает оригинал меньшего размера;
+    счетчик доски должен совпадать с суммой, которую уменьшит удаление.
+
+    Args:
+        thread_deltas: Изменение размера в байтах по ID треда
+    """
+    boards = Board.__table__
+    threads = Thread.__table__
+    for thread_id, delta in thread_deltas.items():
+        if delta:
+            db.session.execute(
+                boards.update()
+                .where(boards.c.id == select(threads.c.board_id).where(threads.c.id == thread_id).scalar_subquery())
+                .values(file_bytes=boards.c.file_bytes + delta)
+            )
@@ -0,0 +1,187 @@
+from bisect import bisect_left
+from flask import current_app
+from models import db
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import NullPool, QueuePool
+from typing import Any, Dict, List, Optional
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограммы ожидания соединения, секунды
+WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+# Параметры, которые create_engine не принимает вместе с NullPool
+QUEUE_POOL_OPTIONS = ('pool_size', 'max_overflow', 'pool_timeout', 'pool_use_lifo')
+
+
+class PoolStats:
+    """Счетчики ожидания соединений пула в текущем процессе."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.slow = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.buckets = [0] * (len(WAIT_BUCKETS) + 1)
+
+    def record(self, wait: float, slow_after: float, timed_out: bool = False) -> None:
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+            self.buckets[bisect_left(WAIT_BUCKETS, wait)] += 1
+            if wait >= slow_after:
+                self.slow += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            attempts = self.checkouts + self.timeouts
+            return {
+                'checkouts': self.checkouts,
+                'timeouts': self.timeouts,
+                'slow_checkouts': self.slow,
+                'wait_avg': self.wait_total / attempts if attempts else 0.0,
+                'wait_max': self.wait_max,
+                'wait_buckets': {
+                    **{f'le_{bound}': count for bound, count in zip(WAIT_BUCKETS, self.buckets)},
+                    'inf': self.buckets[-1]
+                }
+            }
+
+
+class InstrumentedQueuePool(QueuePool):
+    """
+    QueuePool с замером времени ожидания свободного соединения.
+
+    Время выдачи соединения измеряется вокруг _do_get: при свободном
+    соединении это микросекунды, при исчерпанном пуле - ожидание до
+    pool_timeout. Пересоздание пула (dispose) обнуляет счетчики.
+    """
+
+    slow_checkout = 0.1
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats()
+
+    def _do_get(self) -> Any:
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            self.stats.record(time.perf_counter() - start, self.slow_checkout, timed_out=True)
+            logger.warning(f'Database pool exhausted: {self.status()}')
+            raise
+        self.stats.record(time.perf_counter() - start, self.slow_checkout)
+        return connection
+
+
+def build_engine_options(config: Dict[str, Any], profile: str) -> Dict[str, Any]:
+    """
+    Параметры create_engine для профиля процесса.
+
+    К общим SQLALCHEMY_ENGINE_OPTIONS добавляются размеры пула профиля.
+    Без пула приложения (pool_size 0 или DB_PGBOUNCER) используется
+    NullPool: при transaction pooling PgBouncer сам раздает серверные
+    соединения, а проверка pre-ping для только что открытого соединения
+    не нужна.
+
+    Raises:
+        ValueError: Если профиль не описан в DB_POOL_PROFILES
+    """
+    profiles = config['DB_POOL_PROFILES']
+    if profile not in profiles:
+        raise ValueError(f'Unknown database pool profile: {profile}')
+    options = dict(config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    for name in QUEUE_POOL_OPTIONS:
+        options.pop(name, None)
+    settings = profiles[profile]
+
+    # SQLite (тесты, локальный запуск): пул выбирает Flask-SQLAlchemy,
+    # для базы в памяти это StaticPool без параметров очереди
+    if str(config.get('SQLALCHEMY_DATABASE_URI', '')).startswith('sqlite'):
+        return options
+
+    if config.get('DB_PGBOUNCER') or not settings.get('pool_size'):
+        options['poolclass'] = NullPool
+        options.pop('pool_pre_ping', None)
+        return options
+
+    options.update(settings)
+    options['poolclass'] = InstrumentedQueuePool
+    return options
+
+
+def configure_pool(app: Any, profile: Optional[str] = None) -> str:
+    """
+    Выбор профиля пула соединений при создании приложения.
+
+    Вызывается до configure_replicas и db.init_app: Flask-SQLAlchemy
+    применяет SQLALCHEMY_ENGINE_OPTIONS ко всем bind, поэтому реплики
+    получают тот же профиль.
+
+    Args:
+        app: Flask приложение
+        profile: web, realtime, worker или cli; по умолчанию DB_POOL_PROFILE
+
+    Returns:
+        str: Имя выбранного профиля
+    """
+    profile = profile or app.config['DB_POOL_PROFILE']
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = build_engine_options(app.config, profile)
+    app.config['DB_POOL_PROFILE'] = profile
+    InstrumentedQueuePool.slow_checkout = app.config['DB_POOL_SLOW_CHECKOUT']
+    app.logger.info(f'Database pool profile: {profile}')
+    return profile
+
+
+def dispose_engines() -> None:
+    """
+    Сброс унаследованных соединений после fork.
+
+    Дочерний процесс не должен пользоваться сокетами родителя; close=False
+    оставляет их открытыми для родителя, а ребенок создает свои.
+    """
+    for engine in db.engines.values():
+        engine.dispose(close=False)
+
+
+def pool_status() -> List[Dict[str, Any]]:
+    """
+    Состояние пулов соединений текущего процесса для /metrics.
+
+    saturation - доля занятых соединений от предела pool_size + max_overflow.
+    """
+    status = []
+    for key, engine in db.engines.items():
+        pool = engine.pool
+        entry = {
+            'bind': key or 'primary',
+            'profile': current_app.config['DB_POOL_PROFILE'],
+            'pid': os.getpid(),
+            'pool': type(pool).__name__
+        }
+        if isinstance(pool, QueuePool):
+            capacity = pool.size() + pool._max_overflow if pool._max_overflow >= 0 else None
+            checked_out = pool.checkedout()
+            entry.update({
+                'size': pool.size(),
+                'max_overflow': pool._max_overflow,
+                'checked_out': checked_out,
+                'checked_in': pool.checkedin(),
+                'overflow': pool.overflow(),
+                'saturation': checked_out / capacity if capacity else None
+            })
+        if isinstance(pool, InstrumentedQueuePool):
+            entry.update(pool.stats.snapshot())
+        status.append(entry)
+    return status
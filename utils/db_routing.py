@@ -0,0 +1,170 @@
+from flask import current_app, g, has_app_context, has_request_context, request, session
+from flask_sqlalchemy.session import Session
+from contextlib import contextmanager
+from functools import wraps
+from sqlalchemy import text
+from sqlalchemy.sql.dml import UpdateBase
+from typing import Any, Callable, Dict, List, Optional
+from utils.tiered_cache import LocalCache
+import logging
+import random
+import time
+
+logger = logging.getLogger(__name__)
+
+REPLICA_BIND_PREFIX = 'replica_'
+# Ключ Flask-сессии: до какого времени запросы пользователя идут на основную базу
+PRIMARY_UNTIL_KEY = '_db_primary_until'
+
+# Отставание реплики в секундах; 0, если все полученные WAL уже применены
+REPLICA_LAG_SQL = text(
+    'SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 '
+    'ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END'
+)
+
+_lag_cache = LocalCache(max_size=64, default_ttl=60)
+
+
+def configure_replicas(app: Any) -> None:
+    """
+    Регистрация реплик как дополнительных bind Flask-SQLAlchemy.
+
+    Вызывается до db.init_app, чтобы движки реплик создавались вместе с
+    основным и с теми же SQLALCHEMY_ENGINE_OPTIONS.
+    """
+    binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+    for index, uri in enumerate(app.config.get('SQLALCHEMY_REPLICA_URIS') or []):
+        binds[f'{REPLICA_BIND_PREFIX}{index}'] = uri
+    app.config['SQLALCHEMY_BINDS'] = binds
+
+    @app.after_request
+    def stick_to_primary(response: Any) -> Any:
+        # Запросы пользователя после записи читают с основной базы, пока
+        # реплики не догонят изменения (read-your-writes)
+        if g.get('db_wrote') and app.config['SQLALCHEMY_REPLICA_URIS']:
+            session[PRIMARY_UNTIL_KEY] = time.time() + app.config['REPLICA_STICKINESS']
+        return response
+
+
+def replica_reads(f: Callable) -> Callable:
+    """
+    Декоратор представлений, чтение которых допускает отставание реплики.
+
+    Действует только для GET и HEAD; запись в рамках такого запроса все
+    равно идет на основную базу.
+    """
+    @wraps(f)
+    def decorated(*args: Any, **kwargs: Any) -> Any:
+        if request.method in ('GET', 'HEAD'):
+            g.db_read_only = True
+        return f(*args, **kwargs)
+    return decorated
+
+
+@contextmanager
+def primary_reads():
+    """
+    Чтение с основной базы внутри блока.
+
+    Используется при заполнении общих кэшей: значение, прочитанное с
+    отстающей реплики, осталось бы в кэше под уже новым поколением.
+    """
+    if not has_request_context():
+        yield
+        return
+    previous = g.get('db_read_only')
+    g.db_read_only = False
+    try:
+        yield
+    finally:
+        g.db_read_only = previous
+
+
+def _mark_write() -> None:
+    if has_app_context():
+        g.db_wrote = True
+
+
+def _replica_allowed() -> bool:
+    if not has_request_context() or not g.get('db_read_only') or g.get('db_wrote'):
+        return False
+    return session.get(PRIMARY_UNTIL_KEY, 0) <= time.time()
+
+
+def _measure_lag(name: str, engine: Any) -> Optional[float]:
+    """Отставание реплики в секундах или None, если реплика недоступна."""
+    hit, lag = _lag_cache.get(name)
+    if hit:
+        return lag
+    try:
+        with engine.connect() as connection:
+            if connection.dialect.name == 'postgresql':
+                lag = float(connection.execute(REPLICA_LAG_SQL).scalar() or 0)
+            else:
+                lag = 0.0
+    except Exception as e:
+        logger.error(f'Error checking lag of {name}: {str(e)}')
+        lag = None
+    _lag_cache.set(name, lag, ttl=current_app.config['REPLICA_LAG_CHECK_INTERVAL'])
+    return lag
+
+
+def _replica_engines(engines: Dict[Optional[str], Any]) -> Dict[str, Any]:
+    return {
+        key: engine for key, engine in engines.items()
+        if key is not None and key.startswith(REPLICA_BIND_PREFIX)
+    }
+
+
+def replica_status() -> List[Dict[str, Any]]:
+    """
+    Состояние реплик для эндпоинта метрик.
+
+    Returns:
+        List[Dict[str, Any]]: Имя, отставание в секундах и признак использования
+    """
+    from models import db
+
+    max_lag = current_app.config['REPLICA_MAX_LAG']
+    status = []
+    for name, engine in sorted(_replica_engines(db.engines).items()):
+        lag = _measure_lag(name, engine)
+        status.append({
+            'name': name,
+            'lag_seconds': lag,
+            'available': lag is not None and lag <= max_lag
+        })
+    return status
+
+
+class RoutingSession(Session):
+    """
+    Сессия, направляющая чтение в запросах replica_reads на реплики.
+
+    Запись (flush и DML-выражения) всегда идет на основную базу. После
+    первой записи сессия до конца запроса читает с основной базы. Реплика
+    выбирается один раз на сессию среди тех, чье отставание не превышает
+    REPLICA_MAX_LAG; если таких нет, используется основная база.
+    """
+
+    def get_bind(self, mapper: Any = None, clause: Any = None, bind: Any = None, **kwargs: Any) -> Any:
+        if bind is None:
+            if self._flushing or isinstance(clause, UpdateBase):
+                _mark_write()
+            elif _replica_allowed():
+                replica = self._choose_replica()
+                if replica is not None:
+                    return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+    def _choose_replica(self) -> Optional[Any]:
+        if 'replica' not in self.info:
+            replicas = _replica_engines(self._db.engines)
+            max_lag = current_app.config['REPLICA_MAX_LAG']
+            healthy = []
+            for name, engine in replicas.items():
+                lag = _measure_lag(name, engine)
+                if lag is not None and lag <= max_lag:
+                    healthy.append(engine)
+            self.info['replica'] = random.choice(healthy) if healthy else None
+        return self.info['replica']
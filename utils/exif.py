@@ -0,0 +1,284 @@
+from PIL import Image, ImageOps
+import logging
+import os
+import struct
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+# Тег ориентации EXIF
+ORIENTATION = 0x0112
+
+# Сегменты APPn JPEG, которые остаются: JFIF и Adobe (нужен декодеру для
+# выбора цветового пространства); ICC-профиль в APP2 проверяется отдельно
+JPEG_KEEP_APP = {0xE0: b'JFIF\x00', 0xEE: b'Adobe'}
+JPEG_ICC = b'ICC_PROFILE\x00'
+
+# Текстовые и временные чанки PNG; iCCP и остальное остается
+PNG_DROP = {b'eXIf', b'tEXt', b'zTXt', b'iTXt', b'tIME'}
+
+# Чанки метаданных WebP и соответствующие им флаги VP8X
+WEBP_DROP = {b'EXIF': 0x08, b'XMP ': 0x04}
+
+
+class MetadataError(ValueError):
+    """Структура файла не разобрана, нужна перекодировка."""
+
+
+def _jpeg_strip(data):
+    """
+    Копия JPEG без сегментов метаданных.
+
+    Разбираются только заголовки сегментов; данные сканов копируются как
+    есть. Все после EOI (вторые кадры MPF, хвосты редакторов) отбрасывается.
+    """
+    if data[:2] != b'\xff\xd8':
+        raise MetadataError('Missing SOI marker')
+    out = [b'\xff\xd8']
+    pos = 2
+    size = len(data)
+    while pos < size:
+        if data[pos] != 0xFF:
+            raise MetadataError(f'Expected marker at {pos}')
+        marker = data[pos + 1] if pos + 1 < size else None
+        if marker == 0xFF:
+            # Заполняющий байт перед маркером
+            pos += 1
+            continue
+        if marker is None:
+            raise MetadataError('Truncated marker')
+        if marker == 0xD9:
+            out.append(b'\xff\xd9')
+            return b''.join(out)
+        if 0xD0 <= marker <= 0xD7 or marker == 0x01:
+            out.append(data[pos:pos + 2])
+            pos += 2
+            continue
+
+        if pos + 4 > size:
+            raise MetadataError('Truncated segment header')
+        (length,) = struct.unpack('>H', data[pos + 2:pos + 4])
+        end = pos + 2 + length
+        if length < 2 or end > size:
+            raise MetadataError(f'Bad segment length at {pos}')
+        payload = data[pos + 4:end]
+
+        if 0xE0 <= marker <= 0xEF:
+            keep = (payload.startswith(JPEG_KEEP_APP[marker]) if marker in JPEG_KEEP_APP
+                    else marker == 0xE2 and payload.startswith(JPEG_ICC))
+        else:
+            keep = marker != 0xFE
+        if keep:
+            out.append(data[pos:end])
+        pos = end
+
+        if marker == 0xDA:
+            # Энтропийно-кодированные данные скана: 0xFF внутри них всегда
+            # экранирован 0x00, маркеры RSTn сканом не заканчиваются
+            scan_start = pos
+            while True:
+                pos = data.find(b'\xff', pos)
+                if pos < 0 or pos + 1 >= size:
+                    raise MetadataError('Unterminated scan')
+                following = data[pos + 1]
+                if following == 0x00 or 0xD0 <= following <= 0xD7:
+                    pos += 2
+                    continue
+                if following == 0xFF:
+                    pos += 1
+                    continue
+                break
+            out.append(data[scan_start:pos])
+    raise MetadataError('Missing EOI marker')
+
+
+def _png_strip(data):
+    """Копия PNG без текстовых чанков и eXIf; CRC остальных не меняется."""
+    if data[:8] != b'\x89PNG\r\n\x1a\n':
+        raise MetadataError('Missing PNG signature')
+    out = [data[:8]]
+    pos = 8
+    while pos < len(data):
+        if pos + 8 > len(data):
+            raise MetadataError('Truncated chunk header')
+        length, kind = struct.unpack('>I4s', data[pos:pos + 8])
+        end = pos + 12 + length
+        if end > len(data):
+            raise MetadataError(f'Bad chunk length at {pos}')
+        if kind not in PNG_DROP:
+            out.append(data[pos:end])
+        pos = end
+        if kind == b'IEND':
+            return b''.join(out)
+    raise MetadataError('Missing IEND chunk')
+
+
+def _webp_strip(data):
+    """Копия WebP без чанков EXIF и XMP со сброшенными флагами VP8X."""
+    if data[:4] != b'RIFF' or data[8:12] != b'WEBP':
+        raise MetadataError('Missing RIFF/WEBP header')
+    chunks = []
+    pos = 12
+    while pos < len(data):
+        if pos + 8 > len(data):
+            raise MetadataError('Truncated chunk header')
+        kind, length = struct.unpack('<4sI', data[pos:pos + 8])
+        end = pos + 8 + length + (length & 1)
+        if end > len(data):
+            raise MetadataError(f'Bad chunk length at {pos}')
+        chunks.append((kind, data[pos:end]))
+        pos = end
+
+    flags_clear = 0
+    body = []
+    for kind, chunk in chunks:
+        if kind in WEBP_DROP:
+            flags_clear |= WEBP_DROP[kind]
+            continue
+        body.append(chunk)
+    if flags_clear and body and body[0][:4] == b'VP8X':
+        header = bytearray(body[0])
+        header[8] &= ~flags_clear & 0xFF
+        body[0] = bytes(header)
+    payload = b'WEBP' + b''.join(body)
+    return b'RIFF' + struct.pack('<I', len(payload)) + payload
+
+
+# Pillow открывает JPEG с сегментом MPF (снимки телефонов) как MPO;
+# дополнительные кадры после первого EOI отрезаются вместе с метаданными
+LOSSLESS = {'JPEG': _jpeg_strip, 'MPO': _jpeg_strip, 'PNG': _png_strip, 'WEBP': _webp_strip}
+
+# Форматы, в которых нет EXIF
+NO_METADATA = {'GIF'}
+
+
+def _replace(path, write):
+    """Запись файла через временный файл рядом с ним и os.replace."""
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            write(out)
+        os.replace(temp_path, path)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def _reencode(path, image):
+    """
+    Перекодирование без метаданных из внутреннего буфера Pillow.
+
+    Ориентация из EXIF применяется к пикселям, так как сам тег удаляется.
+    ICC-профиль сохраняется, чтобы не исказить цвета.
+    """
+    # MPO перекодируется в JPEG по первому кадру
+    image_format = 'JPEG' if image.format == 'MPO' else image.format
+    icc_profile = image.info.get('icc_profile')
+    if image.format != 'MPO' and getattr(image, 'is_animated', False):
+        clean = image
+        params = {'save_all': True}
+    else:
+        clean = ImageOps.exif_transpose(image)
+        clean.info = {}
+        params = {}
+
+    params.update(format=image_format, exif=b'', xmp=b'')
+    if icc_profile:
+        params['icc_profile'] = icc_profile
+    if image_format in ('JPEG', 'WEBP'):
+        params['quality'] = 95
+    _replace(path, lambda out: clean.save(out, **params))
+
+
+def strip_metadata(path):
+    """
+    Удаление EXIF, XMP и текстовых метаданных из изображения на месте.
+
+    Для JPEG (в том числе MPO), PNG и WebP без поворота в EXIF файл
+    переписывается по сегментам без декодирования пикселей. Если нужен
+    поворот, структура не разобрана или формат другой, изображение
+    перекодируется.
+
+    Args:
+        path: Путь к изображению
+
+    Returns:
+        str: 'lossless', 'reencoded' или 'skipped' для форматов без
+        EXIF (GIF)
+    """
+    with Image.open(path) as image:
+        image_format = image.format
+        if image_format in NO_METADATA:
+            return 'skipped'
+        # getexif читает только заголовки, пиксели не декодируются
+        orientation = image.getexif().get(ORIENTATION, 1)
+        strip = LOSSLESS.get(image_format)
+        if strip is not None and orientation == 1:
+            with open(path, 'rb') as f:
+                data = f.read()
+            try:
+                cleaned = strip(data)
+            except MetadataError as e:
+                logger.warning(f'Lossless metadata strip failed for {path}: {str(e)}')
+            else:
+                if cleaned != data:
+                    _replace(path, lambda out: out.write(cleaned))
+                return 'lossless'
+        _reencode(path, image)
+        return 'reencoded'
+
+
+def _pixel_copy(path):
+    """Прежний способ очистки: копирование пикселей через getdata/putdata."""
+    with Image.open(path) as image:
+        data = list(image.getdata())
+        clean = Image.new(image.mode, image.size)
+        clean.putdata(data)
+        params = {'quality': 95} if image.format in ('JPEG', 'WEBP') else {}
+        _replace(path, lambda out: clean.save(out, format=image.format, **params))
+
+
+def benchmark(paths, repeat=3):
+    """
+    Сравнение strip_metadata с копированием пикселей.
+
+    Каждый способ запускается repeat раз на копии файла во временном
+    каталоге. Пиковая память считается через tracemalloc и учитывает
+    только объекты Python: буферы Pillow в нее не входят, а список
+    кортежей getdata - входит.
+
+    Args:
+        paths: Пути к изображениям
+        repeat: Количество повторов
+
+    Returns:
+        List[Dict]: Для каждого файла - размер, режим strip_metadata и
+        лучшее время и пиковая память каждого способа
+    """
+    import shutil
+    import time
+    import tracemalloc
+
+    methods = {'pixel_copy': _pixel_copy, 'strip_metadata': strip_metadata}
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for path in paths:
+            entry = {'path': path, 'bytes': os.path.getsize(path)}
+            for name, method in methods.items():
+                best, peak = None, 0
+                for _ in range(repeat):
+                    copy = os.path.join(workdir, os.path.basename(path))
+                    shutil.copyfile(path, copy)
+                    tracemalloc.start()
+                    start = time.perf_counter()
+                    outcome = method(copy)
+                    elapsed = time.perf_counter() - start
+                    peak = max(peak, tracemalloc.get_traced_memory()[1])
+                    tracemalloc.stop()
+                    best = elapsed if best is None else min(best, elapsed)
+                    if name == 'strip_metadata':
+                        entry['mode'] = outcome
+                entry[name] = {'seconds': best, 'peak_bytes': peak, 'result_bytes': os.path.getsize(copy)}
+            results.append(entry)
+    return results
@@ -1,6 +1,3 @@
-import os
-from werkzeug.utils import secure_filename
-from flask import current_app
 import magic
 
 def allowed_file(filename):
@@ -9,14 +6,19 @@ def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def save_file(file, folder='uploads'):
-    """Сохраняет загруженный файл."""
+def save_file(file, **fields):
+    """
+    Сохраняет загруженный файл в хранилище по хешу содержимого.
+
+    Returns:
+        Tuple[File, bool]: Несохраненный File и признак нового содержимого
+        или None, если тип файла не разрешен
+    """
+    # utils импортируется из models, поэтому хранилище подключается лениво
+    from utils.blobs import store_upload
+
     if file and allowed_file(file.filename):
-        filename = secure_filename(file.filename)
-        file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], folder, filename)
-        os.makedirs(os.path.dirname(file_path), exist_ok=True)
-        file.save(file_path)
-        return filename
+        return store_upload(file, **fields)
     return None
 
 def check_ban(user):
@@ -0,0 +1,103 @@
+from flask import current_app, request, session, make_response
+from datetime import timezone
+from functools import wraps
+from hashlib import sha1
+from utils.cache import get_generations, get_thread_snapshot
+from utils.render_cache import is_cacheable_request
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def compute_etag(*scopes):
+    """
+    ETag ответа по поколениям областей кэша.
+
+    Поколения читаются из локального уровня или одним MGET, поэтому ETag
+    считается без обращения к базе данных. В хэш входят URL и язык, так как
+    от них зависит тело ответа.
+    """
+    scopes = ('global',) + tuple(scopes)
+    generations = get_generations(*scopes)
+    lang = session.get('language', current_app.config['BABEL_DEFAULT_LOCALE'])
+    parts = [request.full_path, lang] + [f'{scope}.{generation}' for scope, generation in zip(scopes, generations)]
+    return sha1('|'.join(parts).encode('utf-8')).hexdigest()
+
+
+def _to_http_date(value):
+    if value is None:
+        return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.replace(microsecond=0)
+
+
+def is_not_modified(etag, weak=True, last_modified=None):
+    """
+    Проверка условных заголовков запроса.
+
+    If-None-Match имеет приоритет над If-Modified-Since, как требует RFC 9110.
+    """
+    if request.if_none_match:
+        if weak:
+            return request.if_none_match.contains_weak(etag)
+        return request.if_none_match.contains(etag)
+    if last_modified is not None and request.if_modified_since is not None:
+        return last_modified <= request.if_modified_since
+    return False
+
+
+def conditional(scopes, last_modified=None, weak=True, public=True):
+    """
+    Поддержка условных GET с ответом 304 до выполнения представления.
+
+    Args:
+        scopes: Функция от аргументов маршрута, возвращающая области кэша
+        last_modified: Функция от аргументов маршрута, возвращающая время
+            последнего изменения ресурса или None
+        weak: Использовать слабый ETag
+        public: Ответ не зависит от пользователя (API). HTML-страницы
+            обрабатываются только для анонимных запросов, как в кэше страниц
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return f(*args, **kwargs)
+            if not public and not is_cacheable_request():
+                return f(*args, **kwargs)
+            try:
+                etag = compute_etag(*scopes(*args, **kwargs))
+                modified = _to_http_date(last_modified(*args, **kwargs)) if last_modified else None
+            except Exception as e:
+                logger.error(f'Error computing ETag for {request.path}: {str(e)}')
+                return f(*args, **kwargs)
+
+            if is_not_modified(etag, weak, modified):
+                response = current_app.response_class(status=304)
+            else:
+                response = make_response(f(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+
+            response.set_etag(etag, weak=weak)
+            if modified is not None:
+                response.last_modified = modified
+            response.cache_control.no_cache = True
+            if public:
+                response.cache_control.public = True
+            else:
+                response.vary.add('Cookie')
+            return response
+        return decorated_function
+    return decorator
+
+
+def thread_last_modified(thread_id):
+    """Время последнего изменения треда из его снимка."""
+    snapshot = get_thread_snapshot(thread_id)
+    if snapshot is None:
+        return None
+    thread = snapshot.thread
+    candidates = [value for value in (thread.updated_at, thread.last_reply_at, thread.created_at) if value]
+    return max(candidates) if candidates else None
@@ -0,0 +1,142 @@
+from dataclasses import dataclass
+from flask import current_app
+from werkzeug.utils import secure_filename
+import hashlib
+import logging
+import magic
+import os
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+TEMP_DIR = 'tmp'
+
+# Сколько первых байт нужно libmagic для определения типа
+SNIFF_BYTES = 2048
+
+# Принимаемые типы содержимого и расширение, под которым они хранятся
+UPLOAD_TYPES = {
+    'image/jpeg': '.jpg',
+    'image/png': '.png',
+    'image/gif': '.gif',
+    'image/webp': '.webp',
+    'video/mp4': '.mp4',
+    'video/webm': '.webm',
+}
+
+
+class UploadRejected(ValueError):
+    """Загрузка отклонена: недопустимый тип или превышен размер."""
+
+
+@dataclass
+class IngestedUpload:
+    """Загрузка, принятая во временный файл."""
+    temp_path: str
+    sha256: str
+    size: int
+    mime_type: str
+    extension: str
+    original_filename: str
+
+
+def _allowed_types():
+    allowed = {f'.{extension}' for extension in current_app.config['ALLOWED_EXTENSIONS']}
+    return {mime: extension for mime, extension in UPLOAD_TYPES.items() if extension in allowed}
+
+
+def size_limit(mime_type):
+    """Максимальный размер загрузки данного типа в байтах."""
+    if mime_type.startswith('video/'):
+        return current_app.config['MAX_VIDEO_BYTES']
+    return current_app.config['MAX_IMAGE_BYTES']
+
+
+def _sniff(head):
+    """Тип содержимого по первым байтам и лимит размера для него."""
+    mime_type = magic.from_buffer(head, mime=True)
+    if mime_type not in _allowed_types():
+        raise UploadRejected(f'Недопустимый тип файла: {mime_type}')
+    return mime_type, size_limit(mime_type)
+
+
+def ingest(upload):
+    """
+    Прием загрузки за один проход по потоку.
+
+    Поток читается кусками UPLOAD_CHUNK_SIZE. По первым SNIFF_BYTES
+    определяется тип содержимого, имя клиента на тип не влияет. Каждый
+    кусок сразу хешируется и пишется во временный файл в UPLOAD_FOLDER;
+    чтение прекращается, как только превышен лимит размера для типа.
+
+    Args:
+        upload: FileStorage из формы
+
+    Returns:
+        IngestedUpload: Временный файл, хеш, размер и тип
+
+    Raises:
+        UploadRejected: Если тип не разрешен или файл слишком большой
+    """
+    chunk_size = current_app.config['UPLOAD_CHUNK_SIZE']
+    temp_dir = os.path.join(current_app.config['UPLOAD_FOLDER'], TEMP_DIR)
+    os.makedirs(temp_dir, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=temp_dir)
+
+    hasher = hashlib.sha256()
+    size = 0
+    head = b''
+    mime_type = None
+    limit = None
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            while True:
+                chunk = upload.stream.read(chunk_size)
+                if not chunk:
+                    break
+                hasher.update(chunk)
+                out.write(chunk)
+                size += len(chunk)
+                if mime_type is None:
+                    head += chunk[:SNIFF_BYTES - len(head)]
+                    if len(head) < SNIFF_BYTES:
+                        continue
+                    mime_type, limit = _sniff(head)
+                if size > limit:
+                    raise UploadRejected(f'Файл больше {limit // (1024 * 1024)} МБ')
+        # Файл короче SNIFF_BYTES
+        if mime_type is None:
+            if size == 0:
+                raise UploadRejected('Пустой файл')
+            mime_type, limit = _sniff(head)
+    except Exception:
+        os.remove(temp_path)
+        raise
+
+    return IngestedUpload(
+        temp_path=temp_path,
+        sha256=hasher.hexdigest(),
+        size=size,
+        mime_type=mime_type,
+        extension=_allowed_types()[mime_type],
+        original_filename=secure_filename(upload.filename or '') or 'file'
+    )
+
+
+def place(ingested, path):
+    """
+    Перенос принятой загрузки на постоянное место.
+
+    os.replace в пределах одной файловой системы атомарен: читатели видят
+    либо старый файл, либо полностью записанный новый.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    os.replace(ingested.temp_path, path)
+
+
+def discard(ingested):
+    """Удаление временного файла загрузки, если он еще существует."""
+    try:
+        os.remove(ingested.temp_path)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,218 @@
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, List, Optional, Sequence
+import base64
+import json
+import logging
+
+from sqlalchemy import func, tuple_
+
+from models import Thread, Post
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class SortKey:
+    """
+    Поле ключа курсорной пагинации.
+
+    Attributes:
+        name: Имя атрибута объекта выборки
+        column: Колонка модели
+        default: Значение вместо NULL, чтобы строки с NULL участвовали
+            в сравнении кортежей
+    """
+    name: str
+    column: Any
+    default: Any = None
+
+    @property
+    def expression(self) -> Any:
+        if self.default is None:
+            return self.column
+        return func.coalesce(self.column, self.default)
+
+    def value(self, item: Any) -> Any:
+        value = getattr(item, self.name)
+        return self.default if value is None else value
+
+
+class KeysetPage:
+    """
+    Страница курсорной пагинации.
+
+    Вместо номеров страниц содержит курсоры соседних страниц. Общее
+    количество считается только по запросу.
+    """
+
+    def __init__(self, items: List[Any], per_page: int, next_cursor: Optional[str] = None,
+                 prev_cursor: Optional[str] = None, total: Optional[int] = None) -> None:
+        self.items = items
+        self.per_page = per_page
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.total = total
+
+    @property
+    def has_next(self) -> bool:
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self) -> bool:
+        return self.prev_cursor is not None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    @classmethod
+    def from_items(cls, items: List[Any], keys: Sequence[SortKey], per_page: int,
+                   has_next: bool, has_prev: bool = False,
+                   total: Optional[int] = None) -> 'KeysetPage':
+        """Сборка страницы с курсорами по крайним элементам."""
+        next_cursor = encode_cursor(keys, items[-1]) if items and has_next else None
+        prev_cursor = encode_cursor(keys, items[0]) if items and has_prev else None
+        return cls(items, per_page, next_cursor, prev_cursor, total)
+
+
+def _dump_value(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return {'dt': value.isoformat()}
+    return value
+
+
+def _load_value(value: Any) -> Any:
+    if isinstance(value, dict):
+        return datetime.fromisoformat(value['dt'])
+    return value
+
+
+def _matches(key: SortKey, value: Any) -> bool:
+    """Соответствие значения курсора типу колонки ключа."""
+    try:
+        expected = key.column.type.python_type
+    except NotImplementedError:
+        return True
+    if isinstance(value, bool) and expected is not bool:
+        return False
+    return isinstance(value, expected)
+
+
+def encode_cursor(keys: Sequence[SortKey], item: Any) -> str:
+    """Кодирование значений ключа элемента в непрозрачный курсор."""
+    raw = json.dumps([_dump_value(key.value(item)) for key in keys], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(keys: Sequence[SortKey], cursor: str) -> List[Any]:
+    """
+    Декодирование курсора.
+
+    Raises:
+        ValueError: Если курсор поврежден или не соответствует ключу
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        if not isinstance(values, list):
+            raise ValueError('not a list')
+        values = [_load_value(value) for value in values]
+    except (TypeError, ValueError, KeyError, UnicodeError) as e:
+        raise ValueError(f'Invalid cursor: {str(e)}')
+    if len(values) != len(keys) or not all(_matches(key, value) for key, value in zip(keys, values)):
+        raise ValueError('Invalid cursor')
+    return values
+
+
+def build_keyset_query(query: Any, keys: Sequence[SortKey], limit: int,
+                       cursor: Optional[Sequence[Any]] = None, descending: bool = True) -> Any:
+    """
+    Запрос одной страницы по ключу без выполнения.
+
+    Используется пагинацией и проверкой планов запросов (explain-check).
+
+    Args:
+        query: Запрос без сортировки
+        keys: Поля ключа
+        limit: Количество строк
+        cursor: Декодированные значения ключа границы страницы
+        descending: Направление выборки
+    """
+    expressions = [key.expression for key in keys]
+    if cursor is not None:
+        row = tuple_(*expressions)
+        bound = tuple_(*cursor)
+        query = query.filter(row < bound if descending else row > bound)
+    order = [expr.desc() if descending else expr.asc() for expr in expressions]
+    return query.order_by(*order).limit(limit)
+
+
+def keyset_paginate(query: Any, keys: Sequence[SortKey], per_page: int,
+                    after: Optional[str] = None, before: Optional[str] = None,
+                    descending: bool = True, with_total: bool = False) -> KeysetPage:
+    """
+    Курсорная пагинация запроса.
+
+    Страница выбирается сравнением кортежа ключа с курсором и LIMIT, без
+    OFFSET, поэтому стоимость не зависит от глубины страницы. Все поля ключа
+    сортируются в одном направлении, последнее поле должно быть уникальным.
+
+    Args:
+        query: Запрос без сортировки
+        keys: Поля ключа
+        per_page: Размер страницы
+        after: Курсор, после которого начинается страница
+        before: Курсор, перед которым заканчивается страница; поврежденный
+            курсор игнорируется
+        descending: Сортировка по убыванию
+        with_total: Посчитать общее количество отдельным COUNT
+
+    Returns:
+        KeysetPage: Страница с курсорами соседних страниц
+    """
+    per_page = max(1, min(per_page, 100))
+    try:
+        cursor = decode_cursor(keys, after or before) if (after or before) else None
+    except ValueError as e:
+        # Битая или устаревшая ссылка ведет на первую страницу
+        logger.debug(f'Ignoring pagination cursor: {str(e)}')
+        cursor = None
+        after = before = None
+
+    # Для before выборка идет в обратную сторону и затем разворачивается
+    backwards = before is not None and after is None
+
+    total = query.order_by(None).count() if with_total else None
+
+    rows = build_keyset_query(query, keys, per_page + 1, cursor,
+                              descending=descending != backwards).all()
+
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if backwards:
+        rows.reverse()
+        return KeysetPage.from_items(rows, keys, per_page, has_next=True, has_prev=has_more, total=total)
+    return KeysetPage.from_items(rows, keys, per_page, has_next=has_more,
+                                 has_prev=cursor is not None, total=total)
+
+
+# Ключи пагинации тредов и постов. Колонки ключей объявлены NOT NULL, поэтому
+# сравнение идет по самим колонкам и совпадает с составными индексами моделей
+
+
+def _thread_keys(*keys: SortKey) -> tuple:
+    return (SortKey('is_pinned', Thread.is_pinned),) + keys + (SortKey('id', Thread.id),)
+
+
+THREAD_SORT_KEYS = {
+    'activity': _thread_keys(SortKey('last_reply_at', Thread.last_reply_at)),
+    'date': _thread_keys(SortKey('created_at', Thread.created_at)),
+    'replies': _thread_keys(SortKey('reply_count', Thread.reply_count)),
+}
+
+ARCHIVE_KEYS = (SortKey('archived_at', Thread.archived_at), SortKey('id', Thread.id))
+
+POST_KEYS = (SortKey('created_at', Post.created_at), SortKey('id', Post.id))
@@ -0,0 +1,169 @@
+from datetime import datetime
+from flask import current_app
+from models import db
+from sqlalchemy import text
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+# Таблицы, секционированные по месяцам created_at (миграция d7f3b5a9e1c6)
+PARTITIONED_TABLES = ('posts', 'files')
+
+PARTITION_BOUND_RE = re.compile(r"FROM \('([^']+)'\) TO \('([^']+)'\)")
+
+
+def month_start(value):
+    """Начало месяца даты."""
+    return datetime(value.year, value.month, 1)
+
+
+def add_months(value, months):
+    """Сдвиг начала месяца на указанное количество месяцев."""
+    index = value.year * 12 + value.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(table, month):
+    """Имя секции таблицы за месяц, например posts_p2026_10."""
+    return f'{table}_p{month:%Y_%m}'
+
+
+def is_partitioned(connection, table):
+    """Проверка, что таблица секционирована (только PostgreSQL)."""
+    if connection.dialect.name != 'postgresql':
+        return False
+    return connection.execute(text(
+        'SELECT 1 FROM pg_partitioned_table pt '
+        'JOIN pg_class c ON c.oid = pt.partrelid '
+        'JOIN pg_namespace n ON n.oid = c.relnamespace '
+        'WHERE c.relname = :table AND n.nspname = current_schema()'
+    ), {'table': table}).first() is not None
+
+
+def list_partitions(connection, table):
+    """
+    Секции таблицы.
+
+    Returns:
+        List[Tuple[str, datetime, datetime]]: Имя, нижняя и верхняя граница
+    """
+    rows = connection.execute(text(
+        'SELECT child.relname, pg_get_expr(child.relpartbound, child.oid) '
+        'FROM pg_inherits i '
+        'JOIN pg_class parent ON parent.oid = i.inhparent '
+        'JOIN pg_class child ON child.oid = i.inhrelid '
+        'JOIN pg_namespace n ON n.oid = parent.relnamespace '
+        'WHERE parent.relname = :table AND n.nspname = current_schema() '
+        'ORDER BY child.relname'
+    ), {'table': table}).all()
+    partitions = []
+    for name, bound in rows:
+        match = PARTITION_BOUND_RE.search(bound or '')
+        if match:
+            partitions.append((name, datetime.fromisoformat(match.group(1)),
+                               datetime.fromisoformat(match.group(2))))
+    return partitions
+
+
+def create_partition(connection, table, month):
+    """Создание секции таблицы за месяц, если ее еще нет."""
+    name = partition_name(table, month)
+    connection.execute(text(
+        f'CREATE TABLE IF NOT EXISTS {name} PARTITION OF {table} '
+        f"FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{add_months(month, 1):%Y-%m-%d}')"
+    ))
+    return name
+
+
+def ensure_partitions(months_ahead=None):
+    """
+    Создание секций текущего и следующих месяцев.
+
+    Секции создаются заранее, чтобы вставка в начале месяца не упиралась в
+    отсутствующую секцию и не брала блокировку на родительской таблице.
+
+    Args:
+        months_ahead: Сколько месяцев вперед, по умолчанию PARTITION_MONTHS_AHEAD
+
+    Returns:
+        List[str]: Имена созданных секций
+    """
+    months_ahead = current_app.config['PARTITION_MONTHS_AHEAD'] if months_ahead is None else months_ahead
+    connection = db.session.connection()
+    current = month_start(datetime.utcnow())
+    created = []
+    try:
+        for table in PARTITIONED_TABLES:
+            if not is_partitioned(connection, table):
+                continue
+            existing = {name for name, _, _ in list_partitions(connection, table)}
+            for offset in range(months_ahead + 1):
+                month = add_months(current, offset)
+                if partition_name(table, month) not in existing:
+                    created.append(create_partition(connection, table, month))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    if created:
+        logger.info(f'Created partitions: {", ".join(created)}')
+    return created
+
+
+def _month_has_live_threads(connection, month):
+    """Есть ли в секции posts месяца посты неархивированных тредов."""
+    return connection.execute(text(
+        f'SELECT 1 FROM {partition_name("posts", month)} p '
+        'JOIN threads t ON t.id = p.thread_id '
+        'WHERE NOT t.is_archived LIMIT 1'
+    )).first() is not None
+
+
+def detach_partitions(before, schema=None, force=False):
+    """
+    Отключение секций закончившихся месяцев в холодное хранилище.
+
+    Секции posts и files одного месяца отключаются вместе и переносятся в
+    отдельную схему, откуда их можно выгрузить pg_dump или удалить.
+    Месяц пропускается, если в нем есть посты неархивированных тредов.
+
+    Args:
+        before: Отключаются месяцы, закончившиеся не позже этой даты
+        schema: Схема холодного хранилища, по умолчанию PARTITION_COLD_SCHEMA
+        force: Отключать месяцы с постами живых тредов
+
+    Returns:
+        List[str]: Имена отключенных секций
+    """
+    schema = schema or current_app.config['PARTITION_COLD_SCHEMA']
+    connection = db.session.connection()
+    if not is_partitioned(connection, 'posts'):
+        raise RuntimeError('posts is not partitioned')
+
+    limit = month_start(before)
+    months = sorted({lower for _, lower, upper in list_partitions(connection, 'posts') if upper <= limit})
+    detached = []
+    try:
+        connection.execute(text(f'CREATE SCHEMA IF NOT EXISTS {schema}'))
+        for month in months:
+            if not force and _month_has_live_threads(connection, month):
+                logger.warning(f'Skipping {month:%Y-%m}: partition has posts of live threads')
+                continue
+            for table in PARTITIONED_TABLES:
+                name = partition_name(table, month)
+                existing = {partition for partition, _, _ in list_partitions(connection, table)}
+                if name not in existing:
+                    continue
+                connection.execute(text(f'ALTER TABLE {table} DETACH PARTITION {name}'))
+                connection.execute(text(f'ALTER TABLE {name} SET SCHEMA {schema}'))
+                detached.append(name)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    if detached:
+        logger.info(f'Detached partitions to {schema}: {", ".join(detached)}')
+    return detached
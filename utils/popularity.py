@@ -0,0 +1,145 @@
+from flask import current_app
+from models import db, Thread, Post, on_commit
+from sqlalchemy import event
+from datetime import datetime, timedelta
+from utils.cache import get_redis, cached_call, versioned_key
+import logging
+import time
+import redis
+
+logger = logging.getLogger(__name__)
+
+POPULAR_KEY = 'imageboard:popular:threads'
+POPULAR_EPOCH_KEY = 'imageboard:popular:epoch'
+
+# Предельный показатель степени веса. Сверка каждый раз сдвигает эпоху,
+# поэтому при работающем beat он не достигается
+MAX_DECAY_EXPONENT = 512
+
+
+def _decay_weight(timestamp, epoch, half_life):
+    """
+    Вес события с прямым затуханием.
+
+    Вместо уменьшения всех старых оценок каждое новое событие весит
+    2^((t - epoch) / half_life), поэтому порядок в sorted set совпадает с
+    порядком по экспоненциально затухающей активности.
+    """
+    return 2 ** ((timestamp - epoch) / half_life)
+
+
+def _get_epoch(client):
+    epoch = client.get(POPULAR_EPOCH_KEY)
+    if epoch is None:
+        epoch = time.time()
+        client.set(POPULAR_EPOCH_KEY, epoch, nx=True)
+        epoch = client.get(POPULAR_EPOCH_KEY) or epoch
+    return float(epoch)
+
+
+def bump_thread_popularity(thread_id, timestamp=None):
+    """
+    Увеличение оценки треда после нового поста.
+
+    Args:
+        thread_id: ID треда
+        timestamp: Время поста (UNIX), по умолчанию текущее
+    """
+    half_life = current_app.config['POPULAR_THREADS_HALF_LIFE']
+    timestamp = timestamp or time.time()
+    try:
+        client = get_redis()
+        epoch = _get_epoch(client)
+        exponent = (timestamp - epoch) / half_life
+        if exponent > MAX_DECAY_EXPONENT:
+            # Эпоху сдвигает периодическая сверка; без нее веса переполнятся
+            logger.warning('Popularity epoch is too old, waiting for reconciliation')
+            return
+        pipe = client.pipeline()
+        pipe.zincrby(POPULAR_KEY, _decay_weight(timestamp, epoch, half_life), thread_id)
+        # Держим множество ограниченным: хвост нам не нужен
+        pipe.zremrangebyrank(POPULAR_KEY, 0, -(current_app.config['POPULAR_THREADS_MAX_TRACKED'] + 1))
+        pipe.execute()
+    except redis.RedisError as e:
+        logger.error(f'Error bumping popularity of thread {thread_id}: {str(e)}')
+
+
+def rebuild_popular_threads():
+    """
+    Пересборка рейтинга из базы данных.
+
+    Используется для сверки и восстановления после сброса Redis. Оценки
+    считаются по постам за окно POPULAR_THREADS_WINDOW с новой эпохой и
+    атомарно подменяют текущее множество через RENAME.
+
+    Returns:
+        int: Количество тредов в рейтинге
+    """
+    half_life = current_app.config['POPULAR_THREADS_HALF_LIFE']
+    now = time.time()
+    since = datetime.utcnow() - timedelta(seconds=current_app.config['POPULAR_THREADS_WINDOW'])
+    epoch = now - current_app.config['POPULAR_THREADS_WINDOW']
+
+    rows = db.session.query(Post.thread_id, Post.created_at)\
+        .filter(Post.created_at >= since)\
+        .yield_per(1000)
+
+    scores = {}
+    for thread_id, created_at in rows:
+        timestamp = (created_at - datetime(1970, 1, 1)).total_seconds()
+        scores[thread_id] = scores.get(thread_id, 0.0) + _decay_weight(timestamp, epoch, half_life)
+
+    limit = current_app.config['POPULAR_THREADS_MAX_TRACKED']
+    top = dict(sorted(scores.items(), key=lambda item: item[1], reverse=True)[:limit])
+
+    client = get_redis()
+    tmp_key = f'{POPULAR_KEY}:rebuild'
+    pipe = client.pipeline()
+    pipe.delete(tmp_key)
+    if top:
+        pipe.zadd(tmp_key, top)
+        pipe.rename(tmp_key, POPULAR_KEY)
+    else:
+        pipe.delete(POPULAR_KEY)
+    pipe.set(POPULAR_EPOCH_KEY, epoch)
+    pipe.execute()
+    logger.info(f'Popular threads ranking rebuilt: {len(top)} threads')
+    return len(top)
+
+
+def _read_popular_thread_ids():
+    count = current_app.config['POPULAR_THREADS_COUNT']
+    client = get_redis()
+    if not client.exists(POPULAR_KEY):
+        rebuild_popular_threads()
+    ids = [int(thread_id) for thread_id in client.zrevrange(POPULAR_KEY, 0, count - 1)]
+    if not ids:
+        return []
+    # Удаленные треды отбрасываются здесь, чтобы в кэше лежал готовый порядок
+    existing = {thread_id for (thread_id,) in db.session.query(Thread.id).filter(Thread.id.in_(ids))}
+    return [thread_id for thread_id in ids if thread_id in existing]
+
+
+def get_popular_threads():
+    """
+    Получает список популярных тредов из рейтинга в Redis.
+
+    В кэше хранится только список ID: объекты Thread загружаются на
+    каждый запрос и не делятся между запросами и процессами.
+    """
+    cache_key = versioned_key(current_app.config['POPULAR_THREADS_CACHE_KEY'], 'threads')
+    ids = cached_call(
+        cache_key,
+        _read_popular_thread_ids,
+        timeout=current_app.config['THREAD_CACHE_TIMEOUT']
+    )
+    if not ids:
+        return []
+    threads = {thread.id: thread for thread in Thread.query.filter(Thread.id.in_(ids)).all()}
+    return [threads[thread_id] for thread_id in ids if thread_id in threads]
+
+
+@event.listens_for(Post, 'after_insert')
+def schedule_popularity_bump(mapper, connection, target):
+    """Обновление рейтинга треда после коммита нового поста."""
+    on_commit(target, bump_thread_popularity, target.thread_id)
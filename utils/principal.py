@@ -0,0 +1,111 @@
+from flask import current_app
+from flask_login import UserMixin
+from models import User, cache, on_commit
+from sqlalchemy import event
+from typing import Any, Dict, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Версия формата записи принципала в кэше
+PRINCIPAL_VERSION = 1
+
+PRINCIPAL_FIELDS = ('id', 'username', 'is_superadmin', 'is_banned', 'two_factor_enabled')
+
+
+def principal_cache_key(user_id: int) -> str:
+    """Ключ принципала пользователя в кэше."""
+    return f'principal:v{PRINCIPAL_VERSION}:{user_id}'
+
+
+class UserPrincipal(UserMixin):
+    """
+    Легковесный пользователь для Flask-Login.
+
+    Содержит только поля, нужные для проверки прав на каждом запросе.
+    Обращение к остальным атрибутам и методам, а также любая запись
+    атрибута загружают полную модель User одним запросом.
+    """
+
+    def __init__(self, data: Dict[str, Any]) -> None:
+        object.__setattr__(self, '_data', data)
+        object.__setattr__(self, '_user', None)
+
+    @property
+    def user(self) -> Optional[User]:
+        """Полная модель пользователя, загружаемая по требованию."""
+        if self._user is None:
+            object.__setattr__(self, '_user', User.query.get(self._data['id']))
+        return self._user
+
+    @property
+    def is_admin(self) -> bool:
+        return bool(self._data['is_superadmin'])
+
+    def __getattr__(self, name: str) -> Any:
+        if name.startswith('__'):
+            raise AttributeError(name)
+        data = object.__getattribute__(self, '_data')
+        if name in data:
+            return data[name]
+        return getattr(self.user, name)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        setattr(self.user, name, value)
+        if name in self._data:
+            self._data[name] = value
+
+    def __repr__(self) -> str:
+        return f'<UserPrincipal {self._data["username"]}>'
+
+
+def load_user_principal(user_id: int) -> Optional[UserPrincipal]:
+    """
+    Загрузка принципала пользователя для Flask-Login.
+
+    Запись берется из кэша с коротким TTL, поэтому авторизованные запросы
+    не обращаются к таблице users.
+
+    Args:
+        user_id: ID пользователя
+
+    Returns:
+        Optional[UserPrincipal]: Принципал или None, если пользователь не найден
+    """
+    key = principal_cache_key(user_id)
+    try:
+        data = cache.get(key)
+    except Exception as e:
+        logger.error(f'Error reading principal of user {user_id}: {str(e)}')
+        data = None
+    if data is not None:
+        return UserPrincipal(dict(data))
+
+    user = User.query.get(user_id)
+    if user is None:
+        return None
+    data = {field: getattr(user, field) for field in PRINCIPAL_FIELDS}
+    try:
+        cache.set(key, data, timeout=current_app.config['USER_PRINCIPAL_TIMEOUT'])
+    except Exception as e:
+        logger.error(f'Error caching principal of user {user_id}: {str(e)}')
+    principal = UserPrincipal(dict(data))
+    object.__setattr__(principal, '_user', user)
+    return principal
+
+
+def invalidate_user_principal(user_id: int) -> None:
+    """Инвалидирует принципала пользователя во всех процессах."""
+    cache.delete(principal_cache_key(user_id))
+
+
+@event.listens_for(User, 'after_update')
+def schedule_principal_invalidation(mapper, connection, target):
+    """Сброс принципала после коммита изменений пользователя (роль, бан, 2FA)."""
+    on_commit(target, invalidate_user_principal, target.id)
+
+
+@event.listens_for(User, 'after_delete')
+def schedule_principal_removal(mapper, connection, target):
+    """Сброс принципала после удаления пользователя."""
+    on_commit(target, invalidate_user_principal, target.id)
@@ -0,0 +1,252 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from flask import current_app
+from models import db, post_links, Board, Thread, Post, File, Report
+from sqlalchemy import func, or_, select
+from utils.blobs import blob_counts, release_blobs, removable_paths
+from utils.cache import bump_generations
+from utils.renditions import alternate_paths
+from utils.stats import adjust_total_posts
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def remove_files(paths, workers=None):
+    """
+    Параллельное удаление файлов с диска.
+
+    Удаление упирается в задержки файловой системы, а не в CPU, поэтому
+    выполняется пулом потоков. Отсутствующие файлы и файлы действующего
+    содержимого по хешу пропускаются.
+
+    Args:
+        paths: Пути к файлам
+        workers: Количество потоков, по умолчанию FILE_REMOVAL_WORKERS
+
+    Returns:
+        int: Количество удаленных файлов
+    """
+    paths = [path for path in paths if path]
+    if not paths:
+        return 0
+    workers = workers or current_app.config['FILE_REMOVAL_WORKERS']
+
+    def unlink(path):
+        try:
+            os.remove(path)
+            return True
+        except FileNotFoundError:
+            return False
+        except OSError as e:
+            logger.error(f'Error removing file {path}: {str(e)}')
+            return False
+
+    with removable_paths(paths) as removable:
+        if not removable:
+            return 0
+        with ThreadPoolExecutor(max_workers=min(workers, len(removable))) as executor:
+            removed = sum(executor.map(unlink, removable))
+    logger.info(f'Removed {removed} of {len(removable)} files')
+    return removed
+
+
+def schedule_file_removal(paths):
+    """
+    Передача путей удаленных файлов задаче remove_files.
+
+    Пути отправляются пачками по FILE_REMOVAL_CHUNK. Если брокер недоступен,
+    файлы удаляются сразу в текущем процессе.
+    """
+    from utils.tasks import remove_files as remove_files_task
+
+    paths = [path for path in paths if path]
+    chunk = current_app.config['FILE_REMOVAL_CHUNK']
+    for start in range(0, len(paths), chunk):
+        batch = paths[start:start + chunk]
+        try:
+            remove_files_task.delay(batch)
+        except Exception as e:
+            logger.error(f'Error scheduling removal of {len(batch)} files: {str(e)}')
+            remove_files(batch)
+
+
+def _file_rows(thread_ids):
+    """Файлы тредов: прикрепленные к треду напрямую и к его постам."""
+    files = File.__table__
+    posts = Post.__table__
+    threads = Thread.__table__
+    file_thread = func.coalesce(files.c.thread_id, posts.c.thread_id)
+    return db.session.execute(
+        select(files.c.file_path, files.c.thumbnail_path, files.c.preview_path, files.c.file_size, files.c.blob_id, threads.c.board_id)
+        .select_from(
+            files.outerjoin(posts, posts.c.id == files.c.post_id)
+            .join(threads, threads.c.id == file_thread)
+        )
+        .where(threads.c.id.in_(thread_ids))
+    ).all()
+
+
+def _post_counts(thread_ids):
+    posts = Post.__table__
+    threads = Thread.__table__
+    return dict(db.session.execute(
+        select(threads.c.board_id, func.count(posts.c.id))
+        .select_from(posts.join(threads, threads.c.id == posts.c.thread_id))
+        .where(threads.c.id.in_(thread_ids))
+        .group_by(threads.c.board_id)
+    ).all())
+
+
+def purge_threads(thread_ids):
+    """
+    Удаление тредов вместе с постами, файлами и жалобами.
+
+    Посты удаляет база данных каскадом по внешнему ключу, жалобы и файлы -
+    set-based DELETE; в сессию ничего не загружается. В той же транзакции
+    уменьшаются счетчики досок, после коммита - счетчик постов сайта.
+    Файлы с диска удаляются после коммита отдельной задачей.
+
+    Args:
+        thread_ids: ID тредов
+
+    Returns:
+        Dict[str, int]: Количество удаленных тредов, постов и файлов
+    """
+    thread_ids = list(thread_ids)
+    if not thread_ids:
+        return {'threads': 0, 'posts': 0, 'files': 0}
+
+    threads = Thread.__table__
+    boards = Board.__table__
+    try:
+        # Блокировка тредов не дает добавить в них посты и файлы, пока
+        # собираются пути и счетчики
+        thread_ids = db.session.execute(
+            select(threads.c.id).where(threads.c.id.in_(thread_ids)).with_for_update()
+        ).scalars().all()
+        file_rows = _file_rows(thread_ids)
+        post_counts = _post_counts(thread_ids)
+        # Ребра графа цитирования удаляются каскадом от threads, но карты
+        # ответов уцелевших тредов, на которые ссылались удаленные посты, устаревают
+        quoted_threads = db.session.execute(
+            select(post_links.c.thread_id).distinct()
+            .where(post_links.c.source_thread_id.in_(thread_ids), post_links.c.thread_id.notin_(thread_ids))
+        ).scalars().all()
+
+        # На секционированной posts внешних ключей на posts.id нет, поэтому
+        # жалобы и файлы постов удаляются явно; посты удаляет каскад от threads
+        posts = Post.__table__
+        files = File.__table__
+        reports = Report.__table__
+        thread_post_ids = select(posts.c.id).where(posts.c.thread_id.in_(thread_ids))
+        db.session.execute(reports.delete().where(reports.c.post_id.in_(thread_post_ids)))
+        db.session.execute(files.delete().where(
+            or_(files.c.thread_id.in_(thread_ids), files.c.post_id.in_(thread_post_ids))
+        ))
+        # Содержимое из хранилища по хешу удаляется, только если на него
+        # не осталось ссылок из других тредов
+        blob_paths = release_blobs(db.session.connection(), blob_counts(file_rows))
+        deleted = db.session.execute(
+            threads.delete().where(threads.c.id.in_(thread_ids)).returning(threads.c.id, threads.c.board_id)
+        ).all()
+
+        deltas = {}
+        for row in deleted:
+            deltas.setdefault(row.board_id, {'thread_count': 0, 'file_count': 0, 'file_bytes': 0})
+            deltas[row.board_id]['thread_count'] += 1
+        for row in file_rows:
+            if row.board_id in deltas:
+                deltas[row.board_id]['file_count'] += 1
+                deltas[row.board_id]['file_bytes'] += row.file_size or 0
+        for board_id, delta in deltas.items():
+            db.session.execute(
+                boards.update()
+                .where(boards.c.id == board_id)
+                .values(
+                    thread_count=boards.c.thread_count - delta['thread_count'],
+                    post_count=boards.c.post_count - post_counts.get(board_id, 0),
+                    file_count=boards.c.file_count - delta['file_count'],
+                    file_bytes=boards.c.file_bytes - delta['file_bytes']
+                )
+            )
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    # Каскадное удаление постов не проходит через обработчики ORM
+    total_posts = sum(post_counts.values())
+    if total_posts:
+        adjust_total_posts(-total_posts)
+    bump_generations(
+        *[f'thread:{row.id}' for row in deleted],
+        *[f'board:{board_id}' for board_id in deltas],
+        *[f'thread:{thread_id}' for thread_id in quoted_threads],
+        'threads'
+    )
+    paths = []
+    for row in file_rows:
+        if row.blob_id:
+            continue
+        paths.append(row.file_path)
+        for path in (row.thumbnail_path, row.preview_path):
+            if path:
+                paths.extend([path, *alternate_paths(path)])
+    schedule_file_removal(paths + blob_paths)
+
+    return {
+        'threads': len(deleted),
+        'posts': sum(post_counts.values()),
+        'files': len(file_rows)
+    }
+
+
+def purge_old_threads(days=None, batch_size=None, time_budget=None, progress=None):
+    """
+    Удаление старых незакрепленных тредов пачками.
+
+    Каждая пачка удаляется отдельной транзакцией через purge_threads, поэтому
+    объем работы и блокировок ограничен. Работа прекращается, когда треды
+    закончились или исчерпан бюджет времени.
+
+    Args:
+        days: Возраст треда в днях, по умолчанию MAX_THREAD_AGE_DAYS
+        batch_size: Количество тредов в пачке, по умолчанию PURGE_BATCH_SIZE
+        time_budget: Бюджет времени в секундах, по умолчанию PURGE_TIME_BUDGET
+        progress: Вызывается после каждой пачки с накопленными итогами
+
+    Returns:
+        Dict[str, int]: Количество удаленных тредов, постов и файлов
+    """
+    days = days or current_app.config['MAX_THREAD_AGE_DAYS']
+    batch_size = batch_size or current_app.config['PURGE_BATCH_SIZE']
+    if time_budget is None:
+        time_budget = current_app.config['PURGE_TIME_BUDGET']
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    deadline = time.monotonic() + time_budget
+    threads = Thread.__table__
+    candidates = select(threads.c.id)\
+        .where(threads.c.created_at < cutoff, threads.c.is_pinned == False)\
+        .order_by(threads.c.created_at, threads.c.id)\
+        .limit(batch_size)
+
+    totals = {'threads': 0, 'posts': 0, 'files': 0}
+    while True:
+        thread_ids = db.session.execute(candidates).scalars().all()
+        result = purge_threads(thread_ids)
+        for key, value in result.items():
+            totals[key] += value
+        if progress and thread_ids:
+            progress(totals)
+
+        if len(thread_ids) < batch_size:
+            break
+        if time.monotonic() >= deadline:
+            logger.info(f'Purge time budget of {time_budget}s exhausted after {totals["threads"]} threads')
+            break
+
+    logger.info(f'Purged {totals["threads"]} threads, {totals["posts"]} posts, {totals["files"]} files')
+    return totals
@@ -0,0 +1,113 @@
+from models import db, Thread, Post, File
+from sqlalchemy.dialects import postgresql
+from datetime import datetime
+from utils.pagination import THREAD_SORT_KEYS, ARCHIVE_KEYS, POST_KEYS, build_keyset_query
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Таблицы, полное сканирование которых на горячих путях считается регрессией
+WATCHED_TABLES = ('threads', 'posts', 'files')
+
+
+def _sample_value(name, now):
+    """Значение поля ключа для курсора пробного запроса."""
+    if name.startswith('is_'):
+        return False
+    if name.endswith('_at'):
+        return now
+    return 1
+
+
+def _hot_queries():
+    """
+    Горячие запросы листингов в том виде, в котором их строят представления.
+
+    Значения параметров произвольные: планировщик выбирает индекс по форме
+    запроса, а enable_seqscan = off отсекает выбор по статистике пустых таблиц.
+    """
+    now = datetime.utcnow()
+    per_page = 21
+    queries = {}
+
+    board_threads = Thread.query.filter_by(board_id=1, is_archived=False)
+    for sort, keys in THREAD_SORT_KEYS.items():
+        first = build_keyset_query(board_threads, keys, per_page)
+        cursor = [_sample_value(key.name, now) for key in keys]
+        queries[f'board:{sort}'] = first
+        queries[f'board:{sort}:cursor'] = build_keyset_query(board_threads, keys, per_page, cursor)
+
+    archived = Thread.query.filter_by(board_id=1, is_archived=True)
+    queries['archive'] = build_keyset_query(archived, ARCHIVE_KEYS, per_page)
+    queries['archive:cursor'] = build_keyset_query(archived, ARCHIVE_KEYS, per_page, [now, 1])
+
+    thread_posts = Post.in_thread(1, now)
+    queries['thread:posts'] = build_keyset_query(thread_posts, POST_KEYS, per_page, descending=False)
+    queries['thread:posts:cursor'] = build_keyset_query(
+        thread_posts, POST_KEYS, per_page, [now, 1], descending=False
+    )
+    queries['thread:op'] = thread_posts.filter(Post.is_op == True).limit(1)
+    queries['post:files'] = File.query.filter(File.post_id.in_([1, 2, 3]))
+    return queries
+
+
+def _seq_scans(plan):
+    """Рекурсивный поиск узлов Seq Scan по отслеживаемым таблицам."""
+    found = []
+    relation = plan.get('Relation Name') or ''
+    # Секции posts и files называются <таблица>_pYYYY_MM
+    table = relation.split('_p')[0]
+    if plan.get('Node Type') == 'Seq Scan' and table in WATCHED_TABLES:
+        found.append(relation)
+    for child in plan.get('Plans', []):
+        found.extend(_seq_scans(child))
+    return found
+
+
+def compile_for_explain(query):
+    """
+    Компиляция запроса для PostgreSQL под EXPLAIN.
+
+    Расширяемые IN подставляются сразу (render_postcompile): запрос
+    выполняется через exec_driver_sql в обход обработки параметров
+    SQLAlchemy, и PostgreSQL не примет заглушку POSTCOMPILE.
+    """
+    return query.statement.compile(
+        dialect=postgresql.dialect(), compile_kwargs={'render_postcompile': True}
+    )
+
+
+def explain_hot_queries():
+    """
+    Проверка планов горячих запросов листингов.
+
+    Каждый запрос выполняется через EXPLAIN (FORMAT JSON) внутри
+    транзакции с enable_seqscan = off. Если план все равно содержит
+    Seq Scan по threads, posts или files, подходящего индекса нет.
+
+    Returns:
+        Dict[str, List[str]]: Таблицы с полным сканированием по имени запроса
+
+    Raises:
+        RuntimeError: Если база данных не PostgreSQL
+    """
+    connection = db.session.connection()
+    if connection.dialect.name != 'postgresql':
+        raise RuntimeError('Plan check requires PostgreSQL')
+
+    results = {}
+    try:
+        connection.exec_driver_sql('SET LOCAL enable_seqscan = off')
+        for name, query in _hot_queries().items():
+            compiled = compile_for_explain(query)
+            row = connection.exec_driver_sql(
+                f'EXPLAIN (FORMAT JSON) {compiled}', compiled.params
+            ).scalar()
+            plan = row if isinstance(row, list) else json.loads(row)
+            results[name] = _seq_scans(plan[0]['Plan'])
+            if results[name]:
+                logger.warning(f'Sequential scan in {name}: {", ".join(results[name])}')
+    finally:
+        db.session.rollback()
+    return results
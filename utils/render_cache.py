@@ -0,0 +1,174 @@
+from flask import current_app, g, request, session, get_template_attribute
+from flask_login import current_user
+from flask_wtf.csrf import generate_csrf
+from markupsafe import Markup
+from functools import wraps
+from utils.cache import cache, versioned_key, bump_generation, get_generations
+from utils.db_routing import primary_reads
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Заглушка CSRF-токена в сохраненной странице. Угловые скобки экранируются
+# в пользовательском тексте, поэтому в содержимом постов она не встретится
+CSRF_PLACEHOLDER = '<page-csrf-token>'
+
+
+def is_cacheable_request():
+    """
+    Проверяет, можно ли отдать запрос из кэша готовых страниц.
+
+    Кэшируются только GET/HEAD анонимных пользователей без flash-сообщений
+    и достижений в сессии: такие страницы не содержат персональных данных.
+    """
+    if request.method not in ('GET', 'HEAD'):
+        return False
+    if current_user.is_authenticated:
+        return False
+    if session.get('_flashes') or session.get('achievements'):
+        return False
+    return True
+
+
+def page_cache_key(kind, *scopes):
+    """Ключ готовой страницы с учетом URL, языка и поколений областей."""
+    lang = session.get('language', current_app.config['BABEL_DEFAULT_LOCALE'])
+    return versioned_key(f'page:{kind}:{lang}:{request.full_path}', *scopes)
+
+
+def _csrf_field_name():
+    """Ключ CSRF-токена в сессии и g."""
+    return current_app.config.get('WTF_CSRF_FIELD_NAME', 'csrf_token')
+
+
+def _session_markers():
+    """Значения, привязанные к сессии текущего запроса: CSRF-токены."""
+    field_name = _csrf_field_name()
+    return [marker for marker in (g.get(field_name), session.get(field_name)) if marker]
+
+
+def strip_session_state(html):
+    """
+    Подготовка страницы к общему кэшу.
+
+    Выданный в этом запросе CSRF-токен заменяется заглушкой. Если после
+    замены в HTML остается состояние сессии, страница не кэшируется.
+
+    Returns:
+        Optional[str]: HTML для кэша или None
+    """
+    token = g.get(_csrf_field_name())
+    if token:
+        html = html.replace(token, CSRF_PLACEHOLDER)
+    if any(marker in html for marker in _session_markers()):
+        return None
+    return html
+
+
+def fill_session_state(html):
+    """Подстановка CSRF-токена текущей сессии в страницу из кэша."""
+    if CSRF_PLACEHOLDER in html:
+        html = html.replace(CSRF_PLACEHOLDER, generate_csrf())
+    return html
+
+
+def render_cached(kind, scopes, timeout=None):
+    """
+    Кэширование HTML страницы для анонимных читателей.
+
+    CSRF-токены форм хранятся в кэше заглушкой и подставляются для
+    каждого запроса (strip_session_state, fill_session_state).
+
+    Args:
+        kind: Тип страницы, часть ключа
+        scopes: Функция от аргументов маршрута, возвращающая области кэша
+        timeout: Время жизни страницы в секундах
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if not is_cacheable_request():
+                return f(*args, **kwargs)
+            try:
+                key = page_cache_key(kind, *scopes(*args, **kwargs))
+                html = cache.get(key)
+            except Exception as e:
+                logger.error(f'Error reading page cache {kind}: {str(e)}')
+                return f(*args, **kwargs)
+            if html is not None:
+                return fill_session_state(html)
+
+            # Страница попадет в общий кэш, поэтому читается с основной базы
+            with primary_reads():
+                rv = f(*args, **kwargs)
+            if isinstance(rv, str):
+                shared = strip_session_state(rv)
+                if shared is None:
+                    logger.warning(f'Page {kind} carries session state, not cached')
+                    return rv
+                try:
+                    cache.set(key, shared, timeout=timeout or current_app.config['PAGE_CACHE_TIMEOUT'])
+                except Exception as e:
+                    logger.error(f'Error caching page {kind}: {str(e)}')
+            return rv
+        return decorated_function
+    return decorator
+
+
+def post_fragment_key(post_id, thread_locked):
+    """Ключ HTML-фрагмента поста."""
+    lang = session.get('language', current_app.config['BABEL_DEFAULT_LOCALE'])
+    return versioned_key(f'fragment:post:{post_id}:{int(bool(thread_locked))}:{lang}', f'post:{post_id}')
+
+
+def render_post_fragments(posts, thread, backlinks=None):
+    """
+    Собирает HTML постов страницы из кэша фрагментов.
+
+    Фрагменты не зависят от пользователя, поэтому используются и для
+    авторизованных, у которых остальная страница рендерится заново.
+    Отсутствующие фрагменты рендерятся макросом render_post и сохраняются.
+    Ответы на пост входят во фрагмент: новая ссылка на пост сдвигает его
+    поколение (utils.backlinks).
+
+    Args:
+        posts: Посты страницы
+        thread: Тред
+        backlinks: Карта ответов треда из get_backlinks
+
+    Returns:
+        Dict[int, Markup]: HTML постов по их ID
+    """
+    posts = list(posts)
+    if not posts:
+        return {}
+    backlinks = backlinks or {}
+    # Поколения всех постов страницы дочитываются одним MGET
+    get_generations('global', *[f'post:{post.id}' for post in posts])
+    keys = [post_fragment_key(post.id, thread.is_locked) for post in posts]
+    try:
+        cached = cache.get_many(*keys)
+    except Exception as e:
+        logger.error(f'Error reading post fragments: {str(e)}')
+        cached = [None] * len(keys)
+
+    render_post = get_template_attribute('macros.html', 'render_post')
+    fragments = {}
+    missing = {}
+    for post, key, html in zip(posts, keys, cached):
+        if html is None:
+            html = str(render_post(post, thread, backlinks.get(post.id)))
+            missing[key] = html
+        fragments[post.id] = Markup(html)
+
+    if missing:
+        try:
+            cache.set_many(missing, timeout=current_app.config['FRAGMENT_CACHE_TIMEOUT'])
+        except Exception as e:
+            logger.error(f'Error caching post fragments: {str(e)}')
+    return fragments
+
+
+def invalidate_post_fragment(post_id):
+    """Инвалидирует HTML-фрагмент поста."""
+    bump_generation(f'post:{post_id}')
@@ -0,0 +1,261 @@
+from dataclasses import dataclass
+from flask import current_app
+from PIL import Image
+from typing import Any, Dict, List, Optional, Tuple
+import logging
+import os
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+# Режимы, которые resize и reduce обрабатывают без потери качества
+NATIVE_MODES = ('L', 'RGB', 'RGBA')
+
+# Параметры сохранения уменьшенного оригинала по формату
+SAVE_OPTIONS = {
+    'JPEG': {'quality': 85, 'optimize': True},
+    'WEBP': {'quality': 85},
+    'PNG': {'optimize': True},
+}
+
+# Превью и предпросмотр всегда есть в JPEG
+JPEG_OPTIONS = {'format': 'JPEG', 'quality': 85, 'optimize': True, 'progressive': True}
+
+# Дополнительные форматы: расширение -> формат Pillow, MIME-тип и параметры.
+# Качество подобрано так, чтобы визуально совпадать с JPEG 85
+ALTERNATE_FORMATS = {
+    '.avif': ('AVIF', 'image/avif', {'quality': 60, 'speed': 6}),
+    '.webp': ('WEBP', 'image/webp', {'quality': 80, 'method': 4}),
+}
+
+
+@dataclass
+class Rendition:
+    """Версия изображения на диске."""
+    path: str
+    width: int
+    height: int
+    size: int
+
+
+@dataclass
+class Renditions:
+    """Результат обработки изображения: оригинал, предпросмотр и превью."""
+    original: Rendition
+    preview: Rendition
+    thumbnail: Rendition
+
+    def columns(self) -> Dict[str, Any]:
+        """Значения колонок File и Blob."""
+        return {
+            'file_size': self.original.size,
+            'width': self.original.width,
+            'height': self.original.height,
+            'preview_path': self.preview.path,
+            'preview_width': self.preview.width,
+            'preview_height': self.preview.height,
+            'preview_size': self.preview.size,
+            'thumbnail_path': self.thumbnail.path,
+            'thumbnail_width': self.thumbnail.width,
+            'thumbnail_height': self.thumbnail.height,
+            'thumbnail_size': self.thumbnail.size,
+        }
+
+
+def fit(size: Tuple[int, int], box: Tuple[int, int]) -> Tuple[int, int]:
+    """Размер, вписанный в box с сохранением пропорций; без увеличения."""
+    width, height = size
+    scale = min(box[0] / width, box[1] / height, 1)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def downscale(image: Image.Image, size: Tuple[int, int]) -> Image.Image:
+    """
+    Уменьшение до size.
+
+    Сначала reduce усредняет блоки пикселей целым коэффициентом, оставляя
+    не меньше двукратного запаса; оставшееся уменьшение делает LANCZOS.
+    Это почти не отличается от LANCZOS по всему изображению, но в разы
+    быстрее на больших коэффициентах.
+    """
+    if image.size == size:
+        return image
+    factor = min(image.width // (size[0] * 2), image.height // (size[1] * 2))
+    if factor >= 2:
+        image = image.reduce(factor)
+    return image.resize(size, Image.LANCZOS)
+
+
+def _normalize(image: Image.Image) -> Image.Image:
+    """Перевод палитровых и прочих режимов в L, RGB или RGBA."""
+    if image.mode in NATIVE_MODES:
+        return image
+    has_alpha = image.mode in ('LA', 'PA') or 'transparency' in image.info
+    return image.convert('RGBA' if has_alpha else 'RGB')
+
+
+def _flatten(image: Image.Image) -> Image.Image:
+    """Наложение прозрачного изображения на белый фон для JPEG."""
+    if image.mode != 'RGBA':
+        return image
+    background = Image.new('RGB', image.size, (255, 255, 255))
+    background.paste(image, mask=image.getchannel('A'))
+    return background
+
+
+def _is_digest(name: str) -> bool:
+    return len(name) == 64 and all(char in '0123456789abcdef' for char in name)
+
+
+def alternate_paths(path: str) -> List[str]:
+    """
+    Пути дополнительных форматов версии рядом с JPEG.
+
+    Дополнительные форматы есть только у версий render_image: по хешу
+    (<sha256>.jpg) и у старых загрузок с расширением исходного файла
+    (thumb_<имя>.<расширение>.jpg). Превью прежнего вида thumb_<имя> не
+    трогаются: thumb_photo.webp - превью другой загрузки, а не версия
+    thumb_photo.jpg.
+    """
+    base, extension = os.path.splitext(path)
+    name = os.path.basename(base)
+    if extension != '.jpg' or not (_is_digest(name) or os.path.splitext(name)[1]):
+        return []
+    return [base + alternate for alternate in ALTERNATE_FORMATS]
+
+
+def enabled_formats() -> List[str]:
+    """Расширения из RENDITION_FORMATS, которые Pillow умеет сохранять."""
+    Image.init()
+    extensions = []
+    for name in current_app.config['RENDITION_FORMATS']:
+        extension = f'.{name.strip().lower()}'
+        if extension in ALTERNATE_FORMATS and ALTERNATE_FORMATS[extension][0] in Image.SAVE:
+            extensions.append(extension)
+    return extensions
+
+
+def _save_alternates(image: Image.Image, path: str, extensions: List[str],
+                     icc_profile: Optional[bytes]) -> None:
+    """Сохранение версии в дополнительных форматах; ошибка формата не мешает JPEG."""
+    base = os.path.splitext(path)[0]
+    for extension in extensions:
+        image_format, _, options = ALTERNATE_FORMATS[extension]
+        params = dict(options, format=image_format)
+        if icc_profile:
+            params['icc_profile'] = icc_profile
+        try:
+            _save(image, base + extension, **params)
+        except Exception as e:
+            logger.warning(f'Could not save {image_format} rendition of {path}: {str(e)}')
+
+
+def _save(image: Image.Image, path: str, **params: Any) -> Rendition:
+    """Атомарное сохранение версии через временный файл и os.replace."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            image.save(out, **params)
+        os.replace(temp_path, path)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return Rendition(path, image.width, image.height, os.path.getsize(path))
+
+
+def render_image(path: str, thumbnail_path: str, preview_path: str,
+                 max_size: Optional[int] = None) -> Renditions:
+    """
+    Все версии изображения из одного декодирования.
+
+    Оригинал больше MAX_IMAGE_SIZE уменьшается и перезаписывается на
+    месте, предпросмотр (PREVIEW_SIZE) строится из уменьшенного оригинала,
+    превью (THUMBNAIL_SIZE) - из предпросмотра. JPEG декодируется через
+    draft: декодер сразу масштабирует DCT в 1/2, 1/4 или 1/8 до
+    наименьшего размера, не меньшего самой крупной нужной версии.
+
+    Анимированные изображения не перезаписываются, версии строятся по
+    первому кадру. Предпросмотр и превью дополнительно сохраняются в
+    форматах RENDITION_FORMATS рядом с JPEG (см. alternate_paths).
+
+    Args:
+        path: Путь к изображению
+        thumbnail_path: Путь к превью
+        preview_path: Путь к предпросмотру
+        max_size: Предельная сторона оригинала, по умолчанию MAX_IMAGE_SIZE
+
+    Returns:
+        Renditions: Пути, размеры в пикселях и байтах всех версий
+    """
+    config = current_app.config
+    max_size = max_size or config['MAX_IMAGE_SIZE']
+
+    with Image.open(path) as image:
+        image_format = image.format
+        icc_profile = image.info.get('icc_profile')
+        animated = getattr(image, 'is_animated', False)
+        source_size = image.size
+        capped_size = source_size if animated else fit(source_size, (max_size, max_size))
+        rewrite = capped_size != source_size
+
+        if image_format == 'JPEG':
+            # Самая крупная нужная версия: уменьшенный оригинал или предпросмотр
+            needed = capped_size if rewrite else fit(source_size, config['PREVIEW_SIZE'])
+            image.draft(image.mode, needed)
+            if image.mode == 'CMYK':
+                # Профиль CMYK не подходит к пикселям после перевода в RGB
+                icc_profile = None
+        image.load()
+        decoded = _normalize(image)
+
+        if rewrite:
+            capped = downscale(decoded, capped_size)
+            params = dict(SAVE_OPTIONS.get(image_format, {}), format=image_format)
+            if icc_profile:
+                params['icc_profile'] = icc_profile
+            original = _save(capped, path, **params)
+        else:
+            capped = decoded
+            original = Rendition(path, source_size[0], source_size[1], os.path.getsize(path))
+
+    jpeg_options = dict(JPEG_OPTIONS, icc_profile=icc_profile) if icc_profile else JPEG_OPTIONS
+    preview_image = _flatten(downscale(capped, fit(capped.size, config['PREVIEW_SIZE'])))
+    preview = _save(preview_image, preview_path, **jpeg_options)
+    thumbnail_image = downscale(preview_image, fit(preview_image.size, config['THUMBNAIL_SIZE']))
+    thumbnail = _save(thumbnail_image, thumbnail_path, **jpeg_options)
+    extensions = enabled_formats()
+    _save_alternates(preview_image, preview_path, extensions, icc_profile)
+    _save_alternates(thumbnail_image, thumbnail_path, extensions, icc_profile)
+
+    logger.info(
+        f'Rendered {path}: original {original.width}x{original.height}, '
+        f'preview {preview.width}x{preview.height}, thumbnail {thumbnail.width}x{thumbnail.height}'
+    )
+    return Renditions(original=original, preview=preview, thumbnail=thumbnail)
+
+
+def negotiate(path: str, accept: Any) -> Tuple[str, str]:
+    """
+    Выбор формата версии по заголовку Accept.
+
+    Формат подходит, только если клиент назвал его явно: */* присылают
+    и клиенты, которые не декодируют AVIF. При равном весе берется более
+    компактный формат (порядок ALTERNATE_FORMATS); если дополнительной
+    версии нет на диске, отдается JPEG.
+
+    Args:
+        path: Путь к JPEG-версии
+        accept: request.accept_mimetypes
+
+    Returns:
+        Tuple[str, str]: Путь к файлу и его MIME-тип
+    """
+    explicit = {value: quality for value, quality in accept if quality > 0}
+    best, best_quality = (path, 'image/jpeg'), 0
+    for alternate, (_, mimetype, _) in zip(alternate_paths(path), ALTERNATE_FORMATS.values()):
+        quality = explicit.get(mimetype, 0)
+        if quality > best_quality and os.path.exists(alternate):
+            best, best_quality = (alternate, mimetype), quality
+    return best
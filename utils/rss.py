@@ -41,7 +41,7 @@ def generate_thread_feed(thread):
     fg.language('ru')
     
     # Получаем все сообщения в треде
-    posts = Post.query.filter_by(thread_id=thread.id)\
+    posts = Post.in_thread(thread.id, thread.created_at)\
         .order_by(Post.created_at.desc())\
         .limit(50).all()
     
@@ -0,0 +1,363 @@
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+import logging
+
+import msgpack
+
+from models import db, Board, Thread, Post, File, User
+from utils.pagination import KeysetPage, POST_KEYS, keyset_paginate
+
+logger = logging.getLogger(__name__)
+
+# Версия формата снимка. Увеличивается при любом изменении структуры,
+# старые записи в Redis при этом просто игнорируются.
+SNAPSHOT_VERSION = 2
+
+VIDEO_EXTENSIONS = ('.mp4', '.webm', '.ogv')
+
+
+def _dump_dt(value: Optional[datetime]) -> Optional[str]:
+    return value.isoformat() if value else None
+
+
+def _load_dt(value: Optional[str]) -> Optional[datetime]:
+    return datetime.fromisoformat(value) if value else None
+
+
+@dataclass
+class BoardRecord:
+    """Запись доски в снимке."""
+    id: int
+    name: str
+    title: str
+    is_locked: bool = False
+
+
+@dataclass
+class FileRecord:
+    """Метаданные файла в снимке."""
+    id: int
+    post_id: Optional[int]
+    filename: str
+    original_filename: str
+    file_path: str
+    thumbnail_path: Optional[str]
+    file_size: int
+    mime_type: str
+    processed: bool = False
+    width: Optional[int] = None
+    height: Optional[int] = None
+    preview_path: Optional[str] = None
+    thumbnail_width: Optional[int] = None
+    thumbnail_height: Optional[int] = None
+
+    @property
+    def is_video(self) -> bool:
+        return self.mime_type.startswith('video/') or self.filename.lower().endswith(VIDEO_EXTENSIONS)
+
+    @property
+    def is_gif(self) -> bool:
+        return self.mime_type == 'image/gif' or self.filename.lower().endswith('.gif')
+
+    @property
+    def original_name(self) -> str:
+        return self.original_filename
+
+    @property
+    def size(self) -> int:
+        return self.file_size
+
+    @property
+    def thumbnail(self) -> Optional[str]:
+        # Превью хранилища по хешу лежат в подкаталогах thumbnails/ab/cd
+        if not self.thumbnail_path:
+            return None
+        if '/thumbnails/' in self.thumbnail_path:
+            return self.thumbnail_path.split('/thumbnails/', 1)[1]
+        return self.thumbnail_path.rsplit('/', 1)[-1]
+
+    @property
+    def url(self) -> str:
+        return f'/static/uploads/{self.filename}'
+
+    @property
+    def thumbnail_url(self) -> Optional[str]:
+        return f'/media/thumbnails/{self.thumbnail}' if self.thumbnail else None
+
+
+@dataclass
+class PostRecord:
+    """Запись поста в снимке."""
+    id: int
+    thread_id: int
+    user_id: Optional[int]
+    name: Optional[str]
+    tripcode: Optional[str]
+    content: Optional[str]
+    is_op: bool
+    reply_to_id: Optional[int]
+    created_at: Optional[datetime]
+    author: Optional[str] = None
+    files: List[FileRecord] = field(default_factory=list)
+
+
+@dataclass
+class ThreadRecord:
+    """Заголовок треда в снимке."""
+    id: int
+    board_id: int
+    subject: Optional[str]
+    content: Optional[str]
+    name: Optional[str]
+    created_at: Optional[datetime]
+    updated_at: Optional[datetime]
+    last_reply_at: Optional[datetime]
+    reply_count: int = 0
+    views: int = 0
+    is_locked: bool = False
+    is_pinned: bool = False
+    is_archived: bool = False
+
+
+@dataclass
+class ThreadSnapshot:
+    """Гидратированный снимок треда, пригодный для рендеринга без обращения к БД."""
+    board: BoardRecord
+    thread: ThreadRecord
+    op: Optional[PostRecord]
+    post_ids: List[int]
+    posts: Dict[int, PostRecord]
+    total_posts: int
+    per_page: int
+
+    def first_page(self) -> KeysetPage:
+        """Первая страница постов треда."""
+        items = [self.posts[post_id] for post_id in self.post_ids if post_id in self.posts]
+        return KeysetPage.from_items(items, POST_KEYS, self.per_page,
+                                     has_next=self.total_posts > len(items), total=self.total_posts)
+
+
+def _file_to_dict(file: File) -> Dict[str, Any]:
+    return {
+        'id': file.id,
+        'post_id': file.post_id,
+        'filename': file.filename,
+        'original_filename': file.original_filename,
+        'file_path': file.file_path,
+        'thumbnail_path': file.thumbnail_path,
+        'file_size': file.file_size,
+        'mime_type': file.mime_type,
+        'processed': bool(file.processed),
+        'width': file.width,
+        'height': file.height,
+        'preview_path': file.preview_path,
+        'thumbnail_width': file.thumbnail_width,
+        'thumbnail_height': file.thumbnail_height,
+    }
+
+
+def _post_to_dict(post: Post, files: List[Dict[str, Any]], author: Optional[str] = None) -> Dict[str, Any]:
+    return {
+        'id': post.id,
+        'thread_id': post.thread_id,
+        'user_id': post.user_id,
+        'name': post.name,
+        'tripcode': post.tripcode,
+        'content': post.content,
+        'is_op': bool(post.is_op),
+        'reply_to_id': post.reply_to_id,
+        'created_at': _dump_dt(post.created_at),
+        'author': author,
+        'files': files,
+    }
+
+
+def serialize_posts(posts: List[Post]) -> List[Dict[str, Any]]:
+    """
+    Сериализация постов вместе с файлами и авторами.
+
+    Файлы и имена авторов всех постов читаются двумя IN-запросами вместо
+    обращения к post.files и post.user у каждого поста.
+
+    Args:
+        posts: Посты в нужном порядке
+
+    Returns:
+        List[Dict[str, Any]]: Записи постов в формате снимка
+    """
+    if not posts:
+        return []
+    post_ids = [post.id for post in posts]
+    files_by_post: Dict[int, List[Dict[str, Any]]] = {}
+    files = File.query.filter(File.post_id.in_(post_ids)).order_by(File.id.asc()).all()
+    for file in files:
+        files_by_post.setdefault(file.post_id, []).append(_file_to_dict(file))
+
+    user_ids = {post.user_id for post in posts if post.user_id}
+    authors: Dict[int, str] = {}
+    if user_ids:
+        authors = dict(db.session.query(User.id, User.username).filter(User.id.in_(user_ids)).all())
+
+    return [
+        _post_to_dict(post, files_by_post.get(post.id, []), authors.get(post.user_id))
+        for post in posts
+    ]
+
+
+def load_thread_page(thread_id: int, per_page: int, after: Optional[str] = None,
+                     before: Optional[str] = None, with_total: bool = False,
+                     since: Optional[datetime] = None) -> KeysetPage:
+    """
+    Загрузка страницы постов треда без N+1.
+
+    Страница читается фиксированным числом запросов независимо от числа
+    постов: посты по курсору, файлы, авторы и, по запросу, счетчик.
+
+    Args:
+        thread_id: ID треда
+        per_page: Количество постов на странице
+        after: Курсор, после которого начинается страница
+        before: Курсор, перед которым заканчивается страница
+        with_total: Посчитать общее количество постов
+        since: Время создания треда для отсечения секций posts
+
+    Returns:
+        KeysetPage: Страница записей постов
+    """
+    page = keyset_paginate(Post.in_thread(thread_id, since), POST_KEYS, per_page,
+                           after=after, before=before, descending=False, with_total=with_total)
+    page.items = [hydrate_post(data) for data in serialize_posts(page.items)]
+    return page
+
+
+def build_thread_snapshot(thread_id: int, per_page: int) -> Optional[Dict[str, Any]]:
+    """
+    Сборка снимка треда из базы данных.
+
+    Все данные читаются фиксированным числом запросов: тред с доской,
+    первая страница постов, ОП, файлы и авторы постов IN-запросами и счетчик.
+
+    Args:
+        thread_id: ID треда
+        per_page: Количество постов на странице
+
+    Returns:
+        Optional[Dict[str, Any]]: Снимок или None, если тред не найден
+    """
+    row = db.session.query(Thread, Board).join(Board, Thread.board_id == Board.id)\
+        .filter(Thread.id == thread_id).first()
+    if row is None:
+        return None
+    thread, board = row
+
+    thread_posts = Post.in_thread(thread_id, thread.created_at)
+    posts = thread_posts.order_by(Post.created_at.asc(), Post.id.asc())\
+        .limit(per_page).all()
+    op = next((post for post in posts if post.is_op), None)
+    if op is None:
+        op = thread_posts.filter(Post.is_op == True).first()
+
+    post_ids = [post.id for post in posts]
+    wanted = list(posts)
+    if op is not None and op.id not in post_ids:
+        wanted.append(op)
+    records = {record['id']: record for record in serialize_posts(wanted)}
+
+    return {
+        'version': SNAPSHOT_VERSION,
+        'board': {
+            'id': board.id,
+            'name': board.name,
+            'title': board.title,
+            'is_locked': bool(board.is_locked),
+        },
+        'thread': {
+            'id': thread.id,
+            'board_id': thread.board_id,
+            'subject': thread.subject,
+            'content': thread.content,
+            'name': thread.name,
+            'created_at': _dump_dt(thread.created_at),
+            'updated_at': _dump_dt(thread.updated_at),
+            'last_reply_at': _dump_dt(thread.last_reply_at),
+            'reply_count': thread.reply_count or 0,
+            'views': thread.views or 0,
+            'is_locked': bool(thread.is_locked),
+            'is_pinned': bool(thread.is_pinned),
+            'is_archived': bool(thread.is_archived),
+        },
+        'op_id': op.id if op is not None else None,
+        'post_ids': post_ids,
+        'posts': list(records.values()),
+        'total_posts': thread_posts.count(),
+        'per_page': per_page,
+    }
+
+
+def encode_snapshot(data: Dict[str, Any]) -> bytes:
+    """Кодирование снимка в msgpack."""
+    return msgpack.packb(data, use_bin_type=True)
+
+
+def decode_snapshot(raw: Optional[bytes]) -> Optional[Dict[str, Any]]:
+    """
+    Декодирование снимка из msgpack.
+
+    Returns:
+        Optional[Dict[str, Any]]: Снимок или None, если данных нет, они
+        повреждены или записаны другой версией формата
+    """
+    if not raw:
+        return None
+    try:
+        data = msgpack.unpackb(raw, raw=False)
+    except Exception as e:
+        logger.warning(f'Не удалось декодировать снимок треда: {str(e)}')
+        return None
+    if not isinstance(data, dict) or data.get('version') != SNAPSHOT_VERSION:
+        return None
+    return data
+
+
+def hydrate_post(data: Dict[str, Any]) -> PostRecord:
+    """Восстановление записи поста из словаря снимка."""
+    return PostRecord(
+        id=data['id'],
+        thread_id=data['thread_id'],
+        user_id=data['user_id'],
+        name=data['name'],
+        tripcode=data['tripcode'],
+        content=data['content'],
+        is_op=data['is_op'],
+        reply_to_id=data['reply_to_id'],
+        created_at=_load_dt(data['created_at']),
+        author=data.get('author'),
+        files=[FileRecord(**file) for file in data['files']],
+    )
+
+
+def hydrate_thread_snapshot(data: Dict[str, Any]) -> ThreadSnapshot:
+    """
+    Гидратация снимка треда в записи с атрибутным доступом.
+
+    Args:
+        data: Декодированный снимок
+
+    Returns:
+        ThreadSnapshot: Снимок, готовый к рендерингу
+    """
+    thread = dict(data['thread'])
+    for key in ('created_at', 'updated_at', 'last_reply_at'):
+        thread[key] = _load_dt(thread[key])
+    posts = {post['id']: hydrate_post(post) for post in data['posts']}
+    op_id = data['op_id']
+    return ThreadSnapshot(
+        board=BoardRecord(**data['board']),
+        thread=ThreadRecord(**thread),
+        op=posts.get(op_id) if op_id is not None else None,
+        post_ids=list(data['post_ids']),
+        posts=posts,
+        total_posts=data['total_posts'],
+        per_page=data['per_page'],
+    )
@@ -99,23 +99,35 @@ def notify_new_post(thread_id, post):
     except Exception as e:
         logger.error(f'Error sending new post notification: {str(e)}')
 
-def notify_new_reply(thread_id, post, reply_to):
-    """Отправка уведомления о новом ответе."""
-    try:
-        if reply_to and reply_to.user:
+def notify_new_reply(thread_id, post, recipients):
+    """
+    Отправка уведомлений авторам процитированных постов.
+
+    Args:
+        thread_id: ID треда нового поста
+        post: Данные нового поста (id, user_id, user, content, created_at)
+        recipients: Пары (ID процитированного поста, ID его автора) из графа цитирования
+    """
+    content = post['content']
+    if len(content) > 100:
+        content = content[:100] + '...'
+    for reply_to_id, user_id in recipients:
+        if not user_id or user_id == post['user_id']:
+            continue
+        try:
             data = {
                 'type': 'new_reply',
                 'thread_id': thread_id,
-                'post_id': post.id,
-                'reply_to_id': reply_to.id,
-                'content': post.content[:100] + '...' if len(post.content) > 100 else post.content,
-                'user': post.user.username,
-                'created_at': post.created_at.isoformat()
+                'post_id': post['id'],
+                'reply_to_id': reply_to_id,
+                'content': content,
+                'user': post['user'],
+                'created_at': post['created_at'].isoformat()
             }
-            socketio.emit('new_reply', data, room=f'user_{reply_to.user.id}')
-            logger.info(f'New reply notification sent to user {reply_to.user.id}')
-    except Exception as e:
-        logger.error(f'Error sending new reply notification: {str(e)}')
+            socketio.emit('new_reply', data, room=f'user_{user_id}')
+            logger.info(f'New reply notification sent to user {user_id}')
+        except Exception as e:
+            logger.error(f'Error sending new reply notification: {str(e)}')
 
 def notify_thread_locked(thread_id, locked_by):
     """Отправка уведомления о блокировке треда."""
@@ -0,0 +1,206 @@
+from flask import current_app
+from models import db, User, Post, cache, on_commit
+from sqlalchemy import event, func, or_, bindparam
+from datetime import datetime, timedelta
+from utils.cache import get_redis, acquire_lock, release_lock
+import logging
+import time
+import uuid
+import redis
+
+logger = logging.getLogger(__name__)
+
+ONLINE_USERS_KEY = 'imageboard:stats:online'
+TOTAL_POSTS_KEY = 'imageboard:stats:posts'
+SITE_STATS_LOCAL_KEY = 'imageboard:stats:site'
+LAST_SEEN_KEY = 'imageboard:stats:last_seen'
+# Буфер, забранный сбросом; у каждого запуска свой ключ
+LAST_SEEN_FLUSHING_KEY = 'imageboard:stats:last_seen:flushing:{run}'
+# Время жизни забранного буфера, если сброс прервался
+LAST_SEEN_FLUSHING_TTL = 24 * 3600
+
+# Изменение счетчика только после его заполнения: INCRBY по отсутствующему
+# ключу создал бы счетчик с одними приращениями, и сверка бы не запустилась
+ADJUST_IF_SEEDED_SCRIPT = """
+if redis.call('exists', KEYS[1]) == 1 then
+    return redis.call('incrby', KEYS[1], ARGV[1])
+end
+return nil
+"""
+
+
+def record_activity(user_id, timestamp=None):
+    """
+    Запись активности пользователя в буфер last_seen и множество присутствия.
+
+    База данных обновляется пакетно задачей flush_last_seen, поэтому
+    запросы пользователей не блокируют строки таблицы users.
+
+    Args:
+        user_id: ID пользователя
+        timestamp: Время активности (UNIX), по умолчанию текущее
+    """
+    timestamp = timestamp or time.time()
+    try:
+        pipe = get_redis().pipeline(transaction=False)
+        pipe.hset(LAST_SEEN_KEY, user_id, timestamp)
+        pipe.zadd(ONLINE_USERS_KEY, {user_id: timestamp})
+        pipe.execute()
+    except redis.RedisError as e:
+        logger.error(f'Error recording activity of user {user_id}: {str(e)}')
+
+
+def flush_last_seen():
+    """
+    Пакетная запись буфера last_seen в базу данных.
+
+    Буфер атомарно переименовывается в ключ этого запуска, поэтому
+    отметки, пришедшие во время записи, попадут в следующий сброс, а
+    параллельные запуски не перезаписывают забранные друг другом буферы.
+    Обновление идет одним executemany и не откатывает более свежие
+    значения в базе. При ошибке отметки возвращаются в буфер без
+    перезаписи новых.
+
+    Returns:
+        int: Количество обработанных пользователей
+    """
+    client = get_redis()
+    flushing_key = LAST_SEEN_FLUSHING_KEY.format(run=uuid.uuid4().hex)
+    pipe = client.pipeline()
+    pipe.rename(LAST_SEEN_KEY, flushing_key)
+    pipe.expire(flushing_key, LAST_SEEN_FLUSHING_TTL)
+    try:
+        pipe.execute()
+    except redis.ResponseError:
+        # Буфер пуст
+        return 0
+    pending = client.hgetall(flushing_key)
+    rows = [
+        {'user_id': int(user_id), 'seen': datetime.utcfromtimestamp(float(timestamp))}
+        for user_id, timestamp in pending.items()
+    ]
+
+    table = User.__table__
+    statement = table.update()\
+        .where(table.c.id == bindparam('user_id'))\
+        .where(or_(table.c.last_seen.is_(None), table.c.last_seen < bindparam('seen')))\
+        .values(last_seen=bindparam('seen'))
+    try:
+        if rows:
+            db.session.execute(statement, rows)
+            db.session.commit()
+    except Exception:
+        db.session.rollback()
+        pipe = client.pipeline()
+        for user_id, timestamp in pending.items():
+            pipe.hsetnx(LAST_SEEN_KEY, user_id, timestamp)
+        pipe.execute()
+        raise
+    finally:
+        client.delete(flushing_key)
+
+    logger.info(f'Flushed last_seen for {len(rows)} users')
+    return len(rows)
+
+
+def adjust_total_posts(delta):
+    """Изменение счетчика постов сайта; вызывается после коммита."""
+    try:
+        get_redis().eval(ADJUST_IF_SEEDED_SCRIPT, 1, TOTAL_POSTS_KEY, delta)
+    except redis.RedisError as e:
+        logger.error(f'Error updating total posts counter: {str(e)}')
+
+
+def get_site_stats():
+    """
+    Статистика сайта для шаблонов.
+
+    Оба значения читаются одним конвейером Redis и на несколько секунд
+    запоминаются в локальном уровне кэша, поэтому рендер страницы не
+    обращается к базе данных. Незаполненный счетчик постов (после деплоя
+    или сброса Redis) один процесс заполняет сверкой с базой.
+
+    Returns:
+        Dict[str, int]: online_users и total_posts
+    """
+    hit, stats = cache.get_local(SITE_STATS_LOCAL_KEY)
+    if hit:
+        return stats
+
+    now = time.time()
+    window = current_app.config['ONLINE_USERS_WINDOW']
+    pipe = get_redis().pipeline()
+    pipe.zremrangebyscore(ONLINE_USERS_KEY, '-inf', now - window)
+    pipe.zcard(ONLINE_USERS_KEY)
+    pipe.get(TOTAL_POSTS_KEY)
+    _, online_users, total_posts = pipe.execute()
+
+    if total_posts is None:
+        # Счетчик еще не заполнен: после деплоя или сброса Redis
+        total_posts = _seed_total_posts()
+        if total_posts is None:
+            # Сверку выполняет другой процесс; локально не запоминаем
+            return {'online_users': int(online_users or 0), 'total_posts': 0}
+
+    stats = {
+        'online_users': int(online_users or 0),
+        'total_posts': int(total_posts)
+    }
+    cache.set_local(SITE_STATS_LOCAL_KEY, stats)
+    return stats
+
+
+def _seed_total_posts():
+    """Сверка с базой под блокировкой; None, если ее выполняет другой процесс."""
+    token = acquire_lock(TOTAL_POSTS_KEY, current_app.config['CACHE_LOCK_TIMEOUT'])
+    if not token:
+        return None
+    try:
+        return reconcile_site_stats()['total_posts']
+    finally:
+        release_lock(TOTAL_POSTS_KEY, token)
+
+
+def reconcile_site_stats():
+    """
+    Сверка счетчиков с базой данных.
+
+    Исправляет расхождения после сброса Redis и массовых удалений в обход
+    ORM, которые не проходят через обработчики событий.
+
+    Returns:
+        Dict[str, int]: Значения после сверки
+    """
+    window = current_app.config['ONLINE_USERS_WINDOW']
+    since = datetime.utcnow() - timedelta(seconds=window)
+    total_posts = db.session.query(func.count(Post.id)).scalar() or 0
+    online = db.session.query(User.id, User.last_seen).filter(User.last_seen >= since).all()
+
+    client = get_redis()
+    pipe = client.pipeline()
+    pipe.set(TOTAL_POSTS_KEY, total_posts)
+    if online:
+        epoch = datetime(1970, 1, 1)
+        # ZADD GT не откатывает более свежие отметки из запросов
+        pipe.zadd(
+            ONLINE_USERS_KEY,
+            {user_id: (last_seen - epoch).total_seconds() for user_id, last_seen in online},
+            gt=True
+        )
+    pipe.execute()
+    cache.invalidate_local(SITE_STATS_LOCAL_KEY)
+
+    logger.info(f'Site stats reconciled: {total_posts} posts, {len(online)} users online')
+    return {'online_users': len(online), 'total_posts': total_posts}
+
+
+@event.listens_for(Post, 'after_insert')
+def count_inserted_post(mapper, connection, target):
+    """Увеличение счетчика постов после коммита."""
+    on_commit(target, adjust_total_posts, 1)
+
+
+@event.listens_for(Post, 'after_delete')
+def count_deleted_post(mapper, connection, target):
+    """Уменьшение счетчика постов после коммита."""
+    on_commit(target, adjust_total_posts, -1)
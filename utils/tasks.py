@@ -1,12 +1,16 @@
 from celery import Celery
 from celery.signals import task_failure
-from PIL import Image
 import os
 import logging
 import subprocess
 from datetime import datetime
 from models import db, File
+from utils.cache import invalidate_thread_cache
+from utils.render_cache import invalidate_post_fragment
+from utils import archive, blobs, exif, partitions, popularity, purge, renditions, stats
+from utils.counters import adjust_file_bytes
 from config import Config
+from celery_config import beat_schedule
 
 
 logger = logging.getLogger(__name__)
@@ -28,7 +32,8 @@ def init_celery(app):
             task_time_limit=3600,
             task_soft_time_limit=3000,
             worker_max_tasks_per_child=1000,
-            worker_prefetch_multiplier=1
+            worker_prefetch_multiplier=1,
+            beat_schedule=beat_schedule
         )
         logger.info('Celery initialized successfully')
     except Exception as e:
@@ -42,6 +47,65 @@ def handle_task_failure(task_id, exception, args, kwargs, traceback, einfo, **kw
     logger.error(f'Task {task_id} failed: {str(exception)}')
 
 
+def invalidate_file_views(file):
+    """Инвалидация кэшированных страниц и фрагментов с файлом."""
+    if file.post_id:
+        invalidate_post_fragment(file.post_id)
+    thread_id = file.thread_id or (file.post.thread_id if file.post else None)
+    if thread_id:
+        invalidate_thread_cache(thread_id)
+
+
+def finish_processing(file, values):
+    """
+    Сохранение результата обработки.
+
+    Для содержимого из хранилища по хешу версии записываются в blob и во
+    все файлы, которые на него ссылаются: повторные загрузки не
+    обрабатываются заново.
+
+    Args:
+        file: Обработанный файл
+        values: Значения колонок версий (thumbnail_path, file_size и т.д.)
+    """
+    if file.blob is None:
+        delta = values.get('file_size', file.file_size) - file.file_size
+        file.processed = True
+        file.error = None
+        for name, value in values.items():
+            setattr(file, name, value)
+        thread_id = file.thread_id or (file.post.thread_id if file.post else None)
+        if delta and thread_id:
+            adjust_file_bytes({thread_id: delta})
+        db.session.commit()
+        invalidate_file_views(file)
+        return
+
+    rows = blobs.mark_processed(file.blob, values)
+    db.session.commit()
+    for row in rows:
+        if row.post_id:
+            invalidate_post_fragment(row.post_id)
+    for thread_id in {row.thread_id for row in rows if row.thread_id}:
+        invalidate_thread_cache(thread_id)
+
+
+def thumbnail_path_of(file, file_path, extension=''):
+    """Путь превью: по хешу содержимого или рядом с файлом для старых загрузок."""
+    if file.blob is not None:
+        path = blobs.thumbnail_path_for(file.blob.sha256)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+    return os.path.join(os.path.dirname(file_path), f'thumb_{os.path.basename(file_path)}{extension}')
+
+
+def preview_path_of(file, file_path):
+    """Путь предпросмотра: по хешу содержимого или рядом с файлом для старых загрузок."""
+    if file.blob is not None:
+        return blobs.preview_path_for(file.blob.sha256)
+    return os.path.join(os.path.dirname(file_path), f'preview_{os.path.basename(file_path)}.jpg')
+
+
 @celery.task(bind=True, max_retries=3, default_retry_delay=60)
 def process_image(self, file_path, file_id):
     """Обработка изображения."""
@@ -54,30 +118,21 @@ def process_image(self, file_path, file_id):
         if not file.is_image:
             raise ValueError('File is not an image')
 
-        # Открытие изображения
-        with Image.open(file_path) as img:
-            # Проверка размера
-            if img.size[0] > Config.MAX_IMAGE_SIZE or img.size[1] > Config.MAX_IMAGE_SIZE:
-                # Изменение размера
-                img.thumbnail((Config.MAX_IMAGE_SIZE, Config.MAX_IMAGE_SIZE))
-                img.save(file_path, quality=85, optimize=True)
-                logger.info(f'Image {file_id} resized')
-
-            # Создание превью
-            thumb_path = os.path.join(
-                os.path.dirname(file_path),
-                f'thumb_{os.path.basename(file_path)}'
-            )
-            img.thumbnail((200, 200))
-            img.save(thumb_path, quality=85, optimize=True)
-            logger.info(f'Thumbnail created for {file_id}')
-
-            # Обновление информации о файле
-            file.processed = True
-            file.thumbnail_path = thumb_path
-            file.error = None
-            db.session.commit()
-            logger.info(f'Image {file_id} processed successfully')
+        # Удаление метаданных до обработки: поворот из EXIF применяется к
+        # пикселям, поэтому превью получается с правильной ориентацией
+        mode = exif.strip_metadata(file_path)
+        logger.info(f'Metadata of image {file_id} stripped: {mode}')
+
+        # Оригинал, предпросмотр и превью из одного декодирования
+        result = renditions.render_image(
+            file_path,
+            thumbnail_path_of(file, file_path, '.jpg'),
+            preview_path_of(file, file_path)
+        )
+
+        # Обновление информации о файле
+        finish_processing(file, result.columns())
+        logger.info(f'Image {file_id} processed successfully')
 
     except Exception as e:
         logger.error(f'Error processing image {file_id}: {str(e)}')
@@ -100,10 +155,7 @@ def process_video(self, file_path, file_id):
             raise ValueError('File is not a video')
 
         # Создание превью
-        thumb_path = os.path.join(
-            os.path.dirname(file_path),
-            f'thumb_{os.path.basename(file_path)}.jpg'
-        )
+        thumb_path = thumbnail_path_of(file, file_path, '.jpg')
         cmd = [
             'ffmpeg', '-i', file_path,
             '-ss', '00:00:01',
@@ -114,10 +166,7 @@ def process_video(self, file_path, file_id):
         logger.info(f'Thumbnail created for video {file_id}')
 
         # Обновление информации о файле
-        file.processed = True
-        file.thumbnail_path = thumb_path
-        file.error = None
-        db.session.commit()
+        finish_processing(file, {'thumbnail_path': thumb_path})
         logger.info(f'Video {file_id} processed successfully')
 
     except Exception as e:
@@ -184,4 +233,81 @@ def update_file_stats():
         logger.info('File stats updated successfully')
 
     except Exception as e:
-        logger.error(f'Error updating file stats: {str(e)}') 
\ No newline at end of file
+        logger.error(f'Error updating file stats: {str(e)}')
+
+
+@celery.task
+def rebuild_popular_threads():
+    """Сверка рейтинга популярных тредов с базой данных."""
+    try:
+        count = popularity.rebuild_popular_threads()
+        logger.info(f'Popular threads reconciled: {count}')
+    except Exception as e:
+        logger.error(f'Error reconciling popular threads: {str(e)}')
+
+
+@celery.task
+def reconcile_site_stats():
+    """Сверка статистики сайта с базой данных."""
+    try:
+        stats.reconcile_site_stats()
+    except Exception as e:
+        logger.error(f'Error reconciling site stats: {str(e)}')
+
+
+@celery.task
+def flush_last_seen():
+    """Пакетная запись буфера last_seen в базу данных."""
+    try:
+        stats.flush_last_seen()
+    except Exception as e:
+        logger.error(f'Error flushing last_seen buffer: {str(e)}')
+
+
+@celery.task
+def archive_old_threads():
+    """Пакетная архивация старых тредов в пределах бюджета времени."""
+    try:
+        archive.archive_old_threads(
+            days=Config.ARCHIVE_AFTER_DAYS,
+            max_replies=Config.ARCHIVE_MAX_REPLIES
+        )
+    except Exception as e:
+        logger.error(f'Error archiving old threads: {str(e)}')
+
+
+@celery.task
+def purge_old_threads():
+    """Пакетное удаление старых тредов в пределах бюджета времени."""
+    try:
+        purge.purge_old_threads()
+    except Exception as e:
+        logger.error(f'Error purging old threads: {str(e)}')
+
+
+@celery.task(bind=True, max_retries=3, default_retry_delay=60)
+def remove_files(self, paths):
+    """Параллельное удаление файлов удаленных тредов с диска."""
+    try:
+        purge.remove_files(paths)
+    except Exception as e:
+        logger.error(f'Error removing {len(paths)} files: {str(e)}')
+        raise self.retry(exc=e)
+
+
+@celery.task
+def collect_orphan_blobs():
+    """Удаление файлов хранилища по хешу, на которые не ссылается ни один blob."""
+    try:
+        blobs.collect_orphan_blobs()
+    except Exception as e:
+        logger.error(f'Error collecting orphan blobs: {str(e)}')
+
+
+@celery.task
+def ensure_partitions():
+    """Создание секций posts и files на следующие месяцы."""
+    try:
+        partitions.ensure_partitions()
+    except Exception as e:
+        logger.error(f'Error creating partitions: {str(e)}')
@@ -0,0 +1,309 @@
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional, Tuple
+from flask_caching import Cache
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+import redis
+
+logger = logging.getLogger(__name__)
+
+
+class LocalCache:
+    """
+    Ограниченный по размеру LRU-кэш с TTL в памяти процесса.
+
+    Значения отдаются вызывающему коду как есть, без копирования, поэтому
+    должны рассматриваться как неизменяемые.
+    """
+
+    def __init__(self, max_size: int = 1024, default_ttl: float = 5.0) -> None:
+        """
+        Инициализация кэша.
+
+        Args:
+            max_size: Максимальное количество записей
+            default_ttl: Время жизни записи в секундах
+        """
+        self.max_size = max_size
+        self.default_ttl = default_ttl
+        self._data: 'OrderedDict[str, Tuple[float, Any]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Tuple[bool, Any]:
+        """
+        Получение значения.
+
+        Returns:
+            Tuple[bool, Any]: Признак попадания и значение
+        """
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return False, None
+            expires_at, value = item
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                return False, None
+            self._data.move_to_end(key)
+            return True, value
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        """Сохранение значения с вытеснением самых старых записей."""
+        ttl = self.default_ttl if ttl is None else min(ttl, self.default_ttl)
+        if self.max_size <= 0 or ttl <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        """Удаление значения."""
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        """Полная очистка."""
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class TieredCache(Cache):
+    """
+    Двухуровневый кэш: локальный LRU процесса перед Redis-бэкендом Flask-Caching.
+
+    Каждая запись и удаление публикуются в канал Redis pub/sub, и все
+    остальные воркеры (gunicorn, eventlet, Celery) вычищают ключ из своего
+    локального уровня.
+    """
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.local = LocalCache()
+        self.channel = 'imageboard:cache:invalidate'
+        self.instance_id = uuid.uuid4().hex
+        self._instance_pid = os.getpid()
+        self._redis: Optional[redis.Redis] = None
+        self._subscriber = None
+        self._subscriber_pid: Optional[int] = None
+        self._waiters: Dict[str, threading.Event] = {}
+        self._waiters_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'local': {'hits': 0, 'misses': 0},
+            'redis': {'hits': 0, 'misses': 0},
+        }
+
+    def init_app(self, app: Any, config: Optional[Dict[str, Any]] = None) -> None:
+        """Инициализация бэкенда и локального уровня."""
+        super().init_app(app, config)
+        self.local = LocalCache(
+            max_size=app.config.get('LOCAL_CACHE_MAX_SIZE', 1024),
+            default_ttl=app.config.get('LOCAL_CACHE_TTL', 5)
+        )
+        self.channel = app.config.get('CACHE_INVALIDATION_CHANNEL', self.channel)
+        self._redis = redis.Redis.from_url(
+            app.config['REDIS_URL'],
+            socket_connect_timeout=5,
+            retry_on_timeout=True
+        )
+
+    def _count(self, tier: str, hit: bool) -> None:
+        with self._stats_lock:
+            self._stats[tier]['hits' if hit else 'misses'] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Счетчики попаданий и промахов по уровням.
+
+        Returns:
+            Dict[str, Any]: Статистика уровней и размер локального кэша
+        """
+        with self._stats_lock:
+            stats = {tier: dict(values) for tier, values in self._stats.items()}
+        stats['local']['size'] = len(self.local)
+        stats['local']['max_size'] = self.local.max_size
+        return stats
+
+    def _ensure_subscriber(self) -> None:
+        """
+        Запуск подписчика канала инвалидации в текущем процессе.
+
+        Проверка PID нужна, потому что поток не переживает fork воркеров
+        gunicorn и Celery. Идентификатор экземпляра после fork тоже
+        создается заново: иначе дочерние процессы одного родителя считают
+        сообщения друг друга своими и пропускают их.
+        """
+        if self._redis is None or self._subscriber_pid == os.getpid():
+            return
+        if self._instance_pid != os.getpid():
+            self.instance_id = uuid.uuid4().hex
+            self._instance_pid = os.getpid()
+        try:
+            pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(**{self.channel: self._handle_message})
+            self._subscriber = pubsub.run_in_thread(sleep_time=1, daemon=True)
+            self._subscriber_pid = os.getpid()
+            # Ключи, закэшированные до fork, могли устареть
+            self.local.clear()
+        except redis.RedisError as e:
+            logger.error(f'Error subscribing to cache invalidation channel: {str(e)}')
+
+    def _handle_message(self, message: Dict[str, Any]) -> None:
+        try:
+            payload = json.loads(message['data'])
+        except (TypeError, ValueError):
+            return
+        if payload.get('origin') == self.instance_id:
+            return
+        keys = payload.get('keys')
+        if keys is None:
+            self.local.clear()
+        else:
+            for key in keys:
+                self.local.delete(key)
+            self._wake(keys)
+
+    def _wake(self, keys: Iterable[str]) -> None:
+        with self._waiters_lock:
+            events = [self._waiters.pop(key) for key in keys if key in self._waiters]
+        for event in events:
+            event.set()
+
+    def register_waiter(self, key: str) -> threading.Event:
+        """
+        Регистрация ожидания записи ключа любым процессом.
+
+        Событие срабатывает при записи ключа; пробуждение приходит через тот
+        же канал инвалидации, в который публикуется каждая запись. Запись
+        до регистрации событие не видит, поэтому после регистрации ключ
+        нужно перечитать и только потом ждать.
+
+        Args:
+            key: Ключ кэша
+
+        Returns:
+            threading.Event: Событие записи ключа
+        """
+        self._ensure_subscriber()
+        with self._waiters_lock:
+            return self._waiters.setdefault(key, threading.Event())
+
+    def publish_invalidation(self, keys: Optional[Iterable[str]]) -> None:
+        """
+        Рассылка инвалидации локальных уровней остальных процессов.
+
+        Args:
+            keys: Ключи для удаления или None для полной очистки
+        """
+        if self._redis is None:
+            return
+        # Идентификатор отправителя должен принадлежать текущему процессу
+        self._ensure_subscriber()
+        payload = {
+            'origin': self.instance_id,
+            'keys': list(keys) if keys is not None else None
+        }
+        try:
+            self._redis.publish(self.channel, json.dumps(payload))
+        except redis.RedisError as e:
+            logger.error(f'Error publishing cache invalidation: {str(e)}')
+
+    def get_local(self, key: str) -> Tuple[bool, Any]:
+        """Чтение только из локального уровня."""
+        self._ensure_subscriber()
+        hit, value = self.local.get(key)
+        self._count('local', hit)
+        return hit, value
+
+    def set_local(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        """Запись только в локальный уровень."""
+        self._ensure_subscriber()
+        self.local.set(key, value, ttl=ttl)
+
+    def invalidate_local(self, *keys: str) -> None:
+        """Удаление ключей только из локальных уровней всех процессов."""
+        for key in keys:
+            self.local.delete(key)
+        self.publish_invalidation(keys)
+
+    def get(self, key: str) -> Any:
+        self._ensure_subscriber()
+        hit, value = self.local.get(key)
+        self._count('local', hit)
+        if hit:
+            return value
+        value = super().get(key)
+        self._count('redis', value is not None)
+        if value is not None:
+            self.local.set(key, value)
+        return value
+
+    def get_many(self, *keys: str) -> list:
+        self._ensure_subscriber()
+        values = []
+        missing = []
+        for index, key in enumerate(keys):
+            hit, value = self.local.get(key)
+            self._count('local', hit)
+            values.append(value)
+            if not hit:
+                missing.append(index)
+        if missing:
+            fetched = super().get_many(*[keys[index] for index in missing])
+            for index, value in zip(missing, fetched):
+                self._count('redis', value is not None)
+                if value is not None:
+                    self.local.set(keys[index], value)
+                values[index] = value
+        return values
+
+    def set(self, key: str, value: Any, timeout: Optional[int] = None) -> Optional[bool]:
+        self._ensure_subscriber()
+        result = super().set(key, value, timeout=timeout)
+        self.local.set(key, value, ttl=timeout or None)
+        self.publish_invalidation([key])
+        self._wake([key])
+        return result
+
+    def add(self, key: str, value: Any, timeout: Optional[int] = None) -> bool:
+        result = super().add(key, value, timeout=timeout)
+        if result:
+            self.local.delete(key)
+            self.publish_invalidation([key])
+        return result
+
+    def set_many(self, mapping: Dict[str, Any], timeout: Optional[int] = None) -> list:
+        result = super().set_many(mapping, timeout=timeout)
+        for key, value in mapping.items():
+            self.local.set(key, value, ttl=timeout or None)
+        self.publish_invalidation(mapping.keys())
+        return result
+
+    def delete(self, key: str) -> bool:
+        result = super().delete(key)
+        self.local.delete(key)
+        self.publish_invalidation([key])
+        return result
+
+    def delete_many(self, *keys: str) -> list:
+        result = super().delete_many(*keys)
+        for key in keys:
+            self.local.delete(key)
+        self.publish_invalidation(keys)
+        return result
+
+    def clear(self) -> bool:
+        result = super().clear()
+        self.local.clear()
+        self.publish_invalidation(None)
+        return result
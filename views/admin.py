@@ -2,6 +2,7 @@ from flask import Blueprint, render_template, request, redirect, url_for, flash
 from flask_login import login_required, current_user
 from models import db, Board, Thread, Post, File, User, Ban, Report
 from datetime import datetime, timedelta
+from utils.cache import invalidate_board_cache
 
 admin = Blueprint('admin', __name__)
 
@@ -40,6 +41,7 @@ def new_board():
         )
         db.session.add(board)
         db.session.commit()
+        invalidate_board_cache(board.id)
         flash('Доска создана')
         return redirect(url_for('admin.boards'))
     
@@ -62,6 +64,7 @@ def edit_board(board_id):
         board.max_threads = int(request.form['max_threads'])
         board.max_posts_per_thread = int(request.form['max_posts_per_thread'])
         db.session.commit()
+        invalidate_board_cache(board.id)
         flash('Доска обновлена')
         return redirect(url_for('admin.boards'))
     
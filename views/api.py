@@ -1,15 +1,21 @@
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, jsonify, request, url_for
 from models import db, Board, Thread, Post, File
-from datetime import datetime
 import os
 from werkzeug.utils import secure_filename
 from flask import current_app
 from sqlalchemy import desc
 from utils import generate_tripcode
+from utils.http_cache import conditional, thread_last_modified
+from utils.db_routing import replica_reads
+from utils.cache import get_thread_page
+from utils.backlinks import get_backlinks
+from utils.pagination import THREAD_SORT_KEYS, keyset_paginate
 
 api = Blueprint('api', __name__)
 
 @api.route('/api/boards')
+@replica_reads
+@conditional(lambda: ('threads',), weak=False)
 def get_boards():
     """Получить список всех досок."""
     boards = Board.query.all()
@@ -18,10 +24,14 @@ def get_boards():
         'name': board.name,
         'description': board.description,
         'is_nsfw': board.is_nsfw,
-        'thread_count': Thread.query.filter_by(board_id=board.id).count()
+        'thread_count': board.thread_count,
+        'post_count': board.post_count,
+        'file_count': board.file_count
     } for board in boards])
 
 @api.route('/api/board/<int:board_id>')
+@replica_reads
+@conditional(lambda board_id: (f'board:{board_id}', 'threads'), weak=False)
 def get_board(board_id):
     """Получить информацию о доске."""
     board = Board.query.get_or_404(board_id)
@@ -30,26 +40,32 @@ def get_board(board_id):
         'name': board.name,
         'description': board.description,
         'is_nsfw': board.is_nsfw,
-        'thread_count': Thread.query.filter_by(board_id=board.id).count()
+        'thread_count': board.thread_count,
+        'post_count': board.post_count,
+        'file_count': board.file_count,
+        'file_bytes': board.file_bytes
     })
 
 @api.route('/api/board/<int:board_id>/threads')
+@replica_reads
+@conditional(lambda board_id: (f'board:{board_id}', 'threads'), weak=False)
 def get_board_threads(board_id):
     """Получить список тредов на доске."""
-    page = request.args.get('page', 1, type=int)
     per_page = request.args.get('per_page', 20, type=int)
     sort = request.args.get('sort', 'activity')
-    
-    query = Thread.query.filter_by(board_id=board_id)
-    
-    if sort == 'date':
-        query = query.order_by(Thread.created_at.desc())
-    elif sort == 'replies':
-        query = query.order_by(Thread.reply_count.desc())
-    else:  # activity
-        query = query.order_by(Thread.last_reply_at.desc())
-    
-    threads = query.paginate(page=page, per_page=per_page)
+    if sort not in THREAD_SORT_KEYS:
+        sort = 'activity'
+    
+    query = Thread.query.filter_by(board_id=board_id, is_archived=False)
+    
+    threads = keyset_paginate(
+        query,
+        THREAD_SORT_KEYS[sort],
+        per_page,
+        after=request.args.get('after'),
+        before=request.args.get('before'),
+        with_total=request.args.get('count', 0, type=int) == 1
+    )
     
     return jsonify({
         'threads': [{
@@ -62,11 +78,13 @@ def get_board_threads(board_id):
             'last_reply_at': thread.last_reply_at.isoformat() if thread.last_reply_at else None
         } for thread in threads.items],
         'total': threads.total,
-        'pages': threads.pages,
-        'current_page': threads.page
+        'next_cursor': threads.next_cursor,
+        'prev_cursor': threads.prev_cursor
     })
 
 @api.route('/api/thread/<int:thread_id>')
+@replica_reads
+@conditional(lambda thread_id: (f'thread:{thread_id}',), last_modified=thread_last_modified, weak=False)
 def get_thread(thread_id):
     """Получить информацию о треде."""
     thread = Thread.query.get_or_404(thread_id)
@@ -82,21 +100,29 @@ def get_thread(thread_id):
     })
 
 @api.route('/api/thread/<int:thread_id>/posts')
+@replica_reads
+@conditional(lambda thread_id: (f'thread:{thread_id}',), last_modified=thread_last_modified, weak=False)
 def get_thread_posts(thread_id):
     """Получить список сообщений в треде."""
-    page = request.args.get('page', 1, type=int)
     per_page = request.args.get('per_page', 20, type=int)
     
-    posts = Post.query.filter_by(thread_id=thread_id)\
-        .order_by(Post.created_at.asc())\
-        .paginate(page=page, per_page=per_page)
+    posts = get_thread_page(
+        thread_id,
+        after=request.args.get('after'),
+        before=request.args.get('before'),
+        per_page=per_page,
+        with_total=request.args.get('count', 0, type=int) == 1
+    )
+    backlinks = get_backlinks(thread_id)
     
     return jsonify({
         'posts': [{
             'id': post.id,
             'content': post.content,
             'name': post.name,
+            'author': post.author,
             'created_at': post.created_at.isoformat(),
+            'backlinks': [source_id for source_id, _ in backlinks.get(post.id, [])],
             'files': [{
                 'filename': file.filename,
                 'original_name': file.original_name,
@@ -108,14 +134,14 @@ def get_thread_posts(thread_id):
             } for file in post.files]
         } for post in posts.items],
         'total': posts.total,
-        'pages': posts.pages,
-        'current_page': posts.page
+        'next_cursor': posts.next_cursor,
+        'prev_cursor': posts.prev_cursor
     })
 
 @api.route('/api/thread/<int:thread_id>/posts', methods=['POST'])
 def create_post(thread_id):
     """Создать новое сообщение в треде."""
-    thread = Thread.query.get_or_404(thread_id)
+    Thread.query.get_or_404(thread_id)
     
     data = request.get_json()
     if not data:
@@ -138,9 +164,7 @@ def create_post(thread_id):
     )
     
     # TODO: Добавить обработку файлов
-    
-    thread.reply_count += 1
-    thread.last_reply_at = datetime.utcnow()
+    # Счетчики треда и доски обновляются обработчиками событий моделей
     
     return jsonify({
         'id': post.id,
@@ -189,6 +213,8 @@ def create_thread():
     }), 201
 
 @api.route('/post/<int:post_id>/preview')
+@replica_reads
+@conditional(lambda post_id: (f'post:{post_id}',), weak=False)
 def post_preview(post_id):
     post = Post.query.get_or_404(post_id)
     
@@ -202,7 +228,7 @@ def post_preview(post_id):
             file_data = {
                 'name': file.original_name,
                 'url': f'/static/uploads/{file.filename}',
-                'thumbnail_url': f'/static/uploads/thumbnails/{file.thumbnail}',
+                'thumbnail_url': url_for('main.rendition', kind='thumbnails', name=file.thumbnail) if file.thumbnail else None,
                 'is_video': file.is_video,
                 'type': file.filename.split('.')[-1]
             }
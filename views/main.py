@@ -1,7 +1,7 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash, send_file, current_app, jsonify, g, abort, session
 from flask_login import login_required, current_user
-from models import db, Board, Thread, Post, File, User
-from werkzeug.utils import secure_filename
+from models import db, Board, Thread, Post, User
+from werkzeug.utils import safe_join, secure_filename
 import os
 from datetime import datetime
 from forms import PostForm, SearchForm, ThreadForm
@@ -13,11 +13,20 @@ from utils.achievements import check_achievements
 from app import limiter
 import magic
 from celery import Celery
-from utils.cache import get_popular_threads, get_thread_from_cache, invalidate_thread_cache
+from utils.cache import get_thread_from_cache, get_thread_page, invalidate_thread_cache
+from utils.popularity import get_popular_threads
+from utils.render_cache import render_cached, render_post_fragments, invalidate_post_fragment
+from utils.backlinks import get_backlinks
+from utils.blobs import store_upload
+from utils.ingest import UploadRejected
+from utils.renditions import negotiate
+from utils.http_cache import conditional, thread_last_modified
+from utils.db_routing import replica_reads
+from utils.pagination import THREAD_SORT_KEYS, keyset_paginate
 from utils.tasks import process_image, process_video
 from utils.backup import create_backup, restore_backup, delete_backup, list_backups
 from utils.socket import (
-    notify_new_post, notify_new_reply, notify_thread_locked,
+    notify_new_post, notify_thread_locked,
     notify_thread_unlocked, notify_post_deleted, notify_achievement
 )
 from utils.decorators import admin_required
@@ -27,6 +36,7 @@ main = Blueprint('main', __name__)
 logger = logging.getLogger(__name__)
 
 @main.route('/')
+@replica_reads
 def index():
     """Главная страница с популярными тредами."""
     try:
@@ -52,35 +62,42 @@ def index():
         return render_template('index.html', threads=[], boards=empty_pagination)
 
 @main.route('/board/<string:board_id>')
+@replica_reads
+@conditional(lambda board_id: (f'board:{board_id}', 'threads'), public=False)
+@render_cached('board', lambda board_id: (f'board:{board_id}', 'threads'))
 def board(board_id):
-    page = request.args.get('page', 1, type=int)
     sort = request.args.get('sort', 'date')
+    if sort not in THREAD_SORT_KEYS:
+        sort = 'date'
     board = Board.query.get_or_404(board_id)
     
-    # Базовый запрос
-    query = Thread.query.filter_by(board_id=board_id)
+    # Базовый запрос: архивные треды показываются только в архиве
+    query = Thread.query.filter_by(board_id=board_id, is_archived=False)
     
-    # Применяем сортировку
-    if sort == 'activity':
-        # Сортировка по последнему обновлению
-        query = query.order_by(Thread.is_sticky.desc(), Thread.last_updated.desc())
-    elif sort == 'replies':
-        # Сортировка по количеству ответов
-        query = query.order_by(Thread.is_sticky.desc(), Thread.post_count.desc())
-    else:  # sort == 'date'
-        # Сортировка по дате создания
-        query = query.order_by(Thread.is_sticky.desc(), Thread.created_at.desc())
-    
-    # Применяем пагинацию
-    threads = query.paginate(page=page, per_page=current_app.config['THREADS_PER_PAGE'])
+    # Курсорная пагинация: закрепленные треды сверху, затем по выбранному полю
+    threads = keyset_paginate(
+        query,
+        THREAD_SORT_KEYS[sort],
+        current_app.config['THREADS_PER_PAGE'],
+        after=request.args.get('after'),
+        before=request.args.get('before')
+    )
     
     return render_template('board.html', board=board, threads=threads)
 
 @main.route('/<board_name>/thread/<int:thread_id>', methods=['GET', 'POST'])
+@replica_reads
 @limiter.limit("5 per minute", methods=["POST"])
+@conditional(lambda board_name, thread_id: (f'thread:{thread_id}',),
+             last_modified=lambda board_name, thread_id: thread_last_modified(thread_id),
+             public=False)
+@render_cached('thread', lambda board_name, thread_id: (f'thread:{thread_id}',))
 def thread(board_name, thread_id):
-    board = Board.query.filter_by(name=board_name).first_or_404()
-    thread = get_thread_from_cache(thread_id)
+    snapshot = get_thread_from_cache(thread_id)
+    if snapshot.board.name != board_name:
+        abort(404)
+    board = snapshot.board
+    thread = snapshot.thread
     form = PostForm()
     
     if form.validate_on_submit():
@@ -93,6 +110,9 @@ def thread(board_name, thread_id):
         db.session.add(post)
         db.session.commit()
         
+        # Инвалидируем кэш
+        invalidate_thread_cache(thread_id, board_id=board.id)
+        
         # Проверяем достижения
         achievements = check_achievements(request.cookies)
         if achievements:
@@ -104,18 +124,23 @@ def thread(board_name, thread_id):
                     max_age=31536000  # 1 год
                 )
             return response
-            
-        # Инвалидируем кэш
-        invalidate_thread_cache(thread_id)
         
         return redirect(url_for('main.thread', board_name=board_name, thread_id=thread_id))
     
-    page = request.args.get('page', 1, type=int)
-    posts = Post.query.filter_by(thread_id=thread_id).order_by(Post.created_at.asc()).paginate(
-        page=page, per_page=current_app.config['POSTS_PER_PAGE']
-    )
+    after = request.args.get('after')
+    before = request.args.get('before')
+    if not after and not before:
+        # Первая страница целиком берется из снимка треда
+        posts = snapshot.first_page()
+    else:
+        posts = get_thread_page(thread_id, after=after, before=before)
     
-    return render_template('thread.html', board=board, thread=thread, posts=posts, form=form)
+    # Ответы на все посты страницы берутся из одной карты треда
+    backlinks = get_backlinks(thread_id)
+    post_fragments = render_post_fragments(posts.items, thread, backlinks)
+    
+    return render_template('thread.html', board=board, thread=thread, posts=posts, form=form,
+                           post_fragments=post_fragments, backlinks=backlinks)
 
 @main.route('/<board_name>/new_thread', methods=['GET', 'POST'])
 @limiter.limit("2 per minute", methods=["POST"])
@@ -143,7 +168,7 @@ def new_thread(board_name):
         check_achievements(current_user)
         
         # Инвалидируем кэш
-        invalidate_thread_cache()
+        invalidate_thread_cache(thread.id, board_id=board.id)
         
         return redirect(url_for('main.thread', board_name=board_name, thread_id=thread.id))
     
@@ -154,9 +179,7 @@ def new_thread(board_name):
 def reply(thread_id):
     """Ответ в треде."""
     try:
-        thread = get_thread_from_cache(thread_id)
-        if not thread:
-            abort(404)
+        thread = Thread.query.get_or_404(thread_id)
         
         if thread.is_locked and not current_user.is_admin:
             flash('Тред заблокирован', 'error')
@@ -167,54 +190,49 @@ def reply(thread_id):
             post = Post(
                 content=form.content.data,
                 thread=thread,
-                user=current_user
+                user=current_user.user
             )
             
-            # Обработка файла
+            # Обработка файла: содержимое хранится по хешу, повторная
+            # загрузка ссылается на уже обработанный blob с его превью
+            new_file = None
             if form.file.data:
-                file = File(
-                    filename=form.file.data.filename,
-                    user=current_user
-                )
+                file, created = store_upload(form.file.data, thread_id=thread.id)
                 post.files.append(file)
-                
-                # Сохраняем файл
-                file_path = os.path.join(
-                    current_app.config['UPLOAD_FOLDER'],
-                    file.filename
-                )
-                form.file.data.save(file_path)
-                
-                # Определяем тип файла и запускаем обработку
-                mime_type = form.file.data.content_type
-                if mime_type.startswith('image/'):
-                    process_image.delay(file_path, file.id)
-                elif mime_type.startswith('video/'):
-                    process_video.delay(file_path, file.id)
+                if created:
+                    new_file = file
             
             # Сохраняем пост
             thread.posts.append(post)
             thread.save()
             
+            # Обработка запускается после коммита, когда у файла есть ID
+            if new_file is not None:
+                if new_file.mime_type.startswith('image/'):
+                    process_image.delay(new_file.file_path, new_file.id)
+                elif new_file.mime_type.startswith('video/'):
+                    process_video.delay(new_file.file_path, new_file.id)
+            
             # Проверяем достижения
             achievements = check_achievements(current_user)
             for achievement in achievements:
                 notify_achievement(current_user, achievement)
             
-            # Отправляем уведомления
+            # Отправляем уведомления; авторов процитированных постов
+            # уведомляет граф цитирования после коммита
             notify_new_post(thread_id, post)
-            if form.reply_to.data:
-                reply_to = Post.query.get(form.reply_to.data)
-                if reply_to:
-                    notify_new_reply(thread_id, post, reply_to)
             
             # Инвалидируем кэш
-            invalidate_thread_cache(thread_id)
+            invalidate_thread_cache(thread_id, board_id=thread.board_id)
             
             flash('Ответ добавлен', 'success')
             return redirect(url_for('main.thread', thread_id=thread_id))
         
         return render_template('thread.html', thread=thread, form=form)
+    except UploadRejected as e:
+        db.session.rollback()
+        flash(str(e), 'error')
+        return redirect(url_for('main.thread', thread_id=thread_id))
     except Exception as e:
         logger.error(f"Error posting reply in thread {thread_id}: {str(e)}")
         flash('Ошибка при добавлении ответа', 'error')
@@ -226,9 +244,7 @@ def reply(thread_id):
 def lock_thread(thread_id):
     """Блокировка треда."""
     try:
-        thread = get_thread_from_cache(thread_id)
-        if not thread:
-            abort(404)
+        thread = Thread.query.get_or_404(thread_id)
         
         thread.is_locked = True
         thread.save()
@@ -237,7 +253,7 @@ def lock_thread(thread_id):
         notify_thread_locked(thread_id, current_user)
         
         # Инвалидируем кэш
-        invalidate_thread_cache(thread_id)
+        invalidate_thread_cache(thread_id, board_id=thread.board_id)
         
         flash('Тред заблокирован', 'success')
         return redirect(url_for('main.thread', thread_id=thread_id))
@@ -252,9 +268,7 @@ def lock_thread(thread_id):
 def unlock_thread(thread_id):
     """Разблокировка треда."""
     try:
-        thread = get_thread_from_cache(thread_id)
-        if not thread:
-            abort(404)
+        thread = Thread.query.get_or_404(thread_id)
         
         thread.is_locked = False
         thread.save()
@@ -263,7 +277,7 @@ def unlock_thread(thread_id):
         notify_thread_unlocked(thread_id, current_user)
         
         # Инвалидируем кэш
-        invalidate_thread_cache(thread_id)
+        invalidate_thread_cache(thread_id, board_id=thread.board_id)
         
         flash('Тред разблокирован', 'success')
         return redirect(url_for('main.thread', thread_id=thread_id))
@@ -279,6 +293,7 @@ def delete_post(post_id):
     try:
         post = Post.query.get_or_404(post_id)
         thread_id = post.thread_id
+        board_id = post.thread.board_id
         
         if not (current_user.is_admin or post.user_id == current_user.id):
             abort(403)
@@ -290,7 +305,8 @@ def delete_post(post_id):
         post.delete()
         
         # Инвалидируем кэш
-        invalidate_thread_cache(thread_id)
+        invalidate_thread_cache(thread_id, board_id=board_id)
+        invalidate_post_fragment(post_id)
         
         flash('Пост удален', 'success')
         return redirect(url_for('main.thread', thread_id=thread_id))
@@ -304,6 +320,7 @@ def captcha():
     return send_file(generate_captcha(), mimetype='image/png')
 
 @main.route('/search', methods=['GET'])
+@replica_reads
 def search():
     form = SearchForm()
     
@@ -393,6 +410,8 @@ def search():
     return render_template('search.html', form=form)
 
 @main.route('/board/<int:board_id>/rss')
+@replica_reads
+@conditional(lambda board_id: (f'board:{board_id}', 'threads'))
 def board_rss(board_id):
     """RSS-лента для доски."""
     board = Board.query.get_or_404(board_id)
@@ -404,6 +423,9 @@ def board_rss(board_id):
     )
 
 @main.route('/board/<int:board_id>/thread/<int:thread_id>/rss')
+@replica_reads
+@conditional(lambda board_id, thread_id: (f'thread:{thread_id}',),
+             last_modified=lambda board_id, thread_id: thread_last_modified(thread_id))
 def thread_rss(board_id, thread_id):
     """RSS-лента для треда."""
     thread = Thread.query.filter_by(
@@ -418,11 +440,24 @@ def thread_rss(board_id, thread_id):
         download_name=f'thread_{thread_id}.xml'
     )
 
+@main.route('/media/<any(thumbnails, previews):kind>/<path:name>')
+def rendition(kind, name):
+    """Превью или предпросмотр в лучшем формате из принимаемых клиентом."""
+    directory = os.path.abspath(os.path.join(current_app.config['UPLOAD_FOLDER'], kind))
+    path = safe_join(directory, name)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    path, mimetype = negotiate(path, request.accept_mimetypes)
+    response = send_file(path, mimetype=mimetype, max_age=current_app.config['RENDITION_MAX_AGE'])
+    # Тело зависит от Accept: общие кэши должны хранить варианты отдельно
+    response.vary.add('Accept')
+    return response
+
 @main.route('/archive')
+@replica_reads
 def archive():
     """Страница архивных тредов."""
     board_id = request.args.get('board', type=int)
-    page = request.args.get('page', 1, type=int)
     
     board = None
     if board_id:
@@ -430,8 +465,9 @@ def archive():
     
     threads = get_archived_threads(
         board_id=board_id,
-        page=page,
-        per_page=20
+        per_page=20,
+        after=request.args.get('after'),
+        before=request.args.get('before')
     )
     
     boards = Board.query.all()
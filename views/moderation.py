@@ -1,7 +1,10 @@
 from flask import Blueprint, render_template, redirect, url_for, flash, request
 from flask_login import login_required, current_user
-from models import db, Report, Ban, Thread, Post
+from models import db, Report, Ban, Post
 from datetime import datetime, timedelta
+from utils.cache import invalidate_thread_cache
+from utils.render_cache import invalidate_post_fragment
+from utils.purge import purge_threads
 
 bp = Blueprint('moderation', __name__, url_prefix='/admin/mod')
 
@@ -33,17 +36,17 @@ def dashboard():
 def delete_post(post_id):
     post = Post.query.get_or_404(post_id)
     thread_id = post.thread_id
+    board_id = post.thread.board_id
 
     db.session.delete(post)
     db.session.commit()
+    invalidate_thread_cache(thread_id, board_id=board_id)
+    invalidate_post_fragment(post_id)
 
     # Проверка, остались ли посты в теме
     remaining_posts = Post.query.filter_by(thread_id=thread_id).count()
     if remaining_posts == 0:
-        thread = Thread.query.get(thread_id)
-        if thread:
-            db.session.delete(thread)
-            db.session.commit()
+        if purge_threads([thread_id])['threads']:
             flash(f'Пост №{post_id} и пустая тема №{thread_id} удалены.', 'success')
         else:
             flash(f'Пост №{post_id} удалён. (Тема не найдена)', 'success')